@@ -5,6 +5,8 @@ import hashlib
 import hmac
 import json
 import sys
+import threading
+import time
 import traceback
 
 import click
@@ -12,14 +14,114 @@ import dotenv
 import flask
 import waitress
 
+from .collaborators import collaborators, keep_prefetched
 from .config import Config, InvalidTokenException
-from .newpr import HighfiveHandler, UnsupportedRepoError
+from .contributors import build_index
+from .deadline import default_deadline
+from .deliveries import DeliveryLog
+from .diff import default_spool_size
+from .jobs import JobQueue
+from .newpr import AsyncHighfiveHandler, UnsupportedRepoError
 from .payload import Payload
+from .registry import ConfigWatcher
+from .stats import stats
+from .worker import QueueFull, WorkerPool
 
 
-def create_app(config, webhook_secrets=None, config_dir=None):
+def print_webhook(config_generation, event, delivery, payload):
+    print()
+    print('An exception occured while processing a webhook!')
+    print('Time:', datetime.datetime.now())
+    print('Delivery ID:', delivery)
+    print('Event name:', event)
+    print('Config generation:', config_generation)
+    print('Payload:', json.dumps(payload))
+
+
+def handle_webhook(config, registry, event, delivery, payload,
+                   deliveries=None):
+    """Handle a webhook on a worker. The details of the webhook are printed
+    if it fails, before the worker reports the exception. The failed
+    delivery is removed from `deliveries`, so that it can be sent again."""
+    try:
+        handler = AsyncHighfiveHandler(Payload(payload), config, registry)
+        handler.run(event)
+    except Exception:
+        print_webhook(registry.generation, event, delivery, payload)
+        if deliveries is not None:
+            deliveries.forget(delivery)
+        raise
+
+
+def lane_key(payload):
+    """Return the key of the PR (or issue) an event is about, so that the
+    events of a PR are handled in order, or None."""
+    number = payload.get('number')
+    if number is None:
+        number = (payload.get('issue') or {}).get('number')
+    if number is None:
+        return None
+    return (payload['repository']['full_name'], number)
+
+
+def run_job(config, watcher, jobs, delivery=None, deliveries=None):
+    """Claim a job from the durable queue (the given `delivery` if any) and
+    handle it. Returns False if there was no job to claim. A failed job is
+    removed from `deliveries`, so that it is handled if it is sent again."""
+    job = jobs.claim(delivery)
+    if job is None:
+        return False
+    try:
+        handle_webhook(
+            config, watcher.registry, job.event, job.delivery, job.payload,
+            deliveries,
+        )
+    except Exception:
+        jobs.fail(job.delivery, traceback.format_exc())
+        raise
+    jobs.complete(job.delivery)
+    return True
+
+
+def watch_jobs(pool, config, watcher, jobs, deliveries, started,
+               interval=30):
+    """Queue a worker job for every delivery of the durable queue nobody is
+    handling: the ones whose lease expired, and the ones left pending by a
+    previous run (before `started`). They are queued in the lane of their
+    PR, like the webhooks received."""
+    submitted = set()
+    while True:
+        try:
+            recoverable = jobs.recoverable(started)
+            # A job is claimed again with one more attempt: forget the ones
+            # which aren't waiting anymore.
+            submitted &= {job[:2] for job in recoverable}
+            for delivery, attempts, payload in recoverable:
+                if (delivery, attempts) in submitted:
+                    continue
+                pool.submit(
+                    run_job, config, watcher, jobs, delivery, deliveries,
+                    key=lane_key(payload),
+                )
+                submitted.add((delivery, attempts))
+        except QueueFull:
+            pass
+        except Exception:
+            print(traceback.format_exc())
+        time.sleep(interval)
+
+
+def create_app(config, webhook_secrets=None, config_dir=None, watcher=None,
+               pool=None, jobs=None, deliveries=None):
     if webhook_secrets is None:
         webhook_secrets = []
+    if deliveries is None:
+        deliveries = DeliveryLog()
+    if watcher is None:
+        watcher = ConfigWatcher(config_dir)
+    if pool is None:
+        pool = WorkerPool()
+        pool.start()
 
     app = flask.Flask(__name__)
 
@@ -53,18 +155,52 @@ def create_app(config, webhook_secrets=None, config_dir=None):
             payload = json.loads(flask.request.form['payload'])
         except (KeyError, ValueError):
             return 'Error: missing or invalid payload\n', 400
+        # Use the same configuration snapshot for the whole delivery, even if
+        # the configuration is reloaded in the meantime.
+        registry = watcher.registry
         try:
-            handler = HighfiveHandler(Payload(payload), config, config_dir)
-            return handler.run(event)
+            # Reject unconfigured repositories before doing any work.
+            registry.repo_config(payload['repository']['full_name'])
+            if event == 'ping':
+                handler = AsyncHighfiveHandler(
+                    Payload(payload), config, registry
+                )
+                return handler.run(event)
+            # Skip the deliveries sent again, which would e.g. post the
+            # welcome message twice.
+            if not deliveries.record(delivery):
+                return 'OK: duplicate delivery, skipped\n'
+            # Answer GitHub before handling the event, which may take longer
+            # than the delivery timeout.
+            key = lane_key(payload)
+            if jobs is not None:
+                # The delivery is on disk before it is acknowledged, and
+                # survives a restart.
+                jobs.put(delivery, event, payload)
+                try:
+                    pool.submit(
+                        run_job, config, watcher, jobs, delivery, deliveries,
+                        key=key,
+                    )
+                except QueueFull:
+                    # Nothing would handle it before the next restart, and
+                    # GitHub is told to send it again.
+                    jobs.remove(delivery)
+                    raise
+            else:
+                pool.submit(
+                    handle_webhook, config, registry, event, delivery, payload,
+                    deliveries, key=key,
+                )
+            return 'Accepted\n', 202
         except UnsupportedRepoError:
             return 'Error: this repository is not configured!\n', 400
+        except QueueFull:
+            deliveries.forget(delivery)
+            return 'Error: too many webhooks are pending\n', 503
         except:
-            print()
-            print('An exception occured while processing a webhook!')
-            print('Time:', datetime.datetime.now())
-            print('Delivery ID:', delivery)
-            print('Event name:', event)
-            print('Payload:', json.dumps(payload))
+            deliveries.forget(delivery)
+            print_webhook(registry.generation, event, delivery, payload)
             print(traceback.format_exc())
             return 'Internal server error\n', 500
 
@@ -72,26 +208,123 @@ def create_app(config, webhook_secrets=None, config_dir=None):
     def index():
         return 'Welcome to highfive!\n'
 
+    @app.route('/stats')
+    def get_stats():
+        return flask.jsonify(stats.snapshot())
+
     return app
 
 
-@click.command()
+@click.group(invoke_without_command=True)
 @click.option('--port', default=8000)
 @click.option('--github-token', required=True)
 @click.option("webhook_secrets", "--webhook-secret", multiple=True)
 @click.option("--config-dir")
-def cli(port, github_token, webhook_secrets, config_dir):
+@click.option("--config-reload-interval", default=30)
+@click.option("--diff-spool-size", default=default_spool_size)
+@click.option("--webhook-deadline", default=default_deadline)
+@click.option("--prefetch-collaborators", is_flag=True)
+@click.option("--contributors-db")
+@click.option("--index-contributors", is_flag=True)
+@click.option("--workers", default=4)
+@click.option("--max-queue", default=100)
+@click.option("--job-db")
+@click.option("--delivery-db")
+@click.pass_context
+def cli(ctx, port, github_token, webhook_secrets, config_dir,
+        config_reload_interval, diff_spool_size, webhook_deadline,
+        prefetch_collaborators, contributors_db, index_contributors, workers,
+        max_queue, job_db, delivery_db):
     try:
-        config = Config(github_token)
+        config = Config(
+            github_token, diff_spool_size, webhook_deadline, contributors_db
+        )
     except InvalidTokenException:
         print('error: invalid github token provided!')
         sys.exit(1)
     print('Found a valid GitHub token for user @' + config.github_username)
 
-    app = create_app(config, webhook_secrets, config_dir)
+    watcher = ConfigWatcher(config_dir, config_reload_interval)
+    print('Loaded the configuration of %d repositories' % len(watcher.registry))
+    jobs = JobQueue(job_db) if job_db else None
+    deliveries = DeliveryLog(delivery_db)
+
+    if ctx.invoked_subcommand is not None:
+        ctx.obj = (config, watcher, jobs, deliveries)
+        return
+
+    watcher.start()
+
+    if prefetch_collaborators:
+        # Webhooks are served meanwhile, checking collaborators on demand.
+        # The configuration may be reloaded with other repositories.
+        threading.Thread(
+            target=keep_prefetched, name='collaborators-prefetch',
+            daemon=True,
+            args=(collaborators, github_token,
+                  lambda: list(watcher.registry)),
+        ).start()
+
+    if index_contributors and config.contributor_index is not None:
+        # The repositories indexed by a previous run are kept up to date by
+        # the merged PRs, and are not indexed again.
+        threading.Thread(
+            target=build_index, name='contributors-index', daemon=True,
+            args=(config.contributor_index, github_token,
+                  list(watcher.registry)),
+        ).start()
+
+    pool = WorkerPool(workers, max_queue)
+    pool.start()
+
+    if jobs is not None:
+        threading.Thread(
+            target=watch_jobs, name='jobs-watcher', daemon=True,
+            args=(pool, config, watcher, jobs, deliveries, jobs.clock()),
+        ).start()
+
+    app = create_app(
+        config, webhook_secrets, watcher=watcher, pool=pool, jobs=jobs,
+        deliveries=deliveries,
+    )
     waitress.serve(app, port=port)
 
 
+@cli.command()
+@click.argument('deliveries', nargs=-1)
+@click.pass_obj
+def replay(obj, deliveries):
+    """Handle failed or dead deliveries of the job queue again, or list
+    them if no delivery ID is given."""
+    config, watcher, jobs, delivery_log = obj
+    if jobs is None:
+        print('error: the job queue is not configured (see --job-db)')
+        sys.exit(1)
+
+    if not deliveries:
+        for delivery, event, state, error in jobs.unfinished():
+            error = error.strip().splitlines()[-1] if error else ''
+            print('%s\t%s\t%s\t%s' % (delivery, event, state, error))
+        return
+
+    failed = False
+    for delivery in deliveries:
+        try:
+            if not run_job(config, watcher, jobs, delivery, delivery_log):
+                print('error: delivery %s is not in the queue, or is being '
+                      'handled' % delivery)
+                failed = True
+                continue
+        except Exception:
+            print('error: delivery %s failed again' % delivery)
+            print(traceback.format_exc())
+            failed = True
+            continue
+        print('Handled delivery %s' % delivery)
+    if failed:
+        sys.exit(1)
+
+
 def main():
     dotenv.load_dotenv()
     cli(auto_envvar_prefix='HIGHFIVE')
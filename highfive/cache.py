@@ -0,0 +1,84 @@
+import collections
+import threading
+
+from .stats import stats
+
+
+class CachedResponse(object):
+    """The parts of a response needed to serve it again."""
+    __slots__ = ('status', 'reason', 'headers', 'content', 'validators')
+
+    def __init__(self, status, reason, headers, content, validators):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+        # The conditional request headers revalidating the response.
+        self.validators = validators
+
+    @property
+    def size(self):
+        return len(self.content) + sum(
+            len(k) + len(v) for (k, v) in self.headers.items()
+        )
+
+
+class ResponseCache(object):
+    """A thread-safe LRU cache of GET responses, which are revalidated with
+    `If-None-Match`/`If-Modified-Since` instead of being downloaded again.
+
+    The cache holds at most `max_entries` responses and `max_bytes` bytes of
+    response bodies and headers, evicting the least recently used responses
+    first. Responses larger than `max_bytes` are not cached.
+    """
+    def __init__(self, max_entries=1000, max_bytes=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+
+    @staticmethod
+    def validators(response):
+        """Return the conditional request headers for a response, or None if
+        the response can't be revalidated."""
+        result = {}
+        if 'ETag' in response.headers:
+            result['If-None-Match'] = response.headers['ETag']
+        if 'Last-Modified' in response.headers:
+            result['If-Modified-Since'] = response.headers['Last-Modified']
+        return result or None
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        size = entry.size
+        with self._lock:
+            self._remove(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = entry
+            self._bytes += size
+            while len(self._entries) > self.max_entries or \
+                    self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                stats.incr('http.cache.evictions')
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    @property
+    def bytes(self):
+        with self._lock:
+            return self._bytes
@@ -0,0 +1,230 @@
+import http.cookiejar
+import io
+import urllib.error
+
+import requests
+import urllib3
+
+from .cache import CachedResponse, ResponseCache
+from .ratelimit import RateLimiter, resource_for
+from .retry import RetryPolicy, idempotent_methods, transient_statuses
+from .stats import stats
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Responses are decompressed by urllib3 as they are read, which supports
+# brotli only if the `brotli` package is installed.
+accept_encoding = ', '.join(['gzip', 'deflate'] + (['br'] if brotli else []))
+# Timeout (in seconds) of the requests made without a deadline.
+default_timeout = 30
+
+
+class _CountingHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    def _new_conn(self):
+        stats.incr('http.connections')
+        return super()._new_conn()
+
+
+class _CountingHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+    def _new_conn(self):
+        stats.incr('http.connections')
+        return super()._new_conn()
+
+
+class PoolAdapter(requests.adapters.HTTPAdapter):
+    """An adapter counting the connections opened by its pools."""
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _CountingHTTPConnectionPool,
+            'https': _CountingHTTPSConnectionPool,
+        }
+
+
+class GitHubClient(object):
+    """HTTP client shared by everything talking to the GitHub API.
+
+    Connections are kept alive in a pool of up to `pool_size` connections
+    per host, so consecutive requests don't pay for a new TCP and TLS
+    handshake. The pool is thread-safe, and the session keeps no state
+    between requests (cookies are ignored), so a single client is shared by
+    every thread.
+
+    Compressed responses are negotiated with `accept_encoding`, and
+    decompressed incrementally: a streamed response can be read in chunks
+    from `response.raw` without holding the whole body in memory.
+
+    With a `cache` (see `ResponseCache`), the successful responses of
+    non-streamed GET requests carrying an `ETag` or `Last-Modified` header
+    are kept, and requesting them again sends a conditional request: a `304
+    Not Modified` is answered with the cached response, and doesn't count
+    against the GitHub rate limit. Cached responses are keyed by URL, token
+    and media type.
+
+    With a `limiter` (see `RateLimiter`), requests are paced from the GitHub
+    rate limit, and rate limited requests are retried up to
+    `max_retries` times after backing off. With a `retry` policy (see
+    `RetryPolicy`), requests with an idempotent method are also retried
+    when they fail with a transient error (a 5xx status or a connection
+    error).
+
+    Requests made with a `deadline` (see `Deadline`) time out when it
+    expires, and are neither sent nor retried once it has expired, raising
+    `DeadlineExceeded`. They never wait into the reserve of the deadline
+    for a rate limit or a retry. Other requests time out after
+    `default_timeout` seconds.
+
+    Responses with a non-2xx status raise `urllib.error.HTTPError`, like
+    `urllib.request.urlopen` does. The number of requests made and of
+    connections opened are exported as the `http.requests` and
+    `http.connections` stats.
+    """
+    def __init__(self, pool_size=10, accept_encoding=accept_encoding,
+                 cache=None, limiter=None, max_retries=3, retry=None):
+        self.cache = cache
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.retry = retry
+        self.session = requests.Session()
+        self.session.headers['Accept-Encoding'] = accept_encoding
+        self.session.cookies.set_policy(
+            http.cookiejar.DefaultCookiePolicy(allowed_domains=[])
+        )
+        adapter = PoolAdapter(pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def request(self, method, url, token=None, data=None, media_type=None,
+                stream=False, deadline=None):
+        """Send a request, with `data` encoded as JSON. With `stream`, the
+        body of the response is only read when accessed, and
+        `response.raw` is set to decompress what it reads."""
+        headers = {}
+        if token:
+            headers['Authorization'] = 'token %s' % token
+        if media_type:
+            headers['Accept'] = media_type
+
+        key = cached = None
+        if method == 'GET' and not stream and self.cache is not None:
+            key = (url, token, media_type)
+            cached = self.cache.get(key)
+            if cached is not None:
+                headers.update(cached.validators)
+
+        response = self._send(method, url, data, headers, stream, deadline)
+        if cached is not None and response.status_code == 304:
+            stats.incr('http.cache.hits')
+            return self._cached_response(cached, response)
+        if key is not None:
+            stats.incr('http.cache.misses')
+
+        if not 200 <= response.status_code < 300:
+            body = response.content
+            response.close()
+            raise urllib.error.HTTPError(
+                url, response.status_code, response.reason, response.headers,
+                io.BytesIO(body),
+            )
+        response.raw.decode_content = True
+
+        if key is not None:
+            validators = ResponseCache.validators(response)
+            if validators is not None:
+                self.cache.put(key, CachedResponse(
+                    response.status_code, response.reason,
+                    dict(response.headers), response.content, validators,
+                ))
+        return response
+
+    def delay(self, url):
+        """Return how long a request to `url` would wait for the rate limit
+        before being sent."""
+        if self.limiter is None:
+            return 0
+        return self.limiter.delay(resource_for(url))
+
+    def _send(self, method, url, data, headers, stream, deadline):
+        resource = resource_for(url)
+        retry = self.retry if method in idempotent_methods else None
+        # Rate limited attempts, and attempts failing with a transient error.
+        limited = failed = 0
+        while True:
+            max_wait = None if deadline is None else deadline.spare()
+            if self.limiter is not None:
+                self.limiter.acquire(resource, max_wait)
+            timeout = default_timeout if deadline is None else deadline.timeout()
+            stats.incr('http.requests')
+            try:
+                response = self.session.request(
+                    method, url, json=data or None, headers=headers,
+                    stream=stream, timeout=timeout,
+                )
+            except requests.ConnectionError:
+                if retry is None or failed == retry.retries or \
+                        (deadline is not None and deadline.low()):
+                    raise
+                retry.wait(failed, 'requests', deadline and deadline.spare())
+                failed += 1
+                continue
+
+            if self.limiter is not None:
+                self.limiter.update(resource, response.headers)
+                if limited < self.max_retries and \
+                        response.status_code in (403, 429) and \
+                        RateLimiter.is_rate_limited(
+                            response.status_code, response.headers,
+                            response.content,
+                        ):
+                    response.close()
+                    self.limiter.backoff(
+                        limited, response.headers,
+                        deadline and deadline.spare(),
+                    )
+                    limited += 1
+                    continue
+
+            if retry is not None and failed < retry.retries and \
+                    response.status_code in transient_statuses and \
+                    (deadline is None or not deadline.low()):
+                response.close()
+                retry.wait(failed, 'requests', deadline and deadline.spare())
+                failed += 1
+                continue
+            return response
+
+    @staticmethod
+    def _cached_response(cached, not_modified):
+        response = requests.Response()
+        response.status_code = cached.status
+        response.reason = cached.reason
+        response.headers = requests.structures.CaseInsensitiveDict(
+            cached.headers
+        )
+        response._content = cached.content
+        response.url = not_modified.url
+        response.request = not_modified.request
+        return response
+
+
+def requests_per_connection():
+    connections = stats.get('http.connections')
+    if not connections:
+        return 0
+    return stats.get('http.requests') / connections
+
+
+client = GitHubClient(
+    cache=ResponseCache(), limiter=RateLimiter(), retry=RetryPolicy()
+)
+stats.gauge('http.requests_per_connection', requests_per_connection)
+stats.gauge('http.cache.entries', lambda: len(client.cache))
+stats.gauge('http.cache.bytes', lambda: client.cache.bytes)
+for resource in ('core', 'search'):
+    stats.gauge(
+        'ratelimit.%s.remaining' % resource,
+        lambda resource=resource: client.limiter.remaining(resource),
+    )
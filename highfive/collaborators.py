@@ -0,0 +1,122 @@
+import collections
+import threading
+import time
+import traceback
+
+from .client import client
+from .stats import stats
+
+collaborators_url = "https://api.github.com/repos/%s/%s/collaborators?per_page=100"
+
+
+class CollaboratorCache(object):
+    """A thread-safe LRU cache of the answers to "is `user` a collaborator
+    of `owner/repo`?", so that commenters aren't checked against the GitHub
+    API for every comment.
+
+    Collaborators are kept for `positive_ttl` seconds and other users for
+    `negative_ttl` seconds, as a user being added to a repository should be
+    noticed sooner than one being removed. The cache holds at most
+    `max_entries` answers, evicting the least recently used ones first.
+    GitHub logins are case-insensitive, and so are the keys.
+
+    Lookups are counted in the `collaborators.cache.hits` and
+    `collaborators.cache.misses` stats.
+    """
+    def __init__(self, max_entries=10000, positive_ttl=3600, negative_ttl=300,
+                 clock=time.monotonic):
+        self.max_entries = max_entries
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+
+    @staticmethod
+    def key(owner, repo, user):
+        return (owner.lower(), repo.lower(), user.lower())
+
+    def get(self, owner, repo, user):
+        """Return whether `user` is a collaborator of the repository, or None
+        if the answer isn't cached."""
+        key = self.key(owner, repo, user)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= self.clock():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                stats.incr('collaborators.cache.misses')
+                return None
+            self._entries.move_to_end(key)
+        stats.incr('collaborators.cache.hits')
+        return entry[0]
+
+    def put(self, owner, repo, user, is_collaborator):
+        ttl = self.positive_ttl if is_collaborator else self.negative_ttl
+        key = self.key(owner, repo, user)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (is_collaborator, self.clock() + ttl)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                stats.incr('collaborators.cache.evictions')
+
+    def invalidate(self, owner, repo, user=None):
+        """Forget what is known about `user` in the repository, or about
+        every user of the repository if `user` is None."""
+        with self._lock:
+            if user is not None:
+                self._entries.pop(self.key(owner, repo, user), None)
+                return
+            prefix = self.key(owner, repo, '')[:2]
+            for key in [k for k in self._entries if k[:2] == prefix]:
+                del self._entries[key]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+def fetch_collaborators(owner, repo, token):
+    """Return the logins of every collaborator of the repository, following
+    the pagination of the GitHub API."""
+    result = []
+    url = collaborators_url % (owner, repo)
+    while url:
+        response = client.request('GET', url, token)
+        result.extend(user['login'] for user in response.json())
+        url = response.links.get('next', {}).get('url')
+    return result
+
+
+def prefetch(cache, token, repos):
+    """Fill `cache` with the collaborators of every `org/repo` in `repos`.
+    A repository failing to load is reported and skipped."""
+    for full_name in repos:
+        owner, repo = full_name.split('/', 1)
+        try:
+            users = fetch_collaborators(owner, repo, token)
+        except Exception:
+            print('Failed to prefetch the collaborators of %s' % full_name)
+            print(traceback.format_exc())
+            stats.incr('collaborators.prefetch_failures')
+            continue
+        for user in users:
+            cache.put(owner, repo, user, True)
+    stats.set('collaborators.prefetched', len(cache))
+
+
+def keep_prefetched(cache, token, repos, interval=None, sleep=time.sleep):
+    """Prefetch the collaborators of the repositories `repos()` returns
+    every `interval` seconds (half the `positive_ttl` of `cache` by
+    default), so that the prefetched answers never expire."""
+    if interval is None:
+        interval = cache.positive_ttl / 2
+    while True:
+        prefetch(cache, token, repos())
+        sleep(interval)
+
+
+collaborators = CollaboratorCache()
+stats.gauge('collaborators.cache.entries', lambda: len(collaborators))
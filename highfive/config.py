@@ -1,4 +1,9 @@
-import requests
+import urllib.error
+
+from .client import client
+from .contributors import ContributorIndex, ContributorStore
+from .deadline import default_deadline
+from .diff import default_spool_size
 
 
 class InvalidTokenException(Exception):
@@ -6,16 +11,25 @@ class InvalidTokenException(Exception):
 
 
 class Config(object):
-    def __init__(self, github_token):
+    def __init__(self, github_token, diff_spool_size=default_spool_size,
+                 webhook_deadline=default_deadline, contributors_db=None):
         if not github_token:
             raise InvalidTokenException()
         self.github_token = github_token
+        self.diff_spool_size = diff_spool_size
+        self.webhook_deadline = webhook_deadline
+        # Without a database, new contributors are checked on every PR.
+        self.contributors = self.contributor_index = None
+        if contributors_db:
+            self.contributors = ContributorStore(contributors_db)
+            self.contributor_index = ContributorIndex(contributors_db)
         self.github_username = self.fetch_github_username()
 
     def fetch_github_username(self):
-        response = requests.get('https://api.github.com/user', headers={
-            'Authorization': 'token ' + self.github_token
-        })
-        if response.status_code != 200:
+        try:
+            response = client.request(
+                'GET', 'https://api.github.com/user', self.github_token
+            )
+        except urllib.error.HTTPError:
             raise InvalidTokenException()
         return response.json()['login']
@@ -0,0 +1,270 @@
+import hashlib
+import math
+import threading
+import time
+import traceback
+
+from .client import client
+from .database import Database
+from .stats import stats
+
+contributors_url = "https://api.github.com/repos/%s/%s/contributors?per_page=100"
+
+schema = """
+CREATE TABLE IF NOT EXISTS contributors (
+    repo TEXT NOT NULL,
+    user TEXT NOT NULL,
+    contributed INTEGER NOT NULL,
+    checked REAL NOT NULL,
+    PRIMARY KEY (repo, user)
+)
+"""
+index_schema = """
+CREATE TABLE IF NOT EXISTS contributor_index (
+    repo TEXT NOT NULL,
+    user TEXT NOT NULL,
+    PRIMARY KEY (repo, user)
+);
+CREATE TABLE IF NOT EXISTS contributor_filters (
+    repo TEXT PRIMARY KEY,
+    capacity INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    bits BLOB NOT NULL
+);
+"""
+
+
+def repo_key(owner, repo):
+    return ('%s/%s' % (owner, repo)).lower()
+
+
+class ContributorStore(Database):
+    """A persistent cache of whether users have contributed to a
+    repository, stored in the SQLite database at `path`.
+
+    Having a commit in a repository never changes, so contributors are kept
+    forever, while new contributors are checked again after `new_ttl`
+    seconds. A contributor is never recorded as new again.
+
+    Lookups are counted in the `contributors.cache.hits` and
+    `contributors.cache.misses` stats.
+    """
+    def __init__(self, path, new_ttl=3600, timeout=5, clock=time.time):
+        super().__init__(path, timeout)
+        self.new_ttl = new_ttl
+        self.clock = clock
+        with self._connection() as conn:
+            conn.execute(schema)
+
+    @staticmethod
+    def key(owner, repo, user):
+        return repo_key(owner, repo), user.lower()
+
+    def get(self, owner, repo, user):
+        """Return True if `user` contributed to the repository, False if they
+        recently hadn't, or None if that isn't known."""
+        row = self._connection().execute(
+            'SELECT contributed, checked FROM contributors '
+            'WHERE repo = ? AND user = ?',
+            self.key(owner, repo, user),
+        ).fetchone()
+        if row is None or \
+                (not row[0] and row[1] + self.new_ttl <= self.clock()):
+            stats.incr('contributors.cache.misses')
+            return None
+        stats.incr('contributors.cache.hits')
+        return bool(row[0])
+
+    def put(self, owner, repo, user, contributed):
+        key = self.key(owner, repo, user)
+        now = self.clock()
+        with self._transaction() as conn:
+            conn.execute(
+                'INSERT OR IGNORE INTO contributors VALUES (?, ?, ?, ?)',
+                key + (int(contributed), now),
+            )
+            conn.execute(
+                'UPDATE contributors SET '
+                'contributed = max(contributed, ?), checked = ? '
+                'WHERE repo = ? AND user = ?',
+                (int(contributed), now) + key,
+            )
+
+
+class BloomFilter(object):
+    """A Bloom filter of strings, sized to hold `capacity` items with a
+    false positive rate of `error_rate`."""
+    def __init__(self, capacity, error_rate=0.01, bits=None):
+        self.capacity = max(1, capacity)
+        self.size = max(8, int(math.ceil(
+            -self.capacity * math.log(error_rate) / math.log(2) ** 2
+        )))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        if bits is None:
+            bits = bytes((self.size + 7) // 8)
+        self.bits = bytearray(bits)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item):
+        return all(
+            self.bits[pos >> 3] & (1 << (pos & 7))
+            for pos in self._positions(item)
+        )
+
+
+class ContributorIndex(Database):
+    """The users known to have contributed to each indexed repository.
+
+    The exact set of logins of a repository is stored in the database, along
+    with a Bloom filter of it, which is kept in memory so that the logins
+    missing from the index (the usual case for new contributors) are
+    answered without reading the database. A repository is indexed by
+    `build`, and `add` records new contributors, growing the filter when it
+    holds more users than it was sized for.
+
+    Filters are only loaded once by every process, so a user added by
+    another process may be missed until the index is built again.
+    Lookups are counted in the `contributors.index.*` stats.
+    """
+    def __init__(self, path, error_rate=0.01, timeout=5):
+        super().__init__(path, timeout)
+        self.error_rate = error_rate
+        self._lock = threading.Lock()
+        self._filters = {}
+        self._connection().executescript(index_schema)
+
+    def _filter(self, repo):
+        with self._lock:
+            if repo in self._filters:
+                return self._filters[repo]
+        row = self._connection().execute(
+            'SELECT capacity, bits FROM contributor_filters WHERE repo = ?',
+            (repo,),
+        ).fetchone()
+        bloom = None
+        if row is not None:
+            bloom = BloomFilter(row[0], self.error_rate, row[1])
+        with self._lock:
+            return self._filters.setdefault(repo, bloom)
+
+    def indexed(self, owner, repo):
+        return self._filter(repo_key(owner, repo)) is not None
+
+    def contains(self, owner, repo, user):
+        """Return True if `user` is a known contributor of the repository,
+        False if they aren't, or None if the repository isn't indexed."""
+        repo, user = repo_key(owner, repo), user.lower()
+        bloom = self._filter(repo)
+        if bloom is None:
+            return None
+        if user not in bloom:
+            stats.incr('contributors.index.filtered')
+            return False
+        found = self._connection().execute(
+            'SELECT 1 FROM contributor_index WHERE repo = ? AND user = ?',
+            (repo, user),
+        ).fetchone() is not None
+        stats.incr('contributors.index.%s' % ('hits' if found else 'misses'))
+        return found
+
+    def build(self, owner, repo, users):
+        """Index `users` as contributors of the repository, along with the
+        ones already indexed."""
+        repo = repo_key(owner, repo)
+        with self._connection() as conn:
+            conn.executemany(
+                'INSERT OR IGNORE INTO contributor_index VALUES (?, ?)',
+                [(repo, user.lower()) for user in users],
+            )
+            self._rebuild_filter(conn, repo)
+
+    def add(self, owner, repo, user):
+        """Record a new contributor of the repository."""
+        repo, user = repo_key(owner, repo), user.lower()
+        with self._transaction() as conn:
+            added = conn.execute(
+                'INSERT OR IGNORE INTO contributor_index VALUES (?, ?)',
+                (repo, user),
+            ).rowcount
+            bloom = self._filter(repo)
+            if not added or bloom is None:
+                return
+            conn.execute(
+                'UPDATE contributor_filters SET count = count + 1 '
+                'WHERE repo = ?',
+                (repo,),
+            )
+            row = conn.execute(
+                'SELECT count FROM contributor_filters WHERE repo = ?',
+                (repo,),
+            ).fetchone()
+            if row is None or row[0] > bloom.capacity:
+                self._rebuild_filter(conn, repo)
+                return
+            with self._lock:
+                bloom.add(user)
+            conn.execute(
+                'UPDATE contributor_filters SET bits = ? WHERE repo = ?',
+                (bytes(bloom.bits), repo),
+            )
+
+    def _rebuild_filter(self, conn, repo):
+        users = [row[0] for row in conn.execute(
+            'SELECT user FROM contributor_index WHERE repo = ?', (repo,)
+        )]
+        # Leave room for the contributors added until the next build.
+        bloom = BloomFilter(2 * len(users), self.error_rate)
+        for user in users:
+            bloom.add(user)
+        conn.execute(
+            'INSERT OR REPLACE INTO contributor_filters VALUES (?, ?, ?, ?)',
+            (repo, bloom.capacity, len(users), bytes(bloom.bits)),
+        )
+        with self._lock:
+            self._filters[repo] = bloom
+
+
+def fetch_contributors(owner, repo, token):
+    """Return the logins of the contributors of the repository, following
+    the pagination of the GitHub API. GitHub only links the 500 most active
+    authors to their account, so the list may be incomplete."""
+    result = []
+    url = contributors_url % (owner, repo)
+    while url:
+        response = client.request('GET', url, token)
+        if response.status_code == 204:
+            # The repository is empty.
+            break
+        result.extend(
+            user['login'] for user in response.json() if 'login' in user
+        )
+        url = response.links.get('next', {}).get('url')
+    return result
+
+
+def build_index(index, token, repos, rebuild=False):
+    """Index the contributors of every `org/repo` in `repos`, skipping the
+    repositories already indexed unless `rebuild` is set. A repository
+    failing to load is reported and skipped."""
+    for full_name in repos:
+        owner, repo = full_name.split('/', 1)
+        if not rebuild and index.indexed(owner, repo):
+            continue
+        try:
+            users = fetch_contributors(owner, repo, token)
+        except Exception:
+            print('Failed to index the contributors of %s' % full_name)
+            print(traceback.format_exc())
+            stats.incr('contributors.index.failures')
+            continue
+        index.build(owner, repo, users)
+        stats.incr('contributors.index.repos')
@@ -0,0 +1,49 @@
+import contextlib
+import sqlite3
+import threading
+
+
+class Database(object):
+    """A SQLite database in WAL mode, with a connection per thread so that
+    it can be shared by the threads of a process and by several processes
+    using the same file.
+
+    With the default `synchronous` setting, a commit survives a crash of
+    the process but may be lost if the system crashes, while `FULL` also
+    survives the latter.
+    """
+    def __init__(self, path, timeout=5, synchronous='NORMAL'):
+        self.path = path
+        self.timeout = timeout
+        self.synchronous = synchronous
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=%s' % self.synchronous)
+            self._local.conn = conn
+        return conn
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """Run the block in a transaction which takes the write lock first,
+        so that what it reads doesn't change before it writes. This works
+        with the SQLite versions lacking `RETURNING` (before 3.35)."""
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+    def close(self):
+        """Close the connection of the calling thread."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
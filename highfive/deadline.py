@@ -0,0 +1,50 @@
+import time
+
+# Webhooks are handled after being acknowledged, so the deadline doesn't
+# have to beat the 10 second timeout of GitHub deliveries: it bounds how long
+# a webhook holds its worker, and the events of its PR queued behind it, while
+# leaving room for the retries of a slow GitHub API.
+default_deadline = 30
+# Below this number of seconds left, handlers skip the optional work.
+default_reserve = 3
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline(object):
+    """The time budget of a webhook, which every outgoing request takes its
+    timeout from.
+
+    The budget is `low` once less than `reserve` seconds are left: handlers
+    should then skip the work that isn't needed to answer the event.
+    """
+    def __init__(self, seconds=default_deadline, reserve=default_reserve,
+                 clock=time.monotonic):
+        self.seconds = seconds
+        self.reserve = reserve
+        self.clock = clock
+        self.expires = clock() + seconds
+
+    def remaining(self):
+        return max(0, self.expires - self.clock())
+
+    def expired(self):
+        return self.remaining() == 0
+
+    def low(self):
+        return self.remaining() < self.reserve
+
+    def spare(self):
+        """Return how long the event can wait (e.g. for a rate limit),
+        keeping the reserve for the work left."""
+        return max(0, self.remaining() - self.reserve)
+
+    def timeout(self):
+        """Return the timeout of a request, raising `DeadlineExceeded` if no
+        time is left."""
+        remaining = self.remaining()
+        if remaining == 0:
+            raise DeadlineExceeded()
+        return remaining
@@ -0,0 +1,86 @@
+import collections
+import threading
+import time
+
+from .database import Database
+from .stats import stats
+
+schema = """
+CREATE TABLE IF NOT EXISTS deliveries (
+    delivery TEXT PRIMARY KEY,
+    received REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS deliveries_received ON deliveries (received);
+"""
+
+
+class DeliveryStore(Database):
+    """The delivery IDs of a `DeliveryLog`, stored in SQLite."""
+    def __init__(self, path, timeout=5):
+        super().__init__(path, timeout)
+        self._connection().executescript(schema)
+
+    def record(self, delivery, now, window):
+        with self._connection() as conn:
+            conn.execute(
+                'DELETE FROM deliveries WHERE received <= ?', (now - window,)
+            )
+            return conn.execute(
+                'INSERT OR IGNORE INTO deliveries VALUES (?, ?)',
+                (delivery, now),
+            ).rowcount == 1
+
+    def forget(self, delivery):
+        with self._connection() as conn:
+            conn.execute(
+                'DELETE FROM deliveries WHERE delivery = ?', (delivery,)
+            )
+
+
+class DeliveryLog(object):
+    """The IDs of the webhook deliveries received in the last `window`
+    seconds, to skip the ones GitHub (or someone using the "Redeliver"
+    button) sends again.
+
+    At most `max_entries` IDs are kept in memory. With a `path`, they are
+    also stored in a SQLite database, so that they are shared by several
+    processes and survive a restart. Duplicates are counted in the
+    `deliveries.duplicates` stat.
+    """
+    def __init__(self, path=None, window=24 * 3600, max_entries=10000,
+                 clock=time.time):
+        self.window = window
+        self.max_entries = max_entries
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._received = collections.OrderedDict()
+        self._store = DeliveryStore(path) if path else None
+
+    def record(self, delivery):
+        """Record a delivery, returning False if it was already received in
+        the window."""
+        now = self.clock()
+        with self._lock:
+            received = self._received.get(delivery)
+            duplicate = received is not None and received > now - self.window
+            if not duplicate:
+                self._received[delivery] = now
+            self._received.move_to_end(delivery)
+            while len(self._received) > self.max_entries:
+                self._received.popitem(last=False)
+        if duplicate:
+            stats.incr('deliveries.duplicates')
+            return False
+        if self._store is not None and \
+                not self._store.record(delivery, now, self.window):
+            stats.incr('deliveries.duplicates')
+            return False
+        return True
+
+    def forget(self, delivery):
+        """Forget a delivery which wasn't handled, so that it is handled if
+        it is sent again."""
+        with self._lock:
+            self._received.pop(delivery, None)
+        if self._store is not None:
+            self._store.forget(delivery)
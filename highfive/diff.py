@@ -0,0 +1,258 @@
+import contextlib
+import mmap
+import re
+import tempfile
+
+# Both patterns start with the newline preceding the line they look for, so
+# that they are anchored to the beginning of a line while still letting the
+# regex engine skip ahead with a fast literal search.
+submodule_re = re.compile(rb"\n\+Subproject\scommit\s")
+target_re = re.compile(rb"\n[+-]{3} [ab]/compiler/rustc_target/src/spec/")
+
+file_header = b'diff --git '
+
+# Diffs larger than this are written to a temporary file instead of being
+# kept in memory (see `spool`).
+default_spool_size = 1024 * 1024
+# Size of the slices of a memory mapped diff copied in memory to count lines.
+scan_window = 4 * 1024 * 1024
+chunk_size = 64 * 1024
+
+
+class DiffTooLarge(Exception):
+    pass
+
+
+@contextlib.contextmanager
+def spool(stream, max_memory=default_spool_size, length=None, max_size=None):
+    """Read a binary stream, and give its content as `bytes` if it is at
+    most `max_memory` bytes long. Otherwise the content is copied to a
+    temporary file, and given as a read-only `mmap` of that file, so that
+    at most `max_memory` bytes of it are held in memory at any time.
+
+    The stream is closed, and the temporary file removed, when the context
+    exits. `length` is the expected size of the content, if known. Raises
+    `DiffTooLarge` as soon as more than `max_size` bytes are read, if given.
+    """
+    with contextlib.ExitStack() as stack:
+        stack.callback(stream.close)
+
+        def read(size):
+            chunk = stream.read(chunk_size)
+            if max_size is not None and size + len(chunk) > max_size:
+                raise DiffTooLarge()
+            return chunk
+
+        chunks = []
+        size = 0
+        if length is None or length <= max_memory:
+            while size <= max_memory:
+                chunk = read(size)
+                if not chunk:
+                    yield b''.join(chunks)
+                    return
+                chunks.append(chunk)
+                size += len(chunk)
+
+        spooled = stack.enter_context(tempfile.TemporaryFile())
+        spooled.writelines(chunks)
+        del chunks
+        while True:
+            chunk = read(size)
+            if not chunk:
+                break
+            spooled.write(chunk)
+            size += len(chunk)
+        spooled.flush()
+        if size == 0:
+            # Empty files can't be mapped.
+            yield b''
+            return
+        yield stack.enter_context(
+            mmap.mmap(spooled.fileno(), 0, access=mmap.ACCESS_READ)
+        )
+
+
+def count(buf, needle, start, end):
+    """Count the occurrences of `needle` in `buf[start:end]`, without
+    copying more than `scan_window` bytes of `buf` at once."""
+    if isinstance(buf, bytes):
+        return buf.count(needle, start, end)
+    total = 0
+    for pos in range(start, end, scan_window):
+        # Only count the occurrences starting in this window.
+        stop = min(pos + scan_window + len(needle) - 1, end)
+        total += buf[pos:stop].count(needle)
+    return total
+
+
+class FileRecord(object):
+    """What a diff changes in a single file.
+
+    `flags` contains the name of every analyzer that matched the file (see
+    `DiffAnalysis.analyzer`). `status` is only known when the record comes
+    from the PR files API (`added`, `removed`, `modified`, `renamed`...).
+    """
+    __slots__ = ('path', 'added', 'removed', 'flags', 'status')
+
+    def __init__(self, path, added=0, removed=0, flags=(), status=None):
+        self.path = path
+        self.added = added
+        self.removed = removed
+        self.flags = set(flags)
+        self.status = status
+
+    @property
+    def changes(self):
+        return self.added + self.removed
+
+    def __eq__(self, other):
+        return isinstance(other, FileRecord) and \
+            (self.path, self.added, self.removed, self.flags) == \
+            (other.path, other.added, other.removed, other.flags)
+
+    def __repr__(self):
+        return 'FileRecord(%r, %d, %d, %r)' % (
+            self.path, self.added, self.removed, sorted(self.flags)
+        )
+
+
+class DiffAnalysis(object):
+    """Walks a diff once, and records for every file it touches the number
+    of lines added and removed, along with the flags set by the registered
+    analyzers.
+
+    Finding the files and counting their changes only relies on substring
+    searches, so the cost of the analysis grows linearly with the size of
+    the diff.
+
+    The diff is scanned as bytes: it can be `bytes`, or an `mmap` given by
+    `spool`, in which case it is never copied in memory as a whole. A `str`
+    diff is encoded first.
+
+    Analyzers are functions registered with the `analyzer` decorator. They
+    are called as `func(diff, start, end)` for each file, where
+    `diff[start:end]` is the section of the file (starting with its
+    `diff --git` line), and their name is added to the file's `flags` if
+    they return a true value.
+    """
+    analyzers = {}
+
+    @classmethod
+    def analyzer(cls, name):
+        def register(func):
+            cls.analyzers[name] = func
+            return func
+        return register
+
+    def __init__(self, diff, analyzers=None):
+        if analyzers is None:
+            analyzers = self.analyzers
+        if isinstance(diff, str):
+            diff = diff.encode('utf-8')
+        self.files = [
+            self._analyze_file(diff, start, end, analyzers)
+            for (start, end) in self._sections(diff)
+        ]
+        # Whether the analyzers could not look at the content of some files.
+        self.incomplete = False
+
+    @classmethod
+    def from_files(cls, files, analyzers=None):
+        """Build the analysis out of the entries returned by the PR files API
+        instead of the diff itself.
+
+        The line counts come from the `additions` and `deletions` of each
+        entry, and the analyzers are run on a section rebuilt from the
+        `patch` of the entry. GitHub omits the patch of large and binary
+        files: in that case `incomplete` is set.
+        """
+        if analyzers is None:
+            analyzers = cls.analyzers
+        analysis = cls(b'', analyzers)
+        for entry in files:
+            path = entry['filename']
+            record = FileRecord(
+                path, entry['additions'], entry['deletions'],
+                status=entry.get('status'),
+            )
+            patch = entry.get('patch')
+            if patch is None:
+                analysis.incomplete = True
+            else:
+                old_path = entry.get('previous_filename', path)
+                section = 'diff --git a/%s b/%s\n--- a/%s\n+++ b/%s\n%s\n' % (
+                    old_path, path, old_path, path, patch
+                )
+                section = section.encode('utf-8')
+                for name, func in analyzers.items():
+                    if func(section, 0, len(section)):
+                        record.flags.add(name)
+            analysis.files.append(record)
+        return analysis
+
+    def update_flags(self, other):
+        """Add the flags found by another analysis of the same changes (e.g.
+        one made from the full diff) to the records of this one."""
+        flags = {}
+        for record in other.files:
+            flags.setdefault(record.path, set()).update(record.flags)
+        for record in self.files:
+            record.flags.update(flags.get(record.path, ()))
+        self.incomplete = other.incomplete
+
+    @staticmethod
+    def _sections(diff):
+        """Yield the `(start, end)` offsets of the section of each file."""
+        separator = b'\n' + file_header
+        if diff[:len(file_header)] == file_header:
+            start = 0
+        else:
+            start = diff.find(separator)
+            if start == -1:
+                return
+            start += 1
+
+        while True:
+            end = diff.find(separator, start)
+            if end == -1:
+                yield start, len(diff)
+                return
+            yield start, end + 1
+            start = end + 1
+
+    @staticmethod
+    def _analyze_file(diff, start, end, analyzers):
+        header_end = diff.find(b'\n', start, end)
+        if header_end == -1:
+            header_end = end
+        header = diff[start:header_end].decode('utf-8', 'replace')
+        record = FileRecord(header[header.find(' b/') + len(' b/'):])
+
+        # Lines starting with `+++`/`---` are the file names, not changes.
+        record.added = \
+            count(diff, b'\n+', start, end) - count(diff, b'\n+++', start, end)
+        record.removed = \
+            count(diff, b'\n-', start, end) - count(diff, b'\n---', start, end)
+
+        for name, func in analyzers.items():
+            if func(diff, start, end):
+                record.flags.add(name)
+        return record
+
+    def any(self, flag):
+        """Returns True if any file has the `flag` set."""
+        return any(flag in record.flags for record in self.files)
+
+
+@DiffAnalysis.analyzer('submodule')
+def modifies_submodule(diff, start, end):
+    return submodule_re.search(diff, start, end) is not None
+
+
+@DiffAnalysis.analyzer('target')
+def modifies_target(diff, start, end):
+    # The file names are in the `---`/`+++` lines before the first hunk.
+    hunk = diff.find(b'\n@@', start, end)
+    return target_re.search(diff, start, end if hunk == -1 else hunk) \
+        is not None
@@ -0,0 +1,171 @@
+import json
+import time
+
+from .database import Database
+from .stats import stats
+
+schema = """
+CREATE TABLE IF NOT EXISTS jobs (
+    delivery TEXT PRIMARY KEY,
+    event TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_until REAL,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created);
+"""
+
+# The states of a job. Pending jobs wait for a worker, which claims them by
+# making them running until their lease expires. Jobs raising an exception
+# are failed, and jobs whose lease expired too many times (e.g. because
+# highfive was restarted while handling them) are dead: both are only run
+# again by `highfive replay`.
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+DEAD = 'dead'
+
+
+class Job(object):
+    """A webhook delivery claimed from the queue."""
+    __slots__ = ('delivery', 'event', 'payload', 'attempts')
+
+    def __init__(self, delivery, event, payload, attempts):
+        self.delivery = delivery
+        self.event = event
+        self.payload = payload
+        self.attempts = attempts
+
+
+class JobQueue(Database):
+    """A durable queue of webhook deliveries, keyed by delivery ID and
+    stored in the SQLite database at `path`.
+
+    Deliveries are committed with `synchronous=FULL` by `put`, before the
+    webhook is acknowledged. A worker `claim`s a job for `lease` seconds,
+    and marks it `complete` or `fail`ed: a job whose lease expires is
+    claimed again, up to `max_attempts` times. Finished jobs are kept for
+    `retention` seconds.
+
+    Jobs are claimed in a transaction holding the write lock, so several
+    workers and processes can share the queue. The number of jobs in every state is
+    exported as the `jobs.<state>` stats.
+    """
+    def __init__(self, path, lease=120, max_attempts=3,
+                 retention=7 * 24 * 3600, timeout=5, clock=time.time):
+        super().__init__(path, timeout, synchronous='FULL')
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self.clock = clock
+        self._connection().executescript(schema)
+
+        for state in (PENDING, RUNNING, DONE, FAILED, DEAD):
+            stats.gauge(
+                'jobs.%s' % state, lambda state=state: self.count(state)
+            )
+
+    def put(self, delivery, event, payload):
+        """Queue a delivery. Returns False if it was already queued."""
+        now = self.clock()
+        with self._connection() as conn:
+            return conn.execute(
+                'INSERT OR IGNORE INTO jobs '
+                '(delivery, event, payload, state, created, updated) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (delivery, event, json.dumps(payload), PENDING, now, now),
+            ).rowcount == 1
+
+    def claim(self, delivery=None):
+        """Claim the oldest pending job, or a job whose lease expired, and
+        return it, or None if there is none. With `delivery`, claim that
+        delivery instead, even if it failed or is dead."""
+        now = self.clock()
+        with self._transaction() as conn:
+            conn.execute(
+                'UPDATE jobs SET state = ?, updated = ? '
+                'WHERE state = ? AND lease_until < ? AND attempts >= ?',
+                (DEAD, now, RUNNING, now, self.max_attempts),
+            )
+            if delivery is None:
+                where = '(state = ? OR (state = ? AND lease_until < ?))'
+                args = (PENDING, RUNNING, now)
+            else:
+                where = 'delivery = ? AND ' \
+                    '(state IN (?, ?, ?) OR (state = ? AND lease_until < ?))'
+                args = (delivery, PENDING, FAILED, DEAD, RUNNING, now)
+            row = conn.execute(
+                'SELECT delivery, event, payload, attempts FROM jobs '
+                'WHERE %s ORDER BY created LIMIT 1' % where,
+                args,
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                'UPDATE jobs SET state = ?, lease_until = ?, updated = ?, '
+                'attempts = attempts + 1 WHERE delivery = ?',
+                (RUNNING, now + self.lease, now, row[0]),
+            )
+        return Job(row[0], row[1], json.loads(row[2]), row[3] + 1)
+
+    def remove(self, delivery):
+        """Remove a delivery which is still pending, e.g. because no worker
+        could take it."""
+        with self._connection() as conn:
+            conn.execute(
+                'DELETE FROM jobs WHERE delivery = ? AND state = ?',
+                (delivery, PENDING),
+            )
+
+    def complete(self, delivery):
+        self._finish(delivery, DONE, None)
+
+    def fail(self, delivery, error):
+        self._finish(delivery, FAILED, error)
+
+    def _finish(self, delivery, state, error):
+        now = self.clock()
+        with self._connection() as conn:
+            conn.execute(
+                'UPDATE jobs SET state = ?, error = ?, lease_until = NULL, '
+                'updated = ? WHERE delivery = ?',
+                (state, error, now, delivery),
+            )
+            conn.execute(
+                'DELETE FROM jobs WHERE state = ? AND updated < ?',
+                (DONE, now - self.retention),
+            )
+
+    def recoverable(self, before):
+        """Return the `(delivery, attempts, payload)` of the jobs nobody is
+        handling, oldest first: the running jobs whose lease expired, and
+        the jobs left pending since before `before` (e.g. by a previous
+        run)."""
+        return [
+            (row[0], row[1], json.loads(row[2]))
+            for row in self._connection().execute(
+                'SELECT delivery, attempts, payload FROM jobs '
+                'WHERE (state = ? AND lease_until < ? AND attempts < ?) '
+                'OR (state = ? AND created < ?) ORDER BY created',
+                (RUNNING, self.clock(), self.max_attempts, PENDING, before),
+            )
+        ]
+
+    def count(self, state):
+        return self._connection().execute(
+            'SELECT count(*) FROM jobs WHERE state = ?', (state,)
+        ).fetchone()[0]
+
+    def unfinished(self):
+        """Return the `(delivery, event, state, error)` of the failed and
+        dead jobs, oldest first."""
+        return self._connection().execute(
+            'SELECT delivery, event, state, error FROM jobs '
+            'WHERE state IN (?, ?) ORDER BY created',
+            (FAILED, DEAD),
+        ).fetchall()
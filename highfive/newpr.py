@@ -1,14 +1,23 @@
 #!/usr/bin/env python3
 
-import gzip
+import asyncio
+import copy
+import datetime
 import json
-import os
 import random
 import re
-import urllib
+import threading
+import traceback
+import urllib.error
 from configparser import ConfigParser
-from copy import deepcopy
-from io import StringIO
+
+from .client import client
+from .collaborators import collaborators
+from .deadline import Deadline
+from .diff import DiffAnalysis, DiffTooLarge, spool
+from .registry import UnsupportedRepoError
+from .retry import RetryPolicy, is_transient
+from .stats import stats
 
 # Maximum per page is 100. Sorted by number of commits, so most of the time the
 # contributor will happen early,
@@ -17,6 +26,28 @@ user_collabo_url = "https://api.github.com/repos/%s/%s/collaborators/%s"
 issue_url = "https://api.github.com/repos/%s/%s/issues/%s"
 issue_labels_url = "https://api.github.com/repos/%s/%s/issues/%s/labels"
 commit_search_url = "https://api.github.com/search/commits?q=repo:%s/%s+author:%s"
+comments_since_url = "%s?since=%s&per_page=100"
+# Appended to the URL of a pull request. GitHub lists at most 3000 files.
+pr_files_url = "%s/files?per_page=100&page=%d"
+
+diff_media_type = "application/vnd.github.v3.diff"
+# Above these limits, PRs are analyzed with the files API even if the repo
+# doesn't enable `file_stats` (see `analyze_pr`).
+file_stats_changed_files = 300
+file_stats_diff_size = 10 * 1024 * 1024
+
+# What the `author_association` of a user in a payload tells about them.
+# Only owners and collaborators are known to have access to the repository:
+# other users (e.g. organization members whose membership is private, which
+# GitHub reports as CONTRIBUTOR or NONE, while a team gives them write
+# access) are checked with the API, like the associations missing from
+# `new_contributor_associations`.
+collaborator_associations = frozenset(('OWNER', 'COLLABORATOR'))
+new_contributor_associations = {
+    'CONTRIBUTOR': False,
+    'FIRST_TIME_CONTRIBUTOR': True,
+    'FIRST_TIMER': True,
+}
 
 welcome_with_reviewer = '@%s (or someone else)'
 welcome_without_reviewer = "@nrc (NB. this repo may be misconfigured)"
@@ -34,30 +65,29 @@ review_with_reviewer = 'r? @%s\n\n(rust-highfive has picked a reviewer for you,
 review_without_reviewer = '@%s: no appropriate reviewer found, use r? to override'
 
 reviewer_re = re.compile(r"\b[rR]\?[:\- ]*(?:@?([a-zA-Z0-9\-]+)/)?(@?[a-zA-Z0-9\-]+)")
-submodule_re = re.compile(r".*\+Subproject\scommit\s.*", re.DOTALL | re.MULTILINE)
-target_re = re.compile("^[+-]{3} [ab]/compiler/rustc_target/src/spec/", re.MULTILINE)
-
-class UnsupportedRepoError(IOError):
-    pass
-
 
 class HighfiveHandler(object):
-    def __init__(self, payload, config, config_dir=None):
+    def __init__(self, payload, config, registry):
         self.payload = payload
 
         self.integration_user = config.github_username
         self.integration_token = config.github_token
+        self.diff_spool_size = config.diff_spool_size
 
-        self.config_dir = config_dir
+        self.registry = registry
         self.repo_config = self.load_repo_config()
+        # Comment fragments posted together by `flush_comments`.
+        self.comments = []
+        self.retry = RetryPolicy()
+        self.collaborators = collaborators
+        self.contributors = config.contributors
+        self.contributor_index = config.contributor_index
+        # Every request made while handling the event shares this budget.
+        self.deadline = Deadline(config.webhook_deadline)
 
     def load_repo_config(self):
-        """Load the repository configuration."""
-        (org, repo) = self.payload['repository', 'full_name'].split('/')
-        try:
-            return self._load_json_file(os.path.join(org, repo) + '.json')
-        except IOError:
-            raise UnsupportedRepoError
+        """Look up the repository configuration in the registry."""
+        return self.registry.repo_config(self.payload['repository', 'full_name'])
 
     def run(self, event):
         if event == "ping":
@@ -65,48 +95,117 @@ class HighfiveHandler(object):
         elif event == "pull_request" and self.payload["action"] == "opened":
             self.new_pr()
             return 'OK, handled new PR\n'
+        elif event == "pull_request" and self.payload["action"] == "closed":
+            self.pr_closed()
+            return 'OK, handled closed PR\n'
         elif event == "issue_comment" and self.payload["action"] == "created":
             msg = self.new_comment()
             if msg is None:
                 return 'OK\n'
             else:
                 return f"OK: {msg}\n"
+        elif event == "member":
+            self.member_changed()
+            return 'OK, updated collaborators\n'
         else:
             return 'Unsupported webhook event.\n'
 
-    def _load_json_file(self, name):
-        config_dir = self.config_dir
-        if not self.config_dir:
-            config_dir = os.path.join(os.path.dirname(__file__), 'configs')
+    def modifies_submodule(self, analysis):
+        return analysis.any('submodule')
 
-        with open(os.path.join(config_dir, name)) as config:
-            return json.load(config)
+    def modifies_targets(self, analysis):
+        return analysis.any('target')
 
-    def modifies_submodule(self, diff):
-        return submodule_re.match(diff)
+    def api_req(self, method, url, data=None, media_type=None):
+        f = self._open(method, url, data, media_type)
+        return {"header": f.headers, "body": f.content.decode("utf-8")}
+
+    def _open(self, method, url, data=None, media_type=None, stream=False):
+        """Send a request through the shared client. With `stream`, the
+        response is returned before its body is read, and isn't cached."""
+        return client.request(
+            method, url, self.integration_token, data, media_type, stream,
+            self.deadline,
+        )
 
-    def modifies_targets(self, diff):
-        return target_re.search(diff)
+    def fetch_diff(self, url, max_size=None):
+        """Download the diff of a PR, and return a context manager giving its
+        content (see `spool`): diffs larger than `diff_spool_size` are
+        written to a temporary file and memory mapped.
 
-    def api_req(self, method, url, data=None, media_type=None):
-        data = None if not data else json.dumps(data).encode("utf-8")
-        headers = {} if not data else {'Content-Type': 'application/json'}
-        req = urllib.request.Request(url, data, headers)
-        req.get_method = lambda: method
-        if self.integration_token:
-            req.add_header("Authorization", "token %s" % self.integration_token)
-
-        if media_type:
-            req.add_header("Accept", media_type)
-        f = urllib.request.urlopen(req)
-        header = f.info()
-        if header.get('Content-Encoding') == 'gzip':
-            buf = StringIO(f.read())
-            f = gzip.GzipFile(fileobj=buf)
-        body = f.read().decode("utf-8")
-        return {"header": header, "body": body}
+        Raises `DiffTooLarge` without reading the diff if GitHub reports it
+        is larger than `max_size` (for compressed diffs, the size of the
+        compressed diff), or when entering the context once more than
+        `max_size` bytes of the diff have been read.
+        """
+        f = self._open("GET", url, None, diff_media_type, stream=True)
+        length = f.headers.get('Content-Length')
+        length = None if length is None else int(length)
+        if max_size is not None and length is not None and length > max_size:
+            f.close()
+            raise DiffTooLarge(url)
+        return spool(f.raw, self.diff_spool_size, length, max_size)
+
+    def analyze_diff(self, url, max_size=None):
+        with self.fetch_diff(url, max_size) as diff:
+            return DiffAnalysis(diff)
+
+    def fetch_pr_files(self, url):
+        """List the files changed by a PR through the paginated files API."""
+        files = []
+        page = 1
+        while True:
+            entries = json.loads(
+                self.api_req("GET", pr_files_url % (url, page))['body']
+            )
+            files.extend(entries)
+            if len(entries) < 100:
+                return files
+            page += 1
+
+    def analyze_pr(self):
+        """Analyze the changes of the PR.
+
+        The whole diff is downloaded, unless the repo enables `file_stats` or
+        the PR is too large (by number of files or size of the diff). Then the
+        per-file stats come from the files API, and the full diff is only
+        downloaded if some content checks could not be done with the patches
+        returned by the API.
+        """
+        url = self.payload['pull_request', 'url']
+        use_files = self.repo_config.get('file_stats', False) or \
+            self.payload['pull_request', 'changed_files'] > \
+            file_stats_changed_files
+        too_large = False
+        if not use_files:
+            try:
+                return self.analyze_diff(url, file_stats_diff_size)
+            except DiffTooLarge:
+                too_large = True
+
+        analysis = DiffAnalysis.from_files(self.fetch_pr_files(url))
+        if analysis.incomplete and not too_large:
+            try:
+                analysis.update_flags(
+                    self.analyze_diff(url, file_stats_diff_size)
+                )
+            except DiffTooLarge:
+                print("diff of %s is too large to be checked" % url)
+        return analysis
+
+    def analyze_new_pr(self):
+        """Like `analyze_pr`, but nothing is downloaded (and None is
+        returned) if the budget of the event runs low: the reviewer is then
+        picked from the `all` group, and the warnings are posted from the
+        background."""
+        if self.deadline.low():
+            stats.incr('deadline.skipped_analyses')
+            return None
+        return self.analyze_pr()
 
     def set_assignee(self, assignee, owner, repo, issue, user, author, to_mention):
+        """Assign the issue. The comment mentioning `to_mention` is
+        queued."""
         if assignee == 'ghost':
             raise Exception("Skipping assignment: ghost user disables automation").with_traceback(None)
 
@@ -153,47 +252,158 @@ class HighfiveHandler(object):
                     message += '\n\n'
                 message += "%s %s" % (cmd, commands[cmd])
             if len(message) > 0:
-                self.post_comment(message, owner, repo, issue)
+                self.add_comment(message)
+
+    def author_association(self, username):
+        """Return the `author_association` of `username` in the payload if
+        they wrote the comment or the PR of the event, or None."""
+        for key in ('comment', 'pull_request'):
+            if self.payload.get((key, 'user', 'login')) == username:
+                return self.payload.get((key, 'author_association'))
+        return None
 
     def is_collaborator(self, commenter, owner, repo):
         """Returns True if `commenter` is a collaborator in the repo."""
+        if self.author_association(commenter) in collaborator_associations:
+            stats.incr('author_association.saved_requests')
+            return True
+        cached = self.collaborators.get(owner, repo, commenter)
+        if cached is not None:
+            return cached
         try:
             self.api_req(
                 "GET", user_collabo_url % (owner, repo, commenter), None
             )
-            return True
+            result = True
         except urllib.error.HTTPError as e:
             if e.code == 404:
-                return False
+                result = False
             else:
                 raise e
+        self.collaborators.put(owner, repo, commenter, result)
+        return result
+
+    def member_changed(self):
+        """Forget the cached collaborator status of a user added to or
+        removed from the repository."""
+        self.collaborators.invalidate(
+            self.payload['repository', 'owner', 'login'],
+            self.payload['repository', 'name'],
+            self.payload['member', 'login'],
+        )
 
-    def post_warnings(self, diff, owner, repo, issue):
+    def post_warnings(self, analysis, owner, repo, issue):
         warnings = []
 
         surprise = self.unexpected_branch()
         if surprise:
             warnings.append(surprise_branch_warning % surprise)
 
-        if self.modifies_submodule(diff):
+        if self.modifies_submodule(analysis):
             warnings.append(submodule_warning_msg)
 
-        if self.modifies_targets(diff):
+        if self.modifies_targets(analysis):
             warnings.append(targets_warning_msg)
 
         if warnings:
-            self.post_comment(warning_summary % '\n'.join(map(lambda x: '* ' + x, warnings)), owner, repo, issue)
+            self.add_comment(warning_summary % '\n'.join(map(lambda x: '* ' + x, warnings)))
+
+    def handle_warnings(self, analysis, owner, repo, issue):
+        """Queue the warnings, or post them in the background if the budget
+        of the event is running low, or the rate limit is exhausted."""
+        if self.deadline.low():
+            stats.incr('deadline.deferred_warnings')
+            self.defer_warnings(analysis, owner, repo, issue)
+        elif client.delay(post_comment_url) > 0:
+            stats.incr('ratelimit.deferred_warnings')
+            self.defer_warnings(analysis, owner, repo, issue)
+        else:
+            self.post_warnings(analysis, owner, repo, issue)
+
+    def defer_warnings(self, analysis, owner, repo, issue):
+        """Post the warnings as a separate comment from a background thread,
+        with a budget of their own. The PR is analyzed there if `analysis`
+        is None."""
+        handler = copy.copy(self)
+        handler.comments = []
+        handler.deadline = Deadline(self.deadline.seconds, self.deadline.reserve)
+
+        def run():
+            try:
+                handler.post_warnings(
+                    analysis if analysis is not None else handler.analyze_pr(),
+                    owner, repo, issue,
+                )
+                handler.flush_comments(owner, repo, issue)
+            except Exception:
+                print('Failed to post the deferred warnings of %s/%s#%s'
+                      % (owner, repo, issue))
+                print(traceback.format_exc())
+
+        thread = threading.Thread(target=run, name='deferred-warnings', daemon=True)
+        thread.start()
+        return thread
+
+    def add_comment(self, body):
+        """Queue a comment fragment, posted along with the other fragments
+        of the event by `flush_comments`."""
+        self.comments.append(body)
+
+    def flush_comments(self, owner, repo, issue):
+        """Post the queued fragments as a single comment."""
+        if self.comments:
+            body = '\n\n'.join(self.comments)
+            self.comments = []
+            self.post_comment(body, owner, repo, issue)
 
     def post_comment(self, body, owner, repo, issue):
-        try:
-            self.api_req(
-                "POST", post_comment_url % (owner, repo, issue), {"body": body}
-            )['body']
-        except urllib.error.HTTPError as e:
-            if e.code == 201:
-                pass
-            else:
-                raise e
+        """Post a comment, retrying on transient errors. A failed request
+        may still have created the comment, so before posting it again, the
+        comment is looked up (see `has_comment`)."""
+        # Leave some room for the clock skew with GitHub.
+        since = datetime.datetime.now(datetime.timezone.utc) - \
+            datetime.timedelta(minutes=5)
+        attempt = 0
+        while True:
+            try:
+                self.api_req(
+                    "POST", post_comment_url % (owner, repo, issue),
+                    {"body": body}
+                )['body']
+                return
+            except urllib.error.HTTPError as e:
+                if e.code == 201:
+                    return
+                if not self.can_retry(e, attempt):
+                    raise e
+            except OSError as e:
+                if not self.can_retry(e, attempt):
+                    raise e
+
+            self.retry.wait(attempt, 'comments', self.deadline.spare())
+            attempt += 1
+            if self.has_comment(body, owner, repo, issue, since):
+                stats.incr('retry.comments_found')
+                return
+
+    def can_retry(self, error, attempt):
+        # A comment is looked up before being posted again, so it can be
+        # retried after a timeout.
+        return is_transient(error, timeouts=True) and attempt < self.retry.retries and \
+            not self.deadline.low()
+
+    def has_comment(self, body, owner, repo, issue, since):
+        """Returns True if the integration user posted a comment with this
+        `body` on the issue after `since`."""
+        url = comments_since_url % (
+            post_comment_url % (owner, repo, issue),
+            since.strftime('%Y-%m-%dT%H:%M:%SZ'),
+        )
+        comments = json.loads(self.api_req("GET", url)['body'])
+        return any(
+            c['user']['login'] == self.integration_user and c['body'] == body
+            for c in comments
+        )
 
     def welcome_msg(self, reviewer):
         if reviewer is None:
@@ -222,6 +432,14 @@ class HighfiveHandler(object):
         return (expected_target, actual_target) \
             if expected_target != actual_target else False
 
+    def check_new_contributor(self, username, owner, repo):
+        """Like `is_new_contributor`, but the check is skipped (and the user
+        isn't welcomed) if the budget of the event runs low."""
+        if self.deadline.low():
+            stats.incr('deadline.skipped_contributor_checks')
+            return False
+        return self.is_new_contributor(username, owner, repo)
+
     def is_new_contributor(self, username, owner, repo):
         # If this is a fork, we do not treat anyone as a new user. This is
         # because the API endpoint called in this function indicates all
@@ -229,29 +447,52 @@ class HighfiveHandler(object):
         if self.payload['repository', 'fork']:
             return False
 
+        association = self.author_association(username)
+        if association in new_contributor_associations:
+            stats.incr('author_association.saved_requests')
+            return new_contributor_associations[association]
+
+        if self.contributor_index is not None and \
+                self.contributor_index.contains(owner, repo, username):
+            return False
+
+        if self.contributors is not None:
+            contributed = self.contributors.get(owner, repo, username)
+            if contributed is not None:
+                return not contributed
+
+        url = commit_search_url % (owner, repo, username)
+        if client.delay(url) > 0:
+            # Don't hold the event until the search rate limit is reset:
+            # the user isn't welcomed.
+            stats.incr('ratelimit.skipped_contributor_checks')
+            return False
         try:
             result = self.api_req(
-                'GET', commit_search_url % (owner, repo, username), None,
+                'GET', url, None,
                 'application/vnd.github.cloak-preview'
             )
-            return json.loads(result['body'])['total_count'] == 0
+            new = json.loads(result['body'])['total_count'] == 0
         except urllib.error.HTTPError as e:
             if e.code == 422:
-                return True
+                new = True
             else:
                 raise e
-
-    def get_groups(self):
-        groups = deepcopy(self.repo_config['groups'] if 'groups' in self.repo_config else {})
-
-        # fill in the default groups, ensuring that overwriting is an
-        # error.
-        global_ = self._load_json_file('_global.json')
-        for name, people in global_['groups'].items():
-            assert name not in groups, "group %s overlaps with _global.json" % name
-            groups[name] = people
-
-        return groups
+        if self.contributors is not None:
+            self.contributors.put(owner, repo, username, not new)
+        return new
+
+    def pr_closed(self):
+        """Record the author of a merged PR as a contributor."""
+        if not self.payload['pull_request', 'merged']:
+            return
+        owner = self.payload['pull_request', 'base', 'repo', 'owner', 'login']
+        repo = self.payload['pull_request', 'base', 'repo', 'name']
+        author = self.payload['pull_request', 'user', 'login']
+        if self.contributor_index is not None:
+            self.contributor_index.add(owner, repo, author)
+        if self.contributors is not None:
+            self.contributors.put(owner, repo, author, True)
 
     def find_reviewer(self, msg, exclude):
         """
@@ -261,9 +502,9 @@ class HighfiveHandler(object):
         if msg is not None:
             match = reviewer_re.search(msg)
             if match:
-                groups = self.get_groups()
-                potential = groups.get(match.group(2)) or groups.get("%s/%s" % (match.group(1), match.group(2))) or []
-                picked = self.pick_reviewer(groups, potential, exclude)
+                groups = self.repo_config.groups
+                potential = groups.get(match.group(2)) or groups.get("%s/%s" % (match.group(1), match.group(2))) or frozenset()
+                picked = self.pick_reviewer(potential, exclude)
                 if picked:
                     return picked
                 if match.group(1) is None and match.group(2):
@@ -271,46 +512,27 @@ class HighfiveHandler(object):
                         return match.group(2)[1:]
 
 
-    def choose_reviewer(self, repo, owner, diff, exclude):
+    def choose_reviewer(self, repo, owner, analysis, exclude):
         """Choose a reviewer for the PR."""
-        # Get JSON data on reviewers.
-        dirs = self.repo_config.get('dirs', {})
-        groups = self.get_groups()
+        # Get the compiled reviewers of each `dirs` entry and group.
+        dirs = self.repo_config.dirs
+        groups = self.repo_config.groups
 
         # Map of `dirs` path to the number of changes found in that path.
         counts = {}
         # If there's directories with specially assigned groups/users
         # inspect the diff to find the directory with the most additions
-        if dirs:
-            # List of the longest `dirs` paths that match the current path.
-            # This is a list to handle the situation if multiple paths of the
-            # same length match.
-            longest_dir_paths = []
-            for line in diff.split('\n'):
-                if line.startswith("diff --git "):
-                    # update longest_dir_paths
-                    longest_dir_paths = []
-                    parts = line[line.find(" b/") + len(" b/"):].split("/")
-                    if not parts:
-                        continue
-
-                    # Find the longest `dirs` entries that match this path.
-                    longest = {}
-                    for dir_path in dirs:
-                        dir_parts = dir_path.split('/')
-                        if parts[:len(dir_parts)] == dir_parts:
-                            longest[dir_path] = len(dir_parts)
-                    max_count = max(longest.values(), default=0)
-                    longest_dir_paths = [
-                        path for (path, count) in longest.items()
-                            if count == max_count
-                    ]
+        # (if the PR was analyzed).
+        if dirs and analysis is not None:
+            for record in analysis.files:
+                if not record.changes:
                     continue
-
-                if ((not line.startswith('+++')) and line.startswith('+')) or \
-                   ((not line.startswith('---')) and line.startswith('-')):
-                    for path in longest_dir_paths:
-                        counts[path] = counts.get(path, 0) + 1
+                # Count the changes towards the longest `dirs` entries that
+                # match this path. This is a list to handle the situation if
+                # multiple paths of the same length match.
+                parts = record.path.split('/')
+                for path in self.repo_config.dirs_trie.longest_matches(parts):
+                    counts[path] = counts.get(path, 0) + record.changes
 
         # `all` is always included.
         potential = groups['all']
@@ -318,70 +540,41 @@ class HighfiveHandler(object):
         max_count = max(counts.values(), default=0)
         max_paths = [path for (path, count) in counts.items() if count == max_count]
         for path in max_paths:
-            potential.extend(dirs[path])
+            potential = potential | dirs[path]
         if not potential:
-            potential = groups['core']
-
-        return self.pick_reviewer(groups, potential, exclude)
-
-    def pick_reviewer(self, groups, potential, exclude):
-        # expand the reviewers list by group
-        reviewers = []
-        seen = {"all"}
-        while potential:
-            p = potential.pop()
-            if p.startswith('@'):
-                # remove the '@' prefix from each username
-                username = p[1:]
-
-                # If no one should be excluded add the reviewer
-                if exclude == None:
-                    reviewers.append(username)
-
-                # ensure we don't assign someone to their own PR due with a case-insensitive test
-                elif username.lower() != exclude.lower():
-                    reviewers.append(username)
-            elif p in groups:
-                # avoid infinite loops
-                if p not in seen:
-                    seen.add(p)
-                    # we allow groups in groups, so they need to be queued to be resolved
-                    potential.extend(groups[p])
+            potential = groups.get('core', frozenset())
+
+        return self.pick_reviewer(potential, exclude)
+
+    def pick_reviewer(self, potential, exclude):
+        """Pick a random reviewer out of the `potential` set of usernames."""
+        reviewers = potential
+        if exclude is not None:
+            # ensure we don't assign someone to their own PR due with a case-insensitive test
+            exclude = exclude.lower()
+            reviewers = [r for r in reviewers if r.lower() != exclude]
 
         if reviewers:
             random.seed()
-            return random.choice(reviewers)
+            # sort the reviewers, as the iteration order of sets is arbitrary
+            return random.choice(sorted(reviewers))
         # no eligible reviewer found
         return None
 
-    def get_to_mention(self, diff, author):
+    def get_to_mention(self, analysis, author):
         """
         Get the list of people to mention.
         """
         mentions = self.repo_config.get('mentions', {})
-        if not mentions:
+        if not mentions or analysis is None:
             return []
 
+        matcher = self.repo_config.mentions_matcher
         to_mention = set()
-        # If there's directories with specially assigned groups/users
-        # inspect the diff to find the directory with the most additions
-        for line in diff.split('\n'):
-            if line.startswith("diff --git "):
-                parts = line[line.find(" b/") + len(" b/"):].split("/")
-                if not parts:
-                    continue
-                full_dir = "/".join(parts)
-
-                if len(full_dir) > 0:
-                    for entry in mentions:
-                        # Check if this entry is a prefix
-                        eparts = entry.split("/")
-                        if (len(eparts) <= len(parts) and
-                            all(a==b for a,b in zip(parts, eparts))
-                        ):
-                            to_mention.add(entry)
-                        elif entry.endswith('.rs') and full_dir.endswith(entry):
-                            to_mention.add(entry)
+        # Find the mentions entries matching each file touched by the diff.
+        for record in analysis.files:
+            if len(record.path) > 0:
+                to_mention.update(matcher.matches(record.path))
 
         mention_list = []
         for mention in to_mention:
@@ -393,51 +586,75 @@ class HighfiveHandler(object):
     def add_labels(self, owner, repo, issue):
         self.api_req(
             'POST', issue_labels_url % (owner, repo, issue),
-            self.repo_config['new_pr_labels']
+            list(self.repo_config['new_pr_labels'])
         )
 
+    def select_reviewer(self, analysis, owner, repo, author):
+        """Return the reviewer of a new PR, and whether highfive chose it
+        (rather than the PR body requesting it)."""
+        reviewer = self.find_reviewer(
+            self.payload['pull_request', 'body'], author
+        )
+        if reviewer:
+            return reviewer, False
+        return self.choose_reviewer(repo, owner, analysis, author), True
+
     def new_pr(self):
+        asyncio.run(self.new_pr_async())
+
+    async def call_blocking(self, func, *args):
+        """Run a blocking call of the new PR flow. The calls are made one
+        after the other, in the order the flow awaits them."""
+        return func(*args)
+
+    async def new_pr_async(self):
         owner = self.payload['pull_request', 'base', 'repo', 'owner', 'login']
         repo = self.payload['pull_request', 'base', 'repo', 'name']
 
         author = self.payload['pull_request', 'user', 'login']
         issue = str(self.payload["number"])
-        diff = self.api_req(
-            "GET", self.payload["pull_request", "url"], None,
-            "application/vnd.github.v3.diff",
-        )['body']
+
+        # Adding labels leaves the existing ones alone, and can be done at
+        # any time.
+        labels = None
+        if self.repo_config.get("new_pr_labels"):
+            labels = asyncio.create_task(
+                self.call_blocking(self.add_labels, owner, repo, issue)
+            )
 
         if not self.payload['pull_request', 'assignees']:
-            # Only try to set an assignee if one isn't already set.
-            msg = self.payload['pull_request', 'body']
-            reviewer = self.find_reviewer(msg, author)
-            post_msg = False
-
-            if not reviewer:
-                post_msg = True
-                reviewer = self.choose_reviewer(
-                    repo, owner, diff, author
-                )
-            to_mention = self.get_to_mention(diff, author)
+            # Analyze the changes once, everything below only looks at the
+            # analysis.
+            analysis, new_contributor = await asyncio.gather(
+                self.call_blocking(self.analyze_new_pr),
+                self.call_blocking(
+                    self.check_new_contributor, author, owner, repo
+                ),
+            )
+            reviewer, post_msg = self.select_reviewer(
+                analysis, owner, repo, author
+            )
+            to_mention = self.get_to_mention(analysis, author)
 
-            self.set_assignee(
-                reviewer, owner, repo, issue, self.integration_user,
-                author, to_mention
+            await self.call_blocking(
+                self.set_assignee, reviewer, owner, repo, issue,
+                self.integration_user, author, to_mention
             )
 
-            if self.is_new_contributor(author, owner, repo):
-                self.post_comment(
-                    self.welcome_msg(reviewer), owner, repo, issue
-                )
+            if new_contributor:
+                self.add_comment(self.welcome_msg(reviewer))
             elif post_msg:
-                self.post_comment(
-                    self.review_msg(reviewer, author), owner, repo, issue
-                )
+                self.add_comment(self.review_msg(reviewer, author))
+        else:
+            analysis = await self.call_blocking(self.analyze_new_pr)
 
-        self.post_warnings(diff, owner, repo, issue)
+        self.handle_warnings(analysis, owner, repo, issue)
 
-        if self.repo_config.get("new_pr_labels"):
-            self.add_labels(owner, repo, issue)
+        # Everything highfive has to say about the PR is in one comment.
+        writes = [self.call_blocking(self.flush_comments, owner, repo, issue)]
+        if labels is not None:
+            writes.append(labels)
+        await asyncio.gather(*writes)
 
     def new_comment(self):
         # Check the issue is a PR and is open.
@@ -475,3 +692,17 @@ class HighfiveHandler(object):
             return f"set assignee to {reviewer}"
         else:
             return "no reviewer found"
+
+
+class AsyncHighfiveHandler(HighfiveHandler):
+    """A handler running the independent API calls of a new PR
+    concurrently.
+
+    The calls themselves are blocking, and run in worker threads sharing the
+    connection pool of the client: downloading the diff overlaps with the
+    new contributor check, and the labels are added while the assignee is
+    set and the comment is posted. The assignment is still done before the
+    comment is posted.
+    """
+    async def call_blocking(self, func, *args):
+        return await asyncio.to_thread(func, *args)
@@ -0,0 +1,146 @@
+import re
+
+
+class _Node(object):
+    __slots__ = ('children', 'entries')
+
+    def __init__(self):
+        self.children = {}
+        self.entries = []
+
+
+class PathTrie(object):
+    """A trie of `/`-separated paths, split into their components.
+
+    Looking up the entries matching a path costs O(depth of the path),
+    regardless of how many entries the trie contains. An entry matches a path
+    if its components are a prefix of the path components, so `src/lib`
+    matches `src/lib/foo.rs` but not `src/libfoo.rs`.
+    """
+    def __init__(self, entries=()):
+        self._root = _Node()
+        for entry in entries:
+            self.add(entry)
+
+    def add(self, entry):
+        node = self._root
+        for part in entry.split('/'):
+            node = node.children.setdefault(part, _Node())
+        node.entries.append(entry)
+
+    def _walk(self, parts):
+        node = self._root
+        for part in parts:
+            node = node.children.get(part)
+            if node is None:
+                return
+            if node.entries:
+                yield node
+
+    def matches(self, parts):
+        """Return every entry matching the path split into `parts`."""
+        return [entry for node in self._walk(parts) for entry in node.entries]
+
+    def longest_matches(self, parts):
+        """Return the longest entries matching the path split into `parts`.
+        This is a list, as multiple entries can have the same length."""
+        longest = []
+        for node in self._walk(parts):
+            longest = node.entries
+        return list(longest)
+
+
+class SuffixTrie(object):
+    """A trie of reversed strings, finding every entry that is a suffix of a
+    string in O(length of the string)."""
+    def __init__(self, entries=()):
+        self._root = _Node()
+        for entry in entries:
+            self.add(entry)
+
+    def add(self, entry):
+        node = self._root
+        for char in reversed(entry):
+            node = node.children.setdefault(char, _Node())
+        node.entries.append(entry)
+
+    def matches(self, string):
+        """Return every entry `string` ends with."""
+        result = []
+        node = self._root
+        for char in reversed(string):
+            node = node.children.get(char)
+            if node is None:
+                break
+            result.extend(node.entries)
+        return result
+
+
+def glob_to_regex(glob):
+    """Translate a glob into a regular expression. `*` matches anything
+    inside a single path component, while `**` matches across components."""
+    result = []
+    i = 0
+    while i < len(glob):
+        if glob.startswith('**/', i):
+            result.append('(?:.*/)?')
+            i += 3
+        elif glob.startswith('**', i):
+            result.append('.*')
+            i += 2
+        elif glob[i] == '*':
+            result.append('[^/]*')
+            i += 1
+        else:
+            result.append(re.escape(glob[i]))
+            i += 1
+    return ''.join(result)
+
+
+class GlobSet(object):
+    """A set of globs compiled into a single regular expression, which finds
+    every glob matching a path (or one of its parent directories) in one
+    pass."""
+    def __init__(self, globs=()):
+        self._globs = list(globs)
+        # Every glob is an optional lookahead with an empty capture group:
+        # the group participates in the match only if the glob matched.
+        self._re = re.compile('^' + ''.join(
+            '(?:(?=(?:%s)(?:/|$))())?' % glob_to_regex(glob)
+            for glob in self._globs
+        ))
+
+    def matches(self, path):
+        if not self._globs:
+            return []
+        groups = self._re.match(path).groups()
+        return [
+            glob for (glob, group) in zip(self._globs, groups)
+            if group is not None
+        ]
+
+
+class MentionMatcher(object):
+    """Finds the `mentions` entries matching a path.
+
+    An entry matches if:
+    - it is a directory or file prefix of the path (`src/doc`),
+    - it ends with `.rs` and the path ends with it (`error_codes.rs`),
+    - it contains `*` and the path or one of its parent directories matches
+      it as a glob (`library/*/src/**/*.rs`).
+    """
+    def __init__(self, entries=()):
+        entries = list(entries)
+        globs = [e for e in entries if '*' in e]
+        plain = [e for e in entries if '*' not in e]
+
+        self._prefixes = PathTrie(plain)
+        self._suffixes = SuffixTrie(e for e in plain if e.endswith('.rs'))
+        self._globs = GlobSet(globs)
+
+    def matches(self, path):
+        """Return the set of entries matching `path`."""
+        result = set(self._prefixes.matches(path.split('/')))
+        result.update(self._suffixes.matches(path))
+        result.update(self._globs.matches(path))
+        return result
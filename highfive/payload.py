@@ -19,3 +19,11 @@ class Payload(object):
             inc = inc[k]
 
         return inc
+
+    def get(self, keys, default=None):
+        """Like indexing, but returns `default` if any of the keys is
+        missing."""
+        try:
+            return self[keys]
+        except (KeyError, TypeError):
+            return default
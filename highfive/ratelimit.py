@@ -0,0 +1,193 @@
+import random
+import threading
+import time
+
+from .stats import stats
+
+# The number of requests to each GitHub API resource sent in a burst, before
+# the following ones are spread over what is left of the rate limit window.
+default_bursts = {
+    'core': 20,
+    'search': 5,
+}
+
+
+def resource_for(url):
+    """Return the GitHub rate limit resource a request to `url` counts
+    against."""
+    return 'search' if '/search/' in url else 'core'
+
+
+class TokenBucket(object):
+    """A token bucket holding at most `capacity` tokens, refilled at `rate`
+    tokens per second. It doesn't hold anything back while `rate` is None.
+    Not thread-safe."""
+    def __init__(self, capacity, clock=time.time):
+        self.capacity = capacity
+        self.clock = clock
+        self.rate = None
+        self._tokens = capacity
+        self._updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        if self.rate is not None:
+            self._tokens = min(
+                self.capacity,
+                self._tokens + (now - self._updated) * self.rate,
+            )
+        self._updated = now
+
+    def set_rate(self, rate):
+        self._refill()
+        self.rate = rate
+
+    def take(self, max_wait=None):
+        """Take a token, and return how long to wait before using it, at
+        most `max_wait` seconds if given. Tokens are taken ahead when the
+        bucket is empty, so concurrent callers are given increasing waits,
+        but never more than they wait for."""
+        self._refill()
+        if self.rate is None:
+            return 0
+        self._tokens -= 1
+        if self._tokens >= 0:
+            return 0
+        wait = -self._tokens / self.rate
+        if max_wait is not None and wait > max_wait:
+            wait = max_wait
+            self._tokens = -wait * self.rate
+        return wait
+
+
+class Budget(object):
+    """What GitHub reported about the remaining requests of a resource."""
+    __slots__ = ('limit', 'remaining', 'reset')
+
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+
+
+class RateLimiter(object):
+    """Paces the requests to the GitHub API, and tells how long to back off
+    when GitHub rate limits them.
+
+    The core and search resources are tracked separately, with a `Budget`
+    updated from the `X-RateLimit-*` headers of every response. After a
+    burst (see `default_bursts`), requests are paced by a token bucket
+    refilled at the rate which spreads the remaining budget until it is
+    reset, so that they neither exhaust it nor come in bursts tripping the
+    secondary rate limits. Once the budget is exhausted, requests wait until
+    it is reset. Nothing is paced until GitHub reports a budget. No request
+    waits more than `max_wait` seconds.
+
+    The remaining budget of every resource is exported as the
+    `ratelimit.<resource>.remaining` stats.
+    """
+    def __init__(self, bursts=None, max_wait=60, base_delay=1,
+                 clock=time.time, sleep=time.sleep):
+        self.max_wait = max_wait
+        self.base_delay = base_delay
+        self.clock = clock
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._budgets = {}
+        for resource, burst in (bursts or default_bursts).items():
+            self._buckets[resource] = TokenBucket(burst, clock)
+            self._budgets[resource] = Budget()
+
+    def remaining(self, resource):
+        with self._lock:
+            return self._budgets[resource].remaining
+
+    def delay(self, resource):
+        """Return how long a request to `resource` would wait for its budget
+        to be reset before being sent."""
+        with self._lock:
+            return self._delay(self._budgets[resource])
+
+    def _delay(self, budget):
+        if budget.remaining is None or budget.remaining > 0 or \
+                budget.reset is None:
+            return 0
+        return max(0, budget.reset - self.clock())
+
+    def acquire(self, resource, max_wait=None):
+        """Wait until a request to `resource` can be sent, or at most
+        `max_wait` seconds if given."""
+        if max_wait is None or max_wait > self.max_wait:
+            max_wait = self.max_wait
+        with self._lock:
+            budget = self._budgets[resource]
+            wait = self._delay(budget)
+            if wait == 0:
+                wait = self._buckets[resource].take(max_wait)
+            if budget.remaining is not None and budget.remaining > 0:
+                # Count the request before GitHub reports it, so that
+                # concurrent requests don't all use the last one.
+                budget.remaining -= 1
+        self._wait(wait, max_wait)
+
+    def _rate(self, budget):
+        """Return the rate spreading the remaining budget until it is reset,
+        or None if it isn't known."""
+        if budget.remaining is None or budget.remaining <= 0 or \
+                budget.reset is None:
+            return None
+        window = budget.reset - self.clock()
+        if window <= 0:
+            return None
+        return budget.remaining / window
+
+    def update(self, resource, headers):
+        """Record the budget reported by the headers of a response."""
+        if 'X-RateLimit-Remaining' not in headers:
+            return
+        resource = headers.get('X-RateLimit-Resource', resource)
+        with self._lock:
+            budget = self._budgets.get(resource)
+            if budget is None:
+                return
+            budget.remaining = int(headers['X-RateLimit-Remaining'])
+            if 'X-RateLimit-Limit' in headers:
+                budget.limit = int(headers['X-RateLimit-Limit'])
+            if 'X-RateLimit-Reset' in headers:
+                budget.reset = int(headers['X-RateLimit-Reset'])
+            self._buckets[resource].set_rate(self._rate(budget))
+
+    @staticmethod
+    def is_rate_limited(status, headers, body):
+        """Returns True if a response means the request was rate limited,
+        rather than denied."""
+        if status == 429:
+            return True
+        if status != 403:
+            return False
+        return 'Retry-After' in headers or \
+            headers.get('X-RateLimit-Remaining') == '0' or \
+            b'rate limit' in body
+
+    def backoff(self, attempt, headers, max_wait=None):
+        """Wait before retrying a rate limited request. `Retry-After` and
+        `X-RateLimit-Reset` are honored, otherwise the delay grows
+        exponentially with `attempt`, with jitter."""
+        if 'Retry-After' in headers:
+            delay = int(headers['Retry-After'])
+        elif headers.get('X-RateLimit-Remaining') == '0' and \
+                'X-RateLimit-Reset' in headers:
+            delay = int(headers['X-RateLimit-Reset']) - self.clock()
+        else:
+            delay = self.base_delay * 2 ** attempt
+        stats.incr('ratelimit.backoffs')
+        self._wait(delay * random.uniform(1, 1.5), max_wait)
+
+    def _wait(self, delay, max_wait=None):
+        delay = min(delay, self.max_wait)
+        if max_wait is not None:
+            delay = min(delay, max_wait)
+        if delay > 0:
+            stats.incr('ratelimit.wait_seconds', delay)
+            self.sleep(delay)
@@ -0,0 +1,251 @@
+import json
+import os
+import threading
+import time
+import traceback
+from collections.abc import Mapping
+from types import MappingProxyType
+
+from .paths import MentionMatcher, PathTrie
+from .stats import stats
+
+
+class UnsupportedRepoError(IOError):
+    pass
+
+
+def default_config_dir():
+    return os.path.join(os.path.dirname(__file__), 'configs')
+
+
+def load_json_file(config_dir, name):
+    with open(os.path.join(config_dir, name)) as config:
+        return json.load(config)
+
+
+def find_config_files(config_dir):
+    """Return the `(org, filename)` of every repository configuration file
+    in `config_dir`."""
+    result = []
+    for org in os.listdir(config_dir):
+        org_dir = os.path.join(config_dir, org)
+        if not os.path.isdir(org_dir):
+            continue
+        for fname in os.listdir(org_dir):
+            if fname.endswith('.json'):
+                result.append((org, fname))
+    return result
+
+
+def freeze(value):
+    """Recursively convert a decoded JSON value into read-only containers:
+    objects become mapping proxies and arrays become tuples."""
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def expand_reviewers(groups, potential):
+    """Expand a list of `@user` and group entries into the set of usernames
+    (without the `@` prefix) they refer to. Groups can contain other groups;
+    references to the `all` group and cycles are not followed."""
+    reviewers = set()
+    seen = {'all'}
+    potential = list(potential)
+    while potential:
+        p = potential.pop()
+        if p.startswith('@'):
+            reviewers.add(p[1:])
+        elif p in groups and p not in seen:
+            seen.add(p)
+            potential.extend(groups[p])
+    return frozenset(reviewers)
+
+
+def merge_groups(groups, global_groups):
+    """Merge the repository groups with the global ones."""
+    groups = dict(groups)
+    # fill in the default groups, ensuring that overwriting is an error.
+    for name, people in global_groups.items():
+        assert name not in groups, "group %s overlaps with _global.json" % name
+        groups[name] = people
+    return groups
+
+
+def compile_groups(groups):
+    """Flatten every group into the frozenset of usernames it transitively
+    contains."""
+    return MappingProxyType({
+        name: expand_reviewers(groups, people)
+        for name, people in groups.items()
+    })
+
+
+class RepoConfig(Mapping):
+    """The frozen configuration of a repository, along with the structures
+    compiled from it when the configuration is loaded.
+
+    `groups` maps every group name (including the global ones) to the
+    frozenset of usernames it contains, and `dirs` maps every `dirs` entry to
+    the frozenset of usernames eligible to review it. `dirs_trie` indexes the
+    `dirs` entries by path component, and `mentions_matcher` finds the
+    `mentions` entries matching a path.
+    """
+    def __init__(self, config, global_):
+        self._config = freeze(config)
+        entries = merge_groups(
+            self._config.get('groups', {}), freeze(global_).get('groups', {})
+        )
+        self.groups = compile_groups(entries)
+        self.dirs = MappingProxyType({
+            path: expand_reviewers(entries, people)
+            for path, people in self._config.get('dirs', {}).items()
+        })
+        self.dirs_trie = PathTrie(self.dirs)
+        self.mentions_matcher = MentionMatcher(self._config.get('mentions', {}))
+
+    def __getitem__(self, key):
+        return self._config[key]
+
+    def __iter__(self):
+        return iter(self._config)
+
+    def __len__(self):
+        return len(self._config)
+
+
+class ConfigRegistry(object):
+    """Read-only index of every repository configuration, keyed by the
+    `org/repo` name of the repository.
+
+    The registry is built once (usually at startup, see `load`) and shared by
+    every webhook, so looking up a configuration never touches the disk.
+    Building the registry compiles every configuration, so an invalid one
+    (e.g. a group overlapping with `_global.json`) fails the load.
+
+    `generation` is incremented every time `ConfigWatcher` publishes a new
+    registry, and identifies the configuration snapshot a webhook used.
+    """
+    def __init__(self, repos, global_, generation=0):
+        self.generation = generation
+        self.global_config = freeze(global_)
+        self._repos = MappingProxyType({
+            name: RepoConfig(config, self.global_config)
+            for name, config in repos.items()
+        })
+
+    @classmethod
+    def load(cls, config_dir=None, generation=0):
+        """Load `_global.json` and every `<org>/<repo>.json` file below
+        `config_dir` (defaulting to the configs bundled with highfive)."""
+        if not config_dir:
+            config_dir = default_config_dir()
+
+        repos = {}
+        for org, fname in find_config_files(config_dir):
+            name = '%s/%s' % (org, fname[:-len('.json')])
+            repos[name] = load_json_file(os.path.join(config_dir, org), fname)
+
+        return cls(
+            repos, load_json_file(config_dir, '_global.json'), generation
+        )
+
+    def __contains__(self, full_name):
+        return full_name in self._repos
+
+    def __len__(self):
+        return len(self._repos)
+
+    def __iter__(self):
+        return iter(self._repos)
+
+    def repo_config(self, full_name):
+        """Return the configuration of the `org/repo` repository, raising
+        `UnsupportedRepoError` if highfive is not configured for it."""
+        try:
+            return self._repos[full_name]
+        except KeyError:
+            raise UnsupportedRepoError(full_name)
+
+
+class ConfigWatcher(object):
+    """Keeps the current `ConfigRegistry` of a configuration directory, and
+    reloads it when the files in the directory change.
+
+    A new registry is only published once it has been loaded and compiled
+    successfully, by replacing the `registry` attribute. Webhooks read that
+    attribute once and use the snapshot for the whole delivery, so they are
+    not affected by a reload happening while they run.
+
+    Changes are detected by polling the modification time and size of the
+    configuration files every `interval` seconds.
+    """
+    def __init__(self, config_dir=None, interval=30):
+        self.config_dir = config_dir or default_config_dir()
+        self.interval = interval
+
+        self._signature = self.signature()
+        self.registry = ConfigRegistry.load(self.config_dir)
+        self._thread = None
+
+        stats.gauge('config.generation', lambda: self.registry.generation)
+        stats.gauge('config.repos', lambda: len(self.registry))
+
+    def signature(self):
+        """Return a value that changes whenever a configuration file is
+        added, removed or modified."""
+        names = [('', '_global.json')] + sorted(
+            find_config_files(self.config_dir)
+        )
+        result = []
+        for org, fname in names:
+            try:
+                st = os.stat(os.path.join(self.config_dir, org, fname))
+            except OSError:
+                continue
+            result.append((org, fname, st.st_mtime_ns, st.st_size))
+        return tuple(result)
+
+    def check(self):
+        """Reload the configuration if it changed since the last check.
+        Returns True if a new registry was published."""
+        signature = self.signature()
+        if signature == self._signature:
+            return False
+        self._signature = signature
+
+        try:
+            registry = ConfigRegistry.load(
+                self.config_dir, self.registry.generation + 1
+            )
+        except (OSError, ValueError, AssertionError):
+            # Keep serving the previous snapshot until the files are fixed.
+            print('Failed to reload the configuration, keeping generation %d'
+                  % self.registry.generation)
+            print(traceback.format_exc())
+            stats.incr('config.reload_failures')
+            return False
+
+        self.registry = registry
+        print('Loaded configuration generation %d (%d repositories)'
+              % (registry.generation, len(registry)))
+        return True
+
+    def start(self):
+        """Start polling the configuration directory in the background."""
+        if self._thread is not None or not self.interval:
+            return
+        self._thread = threading.Thread(
+            target=self._run, name='config-watcher', daemon=True
+        )
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception:
+                print(traceback.format_exc())
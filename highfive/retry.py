@@ -0,0 +1,55 @@
+import random
+import time
+import urllib.error
+
+import requests
+
+from .stats import stats
+
+# Statuses GitHub answers when it fails to process a request, and that are
+# usually gone when the request is repeated.
+transient_statuses = frozenset([500, 502, 503, 504])
+# The methods whose requests can be repeated without changing the result.
+# PATCH requests to the GitHub API set fields to the given values, so they
+# are idempotent too.
+idempotent_methods = frozenset(['GET', 'HEAD', 'PUT', 'PATCH', 'DELETE'])
+
+
+def is_transient(error, timeouts=False):
+    """Returns True if a request failing with `error` may succeed if it is
+    repeated. A request timing out while waiting for the response may have
+    been processed by GitHub, so timeouts are only transient with
+    `timeouts`, if the caller checks that before repeating it."""
+    if isinstance(error, urllib.error.HTTPError):
+        return error.code in transient_statuses
+    if timeouts and isinstance(error, requests.Timeout):
+        return True
+    return isinstance(error, requests.ConnectionError)
+
+
+class RetryPolicy(object):
+    """Bounded exponential backoff: a failed call is attempted again at most
+    `retries` times, waiting `base_delay * 2 ** attempt` seconds (at most
+    `max_delay`, with jitter) before each retry.
+
+    Retries are counted in the `retry.<name>` stats.
+    """
+    def __init__(self, retries=3, base_delay=0.5, max_delay=8,
+                 sleep=time.sleep):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+
+    def delay(self, attempt):
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return delay * random.uniform(0.5, 1)
+
+    def wait(self, attempt, name, max_wait=None):
+        """Wait before retrying after the failure of `attempt` (counting
+        from 0), at most `max_wait` seconds if given."""
+        stats.incr('retry.%s' % name)
+        delay = self.delay(attempt)
+        if max_wait is not None:
+            delay = min(delay, max_wait)
+        self.sleep(delay)
@@ -0,0 +1,49 @@
+import threading
+
+
+class Stats(object):
+    """Process-wide counters and gauges, exported by the `/stats` endpoint.
+
+    Counters are incremented with `incr`. Gauges are either set explicitly
+    with `set`, or registered as a callable with `gauge`, in which case they
+    are evaluated every time a snapshot is taken.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._gauges = {}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + value
+
+    def set(self, name, value):
+        with self._lock:
+            self._values[name] = value
+
+    def gauge(self, name, func):
+        with self._lock:
+            self._gauges[name] = func
+
+    def get(self, name, default=0):
+        with self._lock:
+            gauge = self._gauges.get(name)
+            if gauge is None:
+                return self._values.get(name, default)
+        return gauge()
+
+    def snapshot(self):
+        with self._lock:
+            result = dict(self._values)
+            gauges = list(self._gauges.items())
+        for name, func in gauges:
+            result[name] = func()
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+            self._gauges.clear()
+
+
+stats = Stats()
@@ -15,6 +15,21 @@ def get_fake_filename(name):
     return os.path.join(os.path.dirname(__file__), 'fakes', name)
 
 
+class FakeClock(object):
+    """A clock standing still at `now`, moved by the tests and by `sleep`,
+    which records the delays."""
+    def __init__(self, now=0):
+        self.now = now
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, delay):
+        self.sleeps.append(delay)
+        self.now += delay
+
+
 def get_repo_configs():
     return {
         'individuals_no_dirs': {
@@ -126,7 +141,8 @@ class Payload(object):
     @staticmethod
     def new_pr(
             number=7, pr_body='The PR comment.', pr_url='https://the.url/',
-            repo_name='repo-name', repo_owner='repo-owner', pr_author='prAuthor'
+            repo_name='repo-name', repo_owner='repo-owner', pr_author='prAuthor',
+            author_association='NONE'
     ):
         with open(get_fake_filename('open-pr.payload'), 'r') as fin:
             p = json.load(fin)
@@ -137,6 +153,7 @@ class Payload(object):
         p['pull_request']['base']['repo']['name'] = repo_name
         p['pull_request']['base']['repo']['owner']['login'] = repo_owner
         p['pull_request']['user']['login'] = pr_author
+        p['pull_request']['author_association'] = author_association
 
         return payload.Payload(p)
 
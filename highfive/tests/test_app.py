@@ -0,0 +1,269 @@
+import json
+
+import pytest
+from click.testing import CliRunner
+
+from highfive.app import create_app, lane_key, replay, run_job, watch_jobs
+from highfive.deliveries import DeliveryLog
+from highfive.jobs import DEAD, DONE, FAILED, PENDING, JobQueue
+from highfive.registry import ConfigRegistry
+from highfive.tests.fakes import FakeClock
+from highfive.tests.patcherize import patcherize
+from highfive.worker import QueueFull
+
+
+class FakePool(object):
+    """Keeps the submitted jobs instead of running them, or rejects them
+    once `full`."""
+    def __init__(self):
+        self.submitted = []
+        self.full = False
+
+    def submit(self, func, *args, key=None):
+        if self.full:
+            raise QueueFull()
+        self.submitted.append((func, args, key))
+
+    def run(self):
+        submitted, self.submitted = self.submitted, []
+        for func, args, key in submitted:
+            func(*args)
+
+
+class FakeWatcher(object):
+    def __init__(self):
+        self.registry = ConfigRegistry(
+            {'rust-lang/rust': {'groups': {'all': ['@pnkfelix']}}},
+            {'groups': {}},
+        )
+
+
+class StopWatching(Exception):
+    pass
+
+
+def pr_payload(number=7, repo='rust-lang/rust'):
+    return {'number': number, 'repository': {'full_name': repo}}
+
+
+class AppTest(object):
+    @pytest.fixture(autouse=True)
+    def make_app(self, patcherize, tmp_path):
+        self.mocks = patcherize((
+            ('handler', 'highfive.app.AsyncHighfiveHandler'),
+            ('sleep', 'highfive.app.time.sleep'),
+        ))
+        self.config = object()
+        self.watcher = FakeWatcher()
+        self.pool = FakePool()
+        self.clock = FakeClock()
+        self.jobs = JobQueue(str(tmp_path / 'jobs.db'), clock=self.clock)
+        self.deliveries = DeliveryLog()
+        self.client = create_app(
+            self.config, watcher=self.watcher, pool=self.pool,
+            jobs=self.jobs, deliveries=self.deliveries,
+        ).test_client()
+
+    def post(self, delivery, payload, event='pull_request'):
+        return self.client.post(
+            '/webhook', data={'payload': json.dumps(payload)},
+            headers={
+                'X-GitHub-Event': event,
+                'X-GitHub-Delivery': delivery,
+                'X-Hub-Signature': 'sha1=unchecked',
+            },
+        )
+
+
+@pytest.mark.unit
+@pytest.mark.hermetic
+class TestApp(AppTest):
+    def test_accepted(self):
+        response = self.post('a', pr_payload())
+        assert response.status_code == 202
+        # The delivery is queued on disk, and handled by a worker in the
+        # lane of its PR.
+        assert self.jobs.count(PENDING) == 1
+        [(func, args, key)] = self.pool.submitted
+        assert func is run_job
+        assert args == (
+            self.config, self.watcher, self.jobs, 'a', self.deliveries,
+        )
+        assert key == ('rust-lang/rust', 7)
+        self.mocks['handler'].assert_not_called()
+
+        self.pool.run()
+        assert self.jobs.count(DONE) == 1
+        self.mocks['handler'].return_value.run.assert_called_once_with(
+            'pull_request'
+        )
+
+    def test_without_job_queue(self):
+        self.client = create_app(
+            self.config, watcher=self.watcher, pool=self.pool,
+            deliveries=self.deliveries,
+        ).test_client()
+        assert self.post('a', pr_payload()).status_code == 202
+        self.pool.run()
+        assert self.jobs.count(PENDING) == 0
+        self.mocks['handler'].return_value.run.assert_called_once_with(
+            'pull_request'
+        )
+
+    def test_queue_full(self):
+        self.pool.full = True
+        response = self.post('a', pr_payload())
+        assert response.status_code == 503
+        # The delivery is neither kept on disk nor recorded, so that it is
+        # handled when GitHub sends it again.
+        assert self.jobs.claim('a') is None
+        assert self.jobs.count(PENDING) == 0
+        assert self.deliveries.record('a')
+
+    def test_duplicate(self):
+        assert self.post('a', pr_payload()).status_code == 202
+        response = self.post('a', pr_payload())
+        assert response.status_code == 200
+        assert b'duplicate' in response.data
+        assert len(self.pool.submitted) == 1
+
+    def test_unsupported_repo(self):
+        response = self.post('a', pr_payload(repo='foo/bar'))
+        assert response.status_code == 400
+        assert self.pool.submitted == []
+        assert self.jobs.count(PENDING) == 0
+
+    def test_missing_headers(self):
+        response = self.client.post(
+            '/webhook', data={'payload': json.dumps(pr_payload())},
+        )
+        assert response.status_code == 400
+
+    def test_error(self, capsys):
+        self.jobs.put = None
+        response = self.post('a', pr_payload())
+        assert response.status_code == 500
+        assert self.deliveries.record('a')
+        assert 'Delivery ID: a' in capsys.readouterr().out
+
+    def test_lane_key(self):
+        assert lane_key(pr_payload()) == ('rust-lang/rust', 7)
+        assert lane_key({
+            'issue': {'number': 8},
+            'repository': {'full_name': 'rust-lang/rust'},
+        }) == ('rust-lang/rust', 8)
+        assert lane_key({'repository': {'full_name': 'rust-lang/rust'}}) \
+            is None
+
+    def test_run_job(self):
+        assert not run_job(self.config, self.watcher, self.jobs)
+        self.jobs.put('a', 'issue_comment', pr_payload())
+        assert run_job(self.config, self.watcher, self.jobs)
+        assert self.jobs.count(DONE) == 1
+        self.mocks['handler'].return_value.run.assert_called_once_with(
+            'issue_comment'
+        )
+
+    def test_run_job_failure(self, capsys):
+        self.mocks['handler'].return_value.run.side_effect = \
+            ValueError('handler failed')
+        self.deliveries.record('a')
+        self.jobs.put('a', 'pull_request', pr_payload())
+        with pytest.raises(ValueError):
+            run_job(self.config, self.watcher, self.jobs, 'a', self.deliveries)
+        assert self.jobs.count(FAILED) == 1
+        # The failed delivery is handled if it is sent again.
+        assert self.deliveries.record('a')
+        assert 'Delivery ID: a' in capsys.readouterr().out
+
+    def test_watch_jobs(self):
+        self.mocks['sleep'].side_effect = [None, StopWatching()]
+        # A job left pending by a previous run, one received since the
+        # start, and one whose lease expired.
+        self.jobs.put('old', 'pull_request', pr_payload(1))
+        self.clock.now = 10
+        self.jobs.put('new', 'pull_request', pr_payload(2))
+        self.jobs.put('expired', 'pull_request', pr_payload(3))
+        self.jobs.claim('expired')
+        self.clock.now += self.jobs.lease + 1
+        with pytest.raises(StopWatching):
+            watch_jobs(
+                self.pool, self.config, self.watcher, self.jobs,
+                self.deliveries, started=5,
+            )
+        # The jobs are submitted once, even if the queue is checked again.
+        assert [(args[3], key) for _, args, key in self.pool.submitted] == [
+            ('old', ('rust-lang/rust', 1)),
+            ('expired', ('rust-lang/rust', 3)),
+        ]
+        self.pool.run()
+        assert self.jobs.count(DONE) == 2
+        assert self.jobs.count(PENDING) == 1
+
+    def test_watch_jobs_queue_full(self):
+        self.jobs.put('old', 'pull_request', pr_payload())
+        self.clock.now = 10
+        self.pool.full = True
+        sleeps = []
+
+        def sleep(interval):
+            sleeps.append(interval)
+            self.pool.full = False
+            if len(sleeps) == 2:
+                raise StopWatching()
+        self.mocks['sleep'].side_effect = sleep
+        with pytest.raises(StopWatching):
+            watch_jobs(
+                self.pool, self.config, self.watcher, self.jobs,
+                self.deliveries, started=5,
+            )
+        # A job rejected by a full queue is submitted at the next check.
+        assert [args[3] for _, args, _ in self.pool.submitted] == ['old']
+
+
+@pytest.mark.unit
+@pytest.mark.hermetic
+class TestReplay(AppTest):
+    def replay(self, *deliveries, jobs=True):
+        obj = (
+            self.config, self.watcher, self.jobs if jobs else None,
+            self.deliveries,
+        )
+        return CliRunner().invoke(replay, list(deliveries), obj=obj)
+
+    def fail(self, delivery):
+        self.jobs.put(delivery, 'pull_request', pr_payload())
+        self.jobs.claim(delivery)
+        self.jobs.fail(delivery, 'Traceback...\nValueError: failed\n')
+
+    def test_list(self):
+        self.fail('a')
+        result = self.replay()
+        assert result.exit_code == 0
+        assert result.output == 'a\tpull_request\t%s\tValueError: failed\n' \
+            % FAILED
+
+    def test_replay(self):
+        self.fail('a')
+        result = self.replay('a')
+        assert result.exit_code == 0
+        assert 'Handled delivery a' in result.output
+        assert self.jobs.count(DONE) == 1
+        self.mocks['handler'].return_value.run.assert_called_once_with(
+            'pull_request'
+        )
+
+    def test_replay_failure(self):
+        self.fail('a')
+        self.mocks['handler'].return_value.run.side_effect = \
+            ValueError('handler failed')
+        result = self.replay('a', 'missing')
+        assert result.exit_code == 1
+        assert 'delivery a failed again' in result.output
+        assert 'delivery missing is not in the queue' in result.output
+        assert self.jobs.count(FAILED) + self.jobs.count(DEAD) == 1
+
+    def test_no_job_queue(self):
+        result = self.replay(jobs=False)
+        assert result.exit_code == 1
+        assert 'the job queue is not configured' in result.output
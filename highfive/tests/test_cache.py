@@ -0,0 +1,57 @@
+import pytest
+
+from highfive.cache import CachedResponse, ResponseCache
+
+
+def entry(size):
+    return CachedResponse(200, 'OK', {}, b'x' * size, {'If-None-Match': '"a"'})
+
+
+@pytest.mark.unit
+@pytest.mark.hermetic
+class TestResponseCache(object):
+    def test_get(self):
+        cache = ResponseCache()
+        assert cache.get('a') is None
+        cache.put('a', entry(3))
+        assert cache.get('a').content == b'xxx'
+        assert len(cache) == 1
+        assert cache.bytes == 3
+
+    def test_replace(self):
+        cache = ResponseCache()
+        cache.put('a', entry(3))
+        cache.put('a', entry(5))
+        assert len(cache) == 1
+        assert cache.bytes == 5
+
+    def test_max_entries(self):
+        cache = ResponseCache(max_entries=2)
+        cache.put('a', entry(1))
+        cache.put('b', entry(1))
+        # Using `a` makes `b` the least recently used entry.
+        cache.get('a')
+        cache.put('c', entry(1))
+        assert cache.get('b') is None
+        assert cache.get('a') is not None
+        assert cache.get('c') is not None
+
+    def test_max_bytes(self):
+        cache = ResponseCache(max_bytes=10)
+        cache.put('a', entry(4))
+        cache.put('b', entry(4))
+        cache.put('c', entry(4))
+        assert cache.get('a') is None
+        assert len(cache) == 2
+        assert cache.bytes == 8
+
+    def test_too_large(self):
+        cache = ResponseCache(max_bytes=10)
+        cache.put('a', entry(4))
+        cache.put('b', entry(11))
+        assert cache.get('b') is None
+        assert cache.get('a') is not None
+
+    def test_size_includes_headers(self):
+        cached = CachedResponse(200, 'OK', {'ETag': '"a"'}, b'xx', {})
+        assert cached.size == 2 + len('ETag') + len('"a"')
@@ -0,0 +1,243 @@
+import gzip
+import http.server
+import threading
+import time
+import urllib.error
+
+import pytest
+import requests
+
+from highfive.cache import ResponseCache
+from highfive.client import GitHubClient
+from highfive.deadline import Deadline, DeadlineExceeded
+from highfive.ratelimit import RateLimiter
+from highfive.retry import RetryPolicy
+from highfive.stats import stats
+from highfive.tests import fakes
+from highfive.tests.test_newpr import HighfiveHandlerMock
+
+large_diff = fakes.make_fake_diff([
+    ('src/lib%d.rs' % n, 200, 100) for n in range(50)
+]).encode('utf-8')
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # The size of the bodies sent, by path.
+    sent = {}
+
+    # The number of requests to `/limited` rejected before accepting one.
+    limited = 0
+    # The number of requests to `/flaky` failing before one succeeds.
+    failures = 0
+
+    def do_GET(self):
+        status = 404 if self.path == '/missing' else 200
+        headers = {}
+        if self.path == '/limited' and Handler.limited:
+            Handler.limited -= 1
+            status = 429
+            headers['Retry-After'] = '1'
+        headers['X-RateLimit-Remaining'] = '42'
+        if self.path == '/slow':
+            time.sleep(1)
+        if self.path == '/flaky' and Handler.failures:
+            Handler.failures -= 1
+            status = 502
+        if self.path.startswith('/etag'):
+            headers['ETag'] = '"v1"'
+            if self.headers.get('If-None-Match') == '"v1"':
+                self.sent[self.path] = 0
+                self.send_response(304)
+                self.send_header('ETag', '"v1"')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+        if self.path == '/diff':
+            body = large_diff
+            if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                body = gzip.compress(body)
+                headers['Content-Encoding'] = 'gzip'
+        else:
+            body = b'{"path": "%s"}' % self.path.encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        # Recorded before responding, so that the client sees it.
+        self.sent[self.path] = len(body)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:%d' % server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.unit
+@pytest.mark.hermetic
+class TestGitHubClient(object):
+    def test_keep_alive(self, server):
+        client = GitHubClient()
+        connections = stats.get('http.connections')
+        requests = stats.get('http.requests')
+
+        for n in range(3):
+            response = client.request('GET', '%s/%d' % (server, n), 'token')
+            assert response.json() == {'path': '/%d' % n}
+        # Streamed responses give their connection back once read.
+        response = client.request('GET', server + '/stream', stream=True)
+        assert response.raw.read() == b'{"path": "/stream"}'
+        client.request('GET', server + '/last')
+
+        assert stats.get('http.requests') - requests == 5
+        assert stats.get('http.connections') - connections == 1
+
+    def test_error(self, server):
+        client = GitHubClient()
+        with pytest.raises(urllib.error.HTTPError) as e:
+            client.request('GET', server + '/missing')
+        assert e.value.code == 404
+        assert e.value.read() == b'{"path": "/missing"}'
+        # The connection can still be reused after an error.
+        connections = stats.get('http.connections')
+        client.request('GET', server + '/found')
+        assert stats.get('http.connections') == connections
+
+    def test_accept_encoding(self, server):
+        client = GitHubClient()
+        response = client.request('GET', server + '/diff', stream=True)
+        assert response.headers['Content-Encoding'] == 'gzip'
+        # The body is decompressed as it is read.
+        assert response.raw.read(10) == large_diff[:10]
+        assert response.raw.read() == large_diff[10:]
+
+    def test_compressed_diff(self, server):
+        handler = HighfiveHandlerMock(fakes.Payload.new_pr()).handler
+        handler.diff_spool_size = 1024
+        analysis = handler.analyze_diff(server + '/diff')
+        assert len(analysis.files) == 50
+        assert analysis.files[0].added == 200
+        assert analysis.files[0].removed == 100
+        # Much less than the diff itself went over the wire.
+        assert Handler.sent['/diff'] < len(large_diff) / 5
+
+    def test_cache(self, server):
+        client = GitHubClient(cache=ResponseCache())
+        first = client.request('GET', server + '/etag', 'token')
+        assert Handler.sent['/etag'] > 0
+        hits = stats.get('http.cache.hits')
+
+        second = client.request('GET', server + '/etag', 'token')
+        assert Handler.sent['/etag'] == 0
+        assert stats.get('http.cache.hits') == hits + 1
+        assert second.status_code == 200
+        assert second.json() == first.json() == {'path': '/etag'}
+        assert second.headers['ETag'] == '"v1"'
+
+    def test_cache_keys(self, server):
+        client = GitHubClient(cache=ResponseCache())
+        client.request('GET', server + '/etag-key', 'token')
+        # Another token, media type or a streamed request isn't served from
+        # the cache.
+        client.request('GET', server + '/etag-key', 'other')
+        assert Handler.sent['/etag-key'] > 0
+        client.request('GET', server + '/etag-key', 'token', media_type='a/b')
+        assert Handler.sent['/etag-key'] > 0
+        client.request('GET', server + '/etag-key', 'token', stream=True)
+        assert Handler.sent['/etag-key'] > 0
+        assert len(client.cache) == 3
+
+    def test_no_cache(self, server):
+        client = GitHubClient()
+        client.request('GET', server + '/etag-none')
+        client.request('GET', server + '/etag-none')
+        assert Handler.sent['/etag-none'] > 0
+
+    def test_rate_limited(self, server):
+        sleeps = []
+        client = GitHubClient(
+            limiter=RateLimiter(sleep=sleeps.append), max_retries=2
+        )
+        Handler.limited = 2
+        response = client.request('GET', server + '/limited')
+        assert response.json() == {'path': '/limited'}
+        assert len(sleeps) == 2
+        assert all(1 <= s <= 1.5 for s in sleeps)
+        assert client.limiter.remaining('core') == 42
+
+        Handler.limited = 3
+        with pytest.raises(urllib.error.HTTPError) as e:
+            client.request('GET', server + '/limited')
+        assert e.value.code == 429
+        Handler.limited = 0
+
+    def test_transient_errors(self, server):
+        sleeps = []
+        client = GitHubClient(retry=RetryPolicy(sleep=sleeps.append))
+        retries = stats.get('retry.requests')
+        Handler.failures = 2
+        response = client.request('GET', server + '/flaky')
+        assert response.json() == {'path': '/flaky'}
+        assert len(sleeps) == 2
+        assert stats.get('retry.requests') == retries + 2
+
+        # POST requests are not idempotent, and are not retried.
+        Handler.failures = 1
+        with pytest.raises(urllib.error.HTTPError) as e:
+            client.request('POST', server + '/flaky', data={'a': 'b'})
+        assert e.value.code == 502
+        assert len(sleeps) == 2
+
+        Handler.failures = 4
+        with pytest.raises(urllib.error.HTTPError) as e:
+            client.request('GET', server + '/flaky')
+        assert e.value.code == 502
+        Handler.failures = 0
+
+    def test_deadline(self, server):
+        client = GitHubClient()
+        with pytest.raises(requests.Timeout):
+            client.request('GET', server + '/slow', deadline=Deadline(0.2))
+        with pytest.raises(DeadlineExceeded):
+            client.request('GET', server + '/fast', deadline=Deadline(0))
+
+    def test_deadline_retries(self, server):
+        sleeps = []
+        client = GitHubClient(retry=RetryPolicy(sleep=sleeps.append))
+        # Transient errors are not retried once the budget runs low.
+        Handler.failures = 1
+        with pytest.raises(urllib.error.HTTPError):
+            client.request(
+                'GET', server + '/flaky', deadline=Deadline(5, reserve=10)
+            )
+        assert sleeps == []
+        Handler.failures = 0
+
+    def test_deadline_rate_limit(self, server):
+        sleeps = []
+        client = GitHubClient(limiter=RateLimiter(sleep=sleeps.append))
+        client.limiter.update('core', {
+            'X-RateLimit-Remaining': '0',
+            'X-RateLimit-Reset': str(int(time.time()) + 600),
+        })
+        assert client.delay(server + '/fast') > 0
+        assert client.delay(server + '/search/commits') == 0
+        client.request('GET', server + '/fast', deadline=Deadline(5, reserve=3))
+        # The wait leaves the reserve of the deadline.
+        assert len(sleeps) == 1
+        assert 0 < sleeps[0] <= 2
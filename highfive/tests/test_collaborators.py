@@ -0,0 +1,128 @@
+import pytest
+import responses
+
+from highfive.collaborators import CollaboratorCache, fetch_collaborators, \
+    keep_prefetched, prefetch
+from highfive.stats import stats
+from highfive.tests.fakes import FakeClock
+
+
+@pytest.mark.unit
+@pytest.mark.hermetic
+class TestCollaboratorCache(object):
+    def test_get(self):
+        hits = stats.get('collaborators.cache.hits')
+        misses = stats.get('collaborators.cache.misses')
+        cache = CollaboratorCache()
+        assert cache.get('owner', 'repo', 'user') is None
+        cache.put('owner', 'repo', 'user', True)
+        cache.put('owner', 'repo', 'other', False)
+        assert cache.get('owner', 'repo', 'user') is True
+        assert cache.get('owner', 'repo', 'other') is False
+        assert cache.get('owner', 'other-repo', 'user') is None
+        assert stats.get('collaborators.cache.hits') == hits + 2
+        assert stats.get('collaborators.cache.misses') == misses + 2
+
+    def test_case_insensitive(self):
+        cache = CollaboratorCache()
+        cache.put('Owner', 'Repo', 'User', True)
+        assert cache.get('owner', 'repo', 'user') is True
+
+    def test_ttl(self):
+        clock = FakeClock()
+        cache = CollaboratorCache(
+            positive_ttl=100, negative_ttl=10, clock=clock
+        )
+        cache.put('owner', 'repo', 'user', True)
+        cache.put('owner', 'repo', 'other', False)
+        clock.now = 50
+        assert cache.get('owner', 'repo', 'user') is True
+        assert cache.get('owner', 'repo', 'other') is None
+        clock.now = 100
+        assert cache.get('owner', 'repo', 'user') is None
+        assert len(cache) == 0
+
+    def test_max_entries(self):
+        evictions = stats.get('collaborators.cache.evictions')
+        cache = CollaboratorCache(max_entries=2)
+        cache.put('owner', 'repo', 'a', True)
+        cache.put('owner', 'repo', 'b', True)
+        # Using `a` makes `b` the least recently used entry.
+        cache.get('owner', 'repo', 'a')
+        cache.put('owner', 'repo', 'c', True)
+        assert cache.get('owner', 'repo', 'b') is None
+        assert cache.get('owner', 'repo', 'a') is True
+        assert cache.get('owner', 'repo', 'c') is True
+        assert stats.get('collaborators.cache.evictions') == evictions + 1
+
+    def test_invalidate(self):
+        cache = CollaboratorCache()
+        cache.put('owner', 'repo', 'a', True)
+        cache.put('owner', 'repo', 'b', True)
+        cache.put('owner', 'other-repo', 'a', True)
+        cache.invalidate('owner', 'Repo', 'A')
+        assert cache.get('owner', 'repo', 'a') is None
+        assert cache.get('owner', 'repo', 'b') is True
+        cache.invalidate('owner', 'repo')
+        assert cache.get('owner', 'repo', 'b') is None
+        assert cache.get('owner', 'other-repo', 'a') is True
+
+
+@pytest.mark.unit
+@pytest.mark.hermetic
+class TestPrefetch(object):
+    url = 'https://api.github.com/repos/owner/repo/collaborators?per_page=100'
+
+    @responses.activate
+    def test_fetch_collaborators(self):
+        responses.add(
+            responses.GET, self.url, json=[{'login': 'a'}, {'login': 'b'}],
+            headers={'Link': '<%s&page=2>; rel="next"' % self.url},
+        )
+        responses.add(
+            responses.GET, self.url + '&page=2', json=[{'login': 'c'}],
+        )
+        assert fetch_collaborators('owner', 'repo', 'token') == \
+            ['a', 'b', 'c']
+        assert responses.calls[0].request.headers['Authorization'] == \
+            'token token'
+
+    @responses.activate
+    def test_prefetch(self, capsys):
+        responses.add(responses.GET, self.url, json=[{'login': 'a'}])
+        responses.add(
+            responses.GET,
+            'https://api.github.com/repos/owner/private/collaborators?per_page=100',
+            status=403, json={'message': 'Must have push access'},
+        )
+        failures = stats.get('collaborators.prefetch_failures')
+        cache = CollaboratorCache()
+        prefetch(cache, 'token', ['owner/private', 'owner/repo'])
+        assert cache.get('owner', 'repo', 'a') is True
+        assert len(cache) == 1
+        assert stats.get('collaborators.prefetch_failures') == failures + 1
+        assert stats.get('collaborators.prefetched') == 1
+        assert 'owner/private' in capsys.readouterr().out
+
+    @responses.activate
+    def test_keep_prefetched(self):
+        responses.add(responses.GET, self.url, json=[{'login': 'a'}])
+        clock = FakeClock()
+        cache = CollaboratorCache(positive_ttl=100, clock=clock)
+        sleeps = []
+
+        class Stop(Exception):
+            pass
+
+        def sleep(delay):
+            sleeps.append(delay)
+            clock.now += delay
+            if len(sleeps) == 3:
+                raise Stop()
+
+        with pytest.raises(Stop):
+            keep_prefetched(cache, 'token', lambda: ['owner/repo'], sleep=sleep)
+        assert sleeps == [50, 50, 50]
+        assert len(responses.calls) == 3
+        # The prefetched answers are refreshed before they expire.
+        assert cache.get('owner', 'repo', 'a') is True
@@ -22,6 +22,18 @@ class TestConfig(object):
         config = Config('foobar')
         assert config.github_token == 'foobar'
         assert config.github_username == 'baz'
+        assert config.contributors is None
+
+    @responses.activate
+    def test_contributors_db(self, tmp_path):
+        responses.add(
+            responses.GET, 'https://api.github.com/user',
+            json={'login': 'baz'},
+        )
+
+        config = Config('foobar', contributors_db=str(tmp_path / 'db'))
+        config.contributors.put('owner', 'repo', 'user', True)
+        assert config.contributors.get('owner', 'repo', 'user')
 
     @responses.activate
     def test_invalid_token(self):
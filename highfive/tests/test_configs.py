@@ -31,6 +31,9 @@ CONFIG_SCHEMA = {
         "expected_branch": {
             "type": "string",
         },
+        "file_stats": {
+            "type": "boolean",
+        },
         "groups": {
             "type": "object",
             "required": [
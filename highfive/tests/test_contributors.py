@@ -0,0 +1,195 @@
+import os
+import threading
+
+import mock
+import pytest
+import responses
+
+from highfive.client import client
+from highfive.contributors import BloomFilter, ContributorIndex, \
+    ContributorStore, build_index, fetch_contributors
+from highfive.retry import RetryPolicy
+from highfive.stats import stats
+from highfive.tests.fakes import FakeClock
+
+
+@pytest.mark.unit
+@pytest.mark.hermetic
+class TestContributorStore(object):
+    @pytest.fixture(autouse=True)
+    def make_store(self, tmp_path):
+        self.path = str(tmp_path / 'contributors.db')
+        self.clock = FakeClock()
+        self.store = ContributorStore(self.path, new_ttl=10, clock=self.clock)
+
+    def test_get(self):
+        hits = stats.get('contributors.cache.hits')
+        misses = stats.get('contributors.cache.misses')
+        assert self.store.get('owner', 'repo', 'user') is None
+        self.store.put('owner', 'repo', 'user', True)
+        self.store.put('owner', 'repo', 'new', False)
+        assert self.store.get('Owner', 'Repo', 'User') is True
+        assert self.store.get('owner', 'repo', 'new') is False
+        assert self.store.get('owner', 'other-repo', 'user') is None
+        assert stats.get('contributors.cache.hits') == hits + 2
+        assert stats.get('contributors.cache.misses') == misses + 2
+
+    def test_new_ttl(self):
+        self.store.put('owner', 'repo', 'user', True)
+        self.store.put('owner', 'repo', 'new', False)
+        self.clock.now = 10
+        assert self.store.get('owner', 'repo', 'user') is True
+        assert self.store.get('owner', 'repo', 'new') is None
+        self.store.put('owner', 'repo', 'new', False)
+        assert self.store.get('owner', 'repo', 'new') is False
+
+    def test_never_new_again(self):
+        self.store.put('owner', 'repo', 'user', True)
+        self.store.put('owner', 'repo', 'user', False)
+        assert self.store.get('owner', 'repo', 'user') is True
+
+    def test_persistent(self):
+        self.store.put('owner', 'repo', 'user', True)
+        self.store.close()
+        assert os.path.exists(self.path)
+        store = ContributorStore(self.path)
+        assert store.get('owner', 'repo', 'user') is True
+        mode = store._connection().execute('PRAGMA journal_mode').fetchone()
+        assert mode == ('wal',)
+
+    def test_threads(self):
+        def put(user):
+            self.store.put('owner', 'repo', user, True)
+
+        threads = [
+            threading.Thread(target=put, args=('user%d' % i,))
+            for i in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for i in range(8):
+            assert self.store.get('owner', 'repo', 'user%d' % i) is True
+
+
+@pytest.mark.unit
+@pytest.mark.hermetic
+class TestBloomFilter(object):
+    def test_contains(self):
+        bloom = BloomFilter(100)
+        for i in range(100):
+            bloom.add('user%d' % i)
+        for i in range(100):
+            assert 'user%d' % i in bloom
+        false_positives = sum(
+            'other%d' % i in bloom for i in range(1000)
+        )
+        assert false_positives < 50
+
+    def test_bits(self):
+        bloom = BloomFilter(10)
+        bloom.add('user')
+        copy = BloomFilter(10, bits=bytes(bloom.bits))
+        assert 'user' in copy
+
+
+@pytest.mark.unit
+@pytest.mark.hermetic
+class TestContributorIndex(object):
+    @pytest.fixture(autouse=True)
+    def make_index(self, tmp_path):
+        self.path = str(tmp_path / 'contributors.db')
+        self.index = ContributorIndex(self.path)
+
+    def test_not_indexed(self):
+        assert not self.index.indexed('owner', 'repo')
+        assert self.index.contains('owner', 'repo', 'user') is None
+        # Contributors of repositories which aren't indexed are kept for
+        # when they are.
+        self.index.add('owner', 'repo', 'user')
+        assert self.index.contains('owner', 'repo', 'user') is None
+        self.index.build('owner', 'repo', [])
+        assert self.index.contains('owner', 'repo', 'user') is True
+
+    def test_build(self):
+        hits = stats.get('contributors.index.hits')
+        self.index.build('owner', 'repo', ['A', 'b'])
+        assert self.index.indexed('Owner', 'Repo')
+        assert self.index.contains('owner', 'repo', 'a') is True
+        assert self.index.contains('owner', 'repo', 'c') is False
+        assert self.index.contains('owner', 'other-repo', 'a') is None
+        assert stats.get('contributors.index.hits') == hits + 1
+
+    def test_add(self):
+        self.index.build('owner', 'repo', ['a'])
+        # The filter has room for 2 users, and grows with the third one.
+        for user in ('b', 'c', 'd'):
+            self.index.add('owner', 'repo', user)
+        for user in ('a', 'b', 'c', 'd'):
+            assert self.index.contains('owner', 'repo', user) is True
+        assert self.index._filter('owner/repo').capacity >= 4
+
+    def test_persistent(self):
+        self.index.build('owner', 'repo', ['a'])
+        self.index.add('owner', 'repo', 'b')
+        index = ContributorIndex(self.path)
+        assert index.indexed('owner', 'repo')
+        assert index.contains('owner', 'repo', 'a') is True
+        assert index.contains('owner', 'repo', 'b') is True
+        assert index.contains('owner', 'repo', 'c') is False
+
+
+@pytest.mark.unit
+@pytest.mark.hermetic
+class TestBuildIndex(object):
+    url = 'https://api.github.com/repos/owner/repo/contributors?per_page=100'
+
+    @pytest.fixture(autouse=True)
+    def make_index(self, tmp_path):
+        self.index = ContributorIndex(str(tmp_path / 'contributors.db'))
+
+    @responses.activate
+    def test_fetch_contributors(self):
+        responses.add(
+            responses.GET, self.url, json=[{'login': 'a'}, {'login': 'b'}],
+            headers={'Link': '<%s&page=2>; rel="next"' % self.url},
+        )
+        responses.add(
+            responses.GET, self.url + '&page=2',
+            json=[{'login': 'c'}, {'email': 'anon@example.com'}],
+        )
+        assert fetch_contributors('owner', 'repo', 'token') == \
+            ['a', 'b', 'c']
+
+    @responses.activate
+    def test_empty_repo(self):
+        responses.add(responses.GET, self.url, status=204)
+        assert fetch_contributors('owner', 'repo', 'token') == []
+
+    @responses.activate
+    def test_build_index(self, capsys):
+        responses.add(responses.GET, self.url, json=[{'login': 'a'}])
+        responses.add(
+            responses.GET,
+            'https://api.github.com/repos/owner/broken/contributors?per_page=100',
+            status=500,
+        )
+        repos = stats.get('contributors.index.repos')
+        failures = stats.get('contributors.index.failures')
+        sleeps = []
+        self.index.build('owner', 'indexed', ['b'])
+        with mock.patch.object(
+                client, 'retry', RetryPolicy(sleep=sleeps.append)
+        ):
+            build_index(
+                self.index, 'token',
+                ['owner/broken', 'owner/indexed', 'owner/repo'],
+            )
+        assert self.index.contains('owner', 'repo', 'a') is True
+        assert not self.index.indexed('owner', 'broken')
+        # The broken repository is retried before being skipped.
+        assert len(sleeps) == 3
+        assert stats.get('contributors.index.repos') == repos + 1
+        assert stats.get('contributors.index.failures') == failures + 1
+        assert 'owner/broken' in capsys.readouterr().out
@@ -0,0 +1,28 @@
+import pytest
+
+from highfive.deadline import Deadline, DeadlineExceeded
+from highfive.tests.fakes import FakeClock
+
+
+@pytest.mark.unit
+@pytest.mark.hermetic
+class TestDeadline(object):
+    def test_budget(self):
+        clock = FakeClock(100)
+        deadline = Deadline(9, reserve=3, clock=clock)
+        assert deadline.remaining() == 9
+        assert deadline.timeout() == 9
+        assert deadline.spare() == 6
+        assert not deadline.low()
+
+        clock.now += 7
+        assert deadline.remaining() == 2
+        assert deadline.spare() == 0
+        assert deadline.low()
+        assert not deadline.expired()
+
+        clock.now += 5
+        assert deadline.remaining() == 0
+        assert deadline.expired()
+        with pytest.raises(DeadlineExceeded):
+            deadline.timeout()
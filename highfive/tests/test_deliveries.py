@@ -0,0 +1,57 @@
+import pytest
+
+from highfive.deliveries import DeliveryLog
+from highfive.stats import stats
+from highfive.tests.fakes import FakeClock
+
+
+@pytest.mark.unit
+@pytest.mark.hermetic
+class TestDeliveryLog(object):
+    def setup_method(self, method):
+        self.clock = FakeClock()
+        self.duplicates = stats.get('deliveries.duplicates')
+
+    def test_record(self):
+        log = DeliveryLog(clock=self.clock)
+        assert log.record('a')
+        assert log.record('b')
+        assert not log.record('a')
+        assert stats.get('deliveries.duplicates') == self.duplicates + 1
+
+    def test_window(self):
+        log = DeliveryLog(window=10, clock=self.clock)
+        assert log.record('a')
+        self.clock.now = 9
+        assert not log.record('a')
+        self.clock.now = 10
+        assert log.record('a')
+        assert not log.record('a')
+
+    def test_max_entries(self):
+        log = DeliveryLog(max_entries=2, clock=self.clock)
+        for delivery in ('a', 'b', 'c'):
+            assert log.record(delivery)
+        assert log.record('a')
+        assert not log.record('c')
+
+    def test_forget(self):
+        log = DeliveryLog(clock=self.clock)
+        log.record('a')
+        log.forget('a')
+        assert log.record('a')
+
+    def test_database(self, tmp_path):
+        path = str(tmp_path / 'deliveries.db')
+        log = DeliveryLog(path, window=10, clock=self.clock)
+        assert log.record('a')
+        assert log.record('b')
+        log.forget('b')
+
+        # Another process, or highfive after a restart.
+        log = DeliveryLog(path, window=10, clock=self.clock)
+        assert not log.record('a')
+        assert log.record('b')
+        self.clock.now = 10
+        assert log.record('a')
+        assert stats.get('deliveries.duplicates') == self.duplicates + 1
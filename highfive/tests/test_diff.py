@@ -0,0 +1,230 @@
+import io
+import mmap
+import time
+
+import pytest
+
+from highfive import diff as diff_module
+from highfive.diff import DiffAnalysis, DiffTooLarge, FileRecord, count, \
+    spool
+from highfive.tests import fakes
+from highfive.tests.fakes import load_fake
+
+
+@pytest.mark.unit
+@pytest.mark.hermetic
+class TestDiffAnalysis(object):
+    def test_file_records(self):
+        diff = fakes.make_fake_diff([
+            ('compiler/rustc_llvm/foo', 1, 2),
+            ('compiler/rustc_macros//src/foo.rs', 0, 3),
+            ('README.md', 4, 0),
+        ])
+        assert DiffAnalysis(diff).files == [
+            FileRecord('compiler/rustc_llvm/foo', 1, 2),
+            FileRecord('compiler/rustc_macros//src/foo.rs', 0, 3),
+            FileRecord('README.md', 4, 0),
+        ]
+
+    def test_submodule(self):
+        analysis = DiffAnalysis(load_fake('submodule.diff'))
+        assert analysis.any('submodule')
+        assert not analysis.any('target')
+        assert [r.path for r in analysis.files if 'submodule' in r.flags] == [
+            'src/jemalloc',
+        ]
+
+    def test_target(self):
+        analysis = DiffAnalysis(load_fake('target.diff'))
+        assert analysis.any('target')
+        assert not analysis.any('submodule')
+
+    def test_normal(self):
+        analysis = DiffAnalysis(load_fake('normal.diff'))
+        assert not analysis.any('target')
+        assert not analysis.any('submodule')
+        assert all(not r.flags for r in analysis.files)
+
+    def test_custom_analyzers(self):
+        sections = []
+
+        def todo(diff, start, end):
+            sections.append(diff[start:end].decode('utf-8'))
+            return b'\n+TODO' in diff[start:end]
+
+        diff = fakes.make_fake_diff([('a.rs', 3, 0), ('b.rs', 1, 0)])
+        diff = diff.replace('+Added line 1', '+TODO line 1', 1)
+        analysis = DiffAnalysis(diff, {'todo': todo})
+        assert [r.flags for r in analysis.files] == [{'todo'}, set()]
+        # The analyzer is called once per file, with the file's section.
+        assert len(sections) == 2
+        assert sections[0].startswith('diff --git a/a.rs b/a.rs\n')
+        assert sections[1].startswith('diff --git a/b.rs b/b.rs\n')
+        assert ''.join(sections) == diff
+
+    def test_submodule_anchored(self):
+        diff = fakes.make_fake_diff([('a.rs', 1, 0)])
+        not_anchored = diff.replace(
+            '+Added line 0', '+// +Subproject commit 1234'
+        )
+        assert not DiffAnalysis(not_anchored).any('submodule')
+        anchored = diff.replace('+Added line 0', '+Subproject commit 1234')
+        assert DiffAnalysis(anchored).any('submodule')
+
+    def test_leading_garbage(self):
+        diff = 'From 1234\nSubject: foo\n+not a file\n' + \
+            fakes.make_fake_diff([('a.rs', 1, 1)])
+        assert DiffAnalysis(diff).files == [FileRecord('a.rs', 1, 1)]
+
+    def test_empty(self):
+        assert DiffAnalysis('').files == []
+
+    def test_from_files(self):
+        analysis = DiffAnalysis.from_files([
+            {
+                'filename': 'src/jemalloc', 'status': 'modified',
+                'additions': 1, 'deletions': 1,
+                'patch': '@@ -1 +1 @@\n-Subproject commit 1\n+Subproject commit 2',
+            },
+            {
+                'filename': 'compiler/rustc_target/src/spec/mod.rs',
+                'previous_filename': 'compiler/rustc_target/src/spec/old.rs',
+                'status': 'renamed', 'additions': 0, 'deletions': 0,
+                'patch': '',
+            },
+            {
+                'filename': 'README.md', 'status': 'added',
+                'additions': 3, 'deletions': 0,
+                'patch': '@@ -0,0 +1,3 @@\n+a\n+b\n+c',
+            },
+        ])
+        assert analysis.files == [
+            FileRecord('src/jemalloc', 1, 1, {'submodule'}),
+            FileRecord('compiler/rustc_target/src/spec/mod.rs', 0, 0, {'target'}),
+            FileRecord('README.md', 3, 0),
+        ]
+        assert [r.status for r in analysis.files] == [
+            'modified', 'renamed', 'added',
+        ]
+        assert not analysis.incomplete
+
+    def test_from_files_without_patch(self):
+        analysis = DiffAnalysis.from_files([
+            {
+                'filename': 'src/jemalloc', 'status': 'modified',
+                'additions': 1, 'deletions': 1,
+            },
+        ])
+        assert analysis.incomplete
+        assert not analysis.any('submodule')
+
+        analysis.update_flags(DiffAnalysis(load_fake('submodule.diff')))
+        assert analysis.any('submodule')
+        assert not analysis.incomplete
+
+
+class Stream(io.BytesIO):
+    """A binary stream recording the size of the reads."""
+    def __init__(self, data):
+        super().__init__(data)
+        self.reads = []
+
+    def read(self, size=-1):
+        self.reads.append(size)
+        return super().read(size)
+
+
+@pytest.mark.unit
+@pytest.mark.hermetic
+class TestSpool(object):
+    def test_small(self):
+        stream = Stream(b'foo' * 10)
+        with spool(stream, 100) as data:
+            assert data == b'foo' * 10
+            assert isinstance(data, bytes)
+        assert stream.closed
+
+    def test_large(self):
+        stream = Stream(b'x' * 200000)
+        with spool(stream, 100) as data:
+            assert isinstance(data, mmap.mmap)
+            assert len(data) == 200000
+            assert data[:3] == b'xxx'
+        assert data.closed
+        assert stream.closed
+        # The stream is never read as a whole.
+        assert -1 not in stream.reads
+
+    def test_large_length(self):
+        stream = Stream(b'x' * 200)
+        with spool(stream, 100, length=200) as data:
+            assert isinstance(data, mmap.mmap)
+            assert data[:] == b'x' * 200
+
+    def test_empty(self):
+        with spool(Stream(b''), 0, length=10) as data:
+            assert data == b''
+
+    def test_max_size(self):
+        for max_memory in (10, 1000000):
+            stream = Stream(b'x' * 200000)
+            with pytest.raises(DiffTooLarge):
+                with spool(stream, max_memory, max_size=100000):
+                    pass
+            assert stream.closed
+            # The stream is not read past the limit.
+            assert len(stream.reads) * diff_module.chunk_size <= \
+                100000 + diff_module.chunk_size
+        with spool(Stream(b'x' * 100), 10, max_size=100) as data:
+            assert len(data) == 100
+
+    def test_mmap_analysis(self):
+        diff = load_fake('submodule.diff') + fakes.make_fake_diff([
+            ('src/lib%d.rs' % n, 20, 10) for n in range(50)
+        ]) + load_fake('target.diff')
+        with spool(Stream(diff.encode('utf-8')), 100) as data:
+            assert isinstance(data, mmap.mmap)
+            analysis = DiffAnalysis(data)
+        assert analysis.files == DiffAnalysis(diff).files
+        assert analysis.any('submodule')
+        assert analysis.any('target')
+
+    def test_count_windows(self, monkeypatch):
+        monkeypatch.setattr(diff_module, 'scan_window', 4)
+        data = b'\n+a\n+++\n+\n+b\n+'
+        with spool(Stream(data), 0) as buf:
+            for needle in (b'\n+', b'\n+++'):
+                for (start, end) in ((0, len(data)), (1, 9), (3, 12)):
+                    assert count(buf, needle, start, end) == \
+                        data.count(needle, start, end)
+
+
+def make_large_diff(size):
+    """Build a diff of at least `size` bytes touching many files, none of
+    which are submodules or compiler targets."""
+    chunk = fakes.make_fake_diff([
+        ('src/lib%d.rs' % n, 200, 100) for n in range(50)
+    ])
+    return chunk * (size // len(chunk) + 1)
+
+
+def time_analysis(diff):
+    best = None
+    for _ in range(2):
+        start = time.perf_counter()
+        analysis = DiffAnalysis(diff)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    assert not analysis.any('submodule')
+    assert not analysis.any('target')
+    return best
+
+
+@pytest.mark.benchmark
+@pytest.mark.hermetic
+def test_analysis_is_linear():
+    """Analyzing a diff twice as large should take about twice as long."""
+    small = time_analysis(make_large_diff(50 * 2 ** 20))
+    large = time_analysis(make_large_diff(100 * 2 ** 20))
+    assert large < small * 3, \
+        'analysis took %.2fs for 50MB but %.2fs for 100MB' % (small, large)
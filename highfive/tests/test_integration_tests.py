@@ -4,6 +4,7 @@ import responses
 
 from highfive import newpr, payload
 from highfive.config import Config
+from highfive.registry import ConfigRegistry
 from highfive.tests import fakes
 from highfive.tests.test_newpr import HighfiveHandlerMock
 from highfive.tests.patcherize import patcherize
@@ -47,6 +48,16 @@ class ApiReqMocker(object):
         assert self.mock.call_count == len(self.calls)
 
 
+def dummy_registry(repo_config):
+    return ConfigRegistry(
+        {
+            'davidalber/highfive': repo_config,
+            'rust-lang/rust': repo_config,
+        },
+        fakes.get_global_configs()['base'],
+    )
+
+
 def dummy_config():
     with responses.RequestsMock() as resp:
         resp.add(
@@ -63,27 +74,33 @@ class TestNewPr(object):
     def make_mocks(cls, patcherize):
         cls.mocks = patcherize((
             ('ConfigParser', 'highfive.newpr.ConfigParser'),
-            ('load_json_file', 'highfive.newpr.HighfiveHandler._load_json_file'),
+            ('fetch_diff', 'highfive.newpr.HighfiveHandler.fetch_diff'),
         ))
 
-        cls.mocks['load_json_file'].side_effect = (
-            fakes.get_repo_configs()['individuals_no_dirs'],
-            fakes.get_global_configs()['base'],
+        cls.mocks['fetch_diff'].return_value.__enter__.return_value = \
+            fakes.load_fake('normal.diff')
+        cls.registry = dummy_registry(
+            fakes.get_repo_configs()['individuals_no_dirs']
+        )
+
+    def verify_fetch_diff(self):
+        self.mocks['fetch_diff'].assert_called_once_with(
+            'https://the.url/', newpr.file_stats_diff_size
         )
 
     def test_new_pr_non_contributor(self):
         payload = fakes.Payload.new_pr(
             repo_owner='rust-lang', repo_name='rust', pr_author='pnkfelix'
         )
-        handler = newpr.HighfiveHandler(payload, dummy_config())
+        handler = newpr.HighfiveHandler(payload, dummy_config(), self.registry)
 
         api_req_mock = ApiReqMocker([
             (
                 (
-                    'GET', 'https://the.url/', None,
-                    'application/vnd.github.v3.diff'
+                    'GET', newpr.commit_search_url % ('rust-lang', 'rust', 'pnkfelix'),
+                    None, 'application/vnd.github.cloak-preview'
                 ),
-                {'body': fakes.load_fake('normal.diff')},
+                {'body': '{"total_count": 0}'},
             ),
             (
                 (
@@ -92,13 +109,6 @@ class TestNewPr(object):
                 ),
                 {'body': {}},
             ),
-            (
-                (
-                    'GET', newpr.commit_search_url % ('rust-lang', 'rust', 'pnkfelix'),
-                    None, 'application/vnd.github.cloak-preview'
-                ),
-                {'body': '{"total_count": 0}'},
-            ),
             (
                 (
                     'POST', newpr.post_comment_url % ('rust-lang', 'rust', '7'),
@@ -111,21 +121,22 @@ class TestNewPr(object):
         handler.new_pr()
 
         api_req_mock.verify_calls()
+        self.verify_fetch_diff()
 
     def test_new_pr_empty_body(self):
         payload = fakes.Payload.new_pr(
             repo_owner='rust-lang', repo_name='rust', pr_author='pnkfelix',
             pr_body=None,
         )
-        handler = newpr.HighfiveHandler(payload, dummy_config())
+        handler = newpr.HighfiveHandler(payload, dummy_config(), self.registry)
 
         api_req_mock = ApiReqMocker([
             (
                 (
-                    'GET', 'https://the.url/', None,
-                    'application/vnd.github.v3.diff'
+                    'GET', newpr.commit_search_url % ('rust-lang', 'rust', 'pnkfelix'),
+                    None, 'application/vnd.github.cloak-preview'
                 ),
-                {'body': fakes.load_fake('normal.diff')},
+                {'body': '{"total_count": 0}'},
             ),
             (
                 (
@@ -134,13 +145,6 @@ class TestNewPr(object):
                 ),
                 {'body': {}},
             ),
-            (
-                (
-                    'GET', newpr.commit_search_url % ('rust-lang', 'rust', 'pnkfelix'),
-                    None, 'application/vnd.github.cloak-preview'
-                ),
-                {'body': '{"total_count": 0}'},
-            ),
             (
                 (
                     'POST', newpr.post_comment_url % ('rust-lang', 'rust', '7'),
@@ -153,20 +157,21 @@ class TestNewPr(object):
         handler.new_pr()
 
         api_req_mock.verify_calls()
+        self.verify_fetch_diff()
 
     def test_new_pr_contributor(self):
         payload = fakes.Payload.new_pr(
             repo_owner='rust-lang', repo_name='rust', pr_author='pnkfelix'
         )
-        handler = newpr.HighfiveHandler(payload, dummy_config())
+        handler = newpr.HighfiveHandler(payload, dummy_config(), self.registry)
 
         api_req_mock = ApiReqMocker([
             (
                 (
-                    'GET', 'https://the.url/', None,
-                    'application/vnd.github.v3.diff'
+                    'GET', newpr.commit_search_url % ('rust-lang', 'rust', 'pnkfelix'),
+                    None, 'application/vnd.github.cloak-preview'
                 ),
-                {'body': fakes.load_fake('normal.diff')},
+                {'body': '{"total_count": 1}'},
             ),
             (
                 (
@@ -175,13 +180,6 @@ class TestNewPr(object):
                 ),
                 {'body': {}},
             ),
-            (
-                (
-                    'GET', newpr.commit_search_url % ('rust-lang', 'rust', 'pnkfelix'),
-                    None, 'application/vnd.github.cloak-preview'
-                ),
-                {'body': '{"total_count": 1}'},
-            ),
             (
                 (
                     'POST', newpr.post_comment_url % ('rust-lang', 'rust', '7'),
@@ -193,29 +191,22 @@ class TestNewPr(object):
         handler.new_pr()
 
         api_req_mock.verify_calls()
+        self.verify_fetch_diff()
 
     def test_new_pr_contributor_with_labels(self):
-        self.mocks['load_json_file'].side_effect = (
-            fakes.get_repo_configs()['individuals_no_dirs_labels'],
-            fakes.get_global_configs()['base'],
+        self.registry = dummy_registry(
+            fakes.get_repo_configs()['individuals_no_dirs_labels']
         )
         payload = fakes.Payload.new_pr(
             repo_owner='rust-lang', repo_name='rust', pr_author='pnkfelix'
         )
-        handler = newpr.HighfiveHandler(payload, dummy_config())
+        handler = newpr.HighfiveHandler(payload, dummy_config(), self.registry)
 
         api_req_mock = ApiReqMocker([
             (
                 (
-                    'GET', 'https://the.url/', None,
-                    'application/vnd.github.v3.diff'
-                ),
-                {'body': fakes.load_fake('normal.diff')},
-            ),
-            (
-                (
-                    'PATCH', newpr.issue_url % ('rust-lang', 'rust', '7'),
-                    {'assignee': 'nrc'}
+                    'POST', newpr.issue_labels_url % ('rust-lang', 'rust', '7'),
+                    ['a', 'b']
                 ),
                 {'body': {}},
             ),
@@ -228,15 +219,15 @@ class TestNewPr(object):
             ),
             (
                 (
-                    'POST', newpr.post_comment_url % ('rust-lang', 'rust', '7'),
-                    {'body': 'r? @nrc\n\n(rust-highfive has picked a reviewer for you, use r? to override)'}
+                    'PATCH', newpr.issue_url % ('rust-lang', 'rust', '7'),
+                    {'assignee': 'nrc'}
                 ),
                 {'body': {}},
             ),
             (
                 (
-                    'POST', newpr.issue_labels_url % ('rust-lang', 'rust', '7'),
-                    ['a', 'b']
+                    'POST', newpr.post_comment_url % ('rust-lang', 'rust', '7'),
+                    {'body': 'r? @nrc\n\n(rust-highfive has picked a reviewer for you, use r? to override)'}
                 ),
                 {'body': {}},
             ),
@@ -244,6 +235,7 @@ class TestNewPr(object):
         handler.new_pr()
 
         api_req_mock.verify_calls()
+        self.verify_fetch_diff()
 
 
 @pytest.mark.integration
@@ -253,20 +245,35 @@ class TestNewComment(object):
     def make_mocks(cls, patcherize):
         cls.mocks = patcherize((
             ('ConfigParser', 'highfive.newpr.ConfigParser'),
-            ('load_json_file', 'highfive.newpr.HighfiveHandler._load_json_file'),
         ))
 
         config_mock = mock.Mock()
         config_mock.get.side_effect = ('integration-user', 'integration-token')
         cls.mocks['ConfigParser'].RawConfigParser.return_value = config_mock
-        cls.mocks['load_json_file'].side_effect = (
-            fakes.get_repo_configs()['individuals_no_dirs'],
-            fakes.get_global_configs()['base'],
+        cls.registry = dummy_registry(
+            fakes.get_repo_configs()['individuals_no_dirs']
         )
 
     def test_author_is_commenter(self):
         payload = fakes.Payload.new_comment()
-        handler = newpr.HighfiveHandler(payload, dummy_config())
+        handler = newpr.HighfiveHandler(payload, dummy_config(), self.registry)
+        api_req_mock = ApiReqMocker([
+            (
+                (
+                    'PATCH', newpr.issue_url % ('rust-lang', 'rust', '1'),
+                    {'assignee': 'davidalber'}
+                ),
+                {'body': {}},
+            ),
+        ])
+        handler.new_comment()
+        api_req_mock.verify_calls()
+
+    def test_author_not_commenter_is_owner(self):
+        payload = fakes.Payload.new_comment()
+        payload._payload['issue']['user']['login'] = 'foouser'
+
+        handler = newpr.HighfiveHandler(payload, dummy_config(), self.registry)
         api_req_mock = ApiReqMocker([
             (
                 (
@@ -282,8 +289,9 @@ class TestNewComment(object):
     def test_author_not_commenter_is_collaborator(self):
         payload = fakes.Payload.new_comment()
         payload._payload['issue']['user']['login'] = 'foouser'
+        payload._payload['comment']['author_association'] = 'MEMBER'
 
-        handler = newpr.HighfiveHandler(payload, dummy_config())
+        handler = newpr.HighfiveHandler(payload, dummy_config(), self.registry)
         api_req_mock = ApiReqMocker([
             (
                 (
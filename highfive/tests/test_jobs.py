@@ -0,0 +1,142 @@
+import threading
+
+import pytest
+
+from highfive.jobs import RUNNING, JobQueue
+from highfive.stats import stats
+from highfive.tests.fakes import FakeClock
+
+
+@pytest.mark.unit
+@pytest.mark.hermetic
+class TestJobQueue(object):
+    @pytest.fixture(autouse=True)
+    def make_queue(self, tmp_path):
+        self.path = str(tmp_path / 'jobs.db')
+        self.clock = FakeClock()
+        self.jobs = JobQueue(
+            self.path, lease=10, max_attempts=2, retention=100,
+            clock=self.clock,
+        )
+
+    def put(self, delivery):
+        assert self.jobs.put(delivery, 'pull_request', {'number': delivery})
+        self.clock.now += 1
+
+    def test_claim(self):
+        assert self.jobs.claim() is None
+        self.put('a')
+        self.put('b')
+        job = self.jobs.claim()
+        assert (job.delivery, job.event, job.payload, job.attempts) == \
+            ('a', 'pull_request', {'number': 'a'}, 1)
+        assert self.jobs.claim().delivery == 'b'
+        assert self.jobs.claim() is None
+        assert stats.get('jobs.running') == 2
+
+    def test_put_twice(self):
+        self.put('a')
+        assert not self.jobs.put('a', 'pull_request', {})
+        assert stats.get('jobs.pending') == 1
+
+    def test_complete(self):
+        self.put('a')
+        self.jobs.complete(self.jobs.claim().delivery)
+        assert self.jobs.claim() is None
+        assert stats.get('jobs.done') == 1
+        # Finished jobs are forgotten after the retention period.
+        self.clock.now += 200
+        self.put('b')
+        self.jobs.complete(self.jobs.claim().delivery)
+        assert stats.get('jobs.done') == 1
+
+    def test_lease(self):
+        self.put('a')
+        self.jobs.claim()
+        self.clock.now += 10
+        assert self.jobs.recoverable(0) == []
+        self.clock.now += 1
+        assert self.jobs.recoverable(0) == [('a', 1, {'number': 'a'})]
+        job = self.jobs.claim()
+        assert (job.delivery, job.attempts) == ('a', 2)
+        # The lease expired too many times.
+        self.clock.now += 11
+        assert self.jobs.claim() is None
+        assert stats.get('jobs.dead') == 1
+
+    def test_recoverable(self):
+        self.put('a')
+        self.put('b')
+        started = self.clock.now
+        self.put('c')
+        # Only the jobs pending since before the start are left over.
+        assert self.jobs.recoverable(started) == [
+            ('a', 0, {'number': 'a'}), ('b', 0, {'number': 'b'}),
+        ]
+        self.jobs.claim('a')
+        self.jobs.fail(self.jobs.claim('b').delivery, 'error')
+        assert self.jobs.recoverable(started) == []
+        self.clock.now += 11
+        assert self.jobs.recoverable(started) == [('a', 1, {'number': 'a'})]
+
+    def test_remove(self):
+        self.put('a')
+        self.put('b')
+        self.jobs.remove('a')
+        self.jobs.claim('b')
+        # Only pending jobs are removed.
+        self.jobs.remove('b')
+        assert stats.get('jobs.pending') == 0
+        assert stats.get('jobs.running') == 1
+
+    def test_fail(self):
+        self.put('a')
+        self.jobs.fail(self.jobs.claim().delivery, 'Traceback...\nValueError')
+        assert self.jobs.claim() is None
+        assert self.jobs.unfinished() == [
+            ('a', 'pull_request', 'failed', 'Traceback...\nValueError'),
+        ]
+
+    def test_replay(self):
+        self.put('a')
+        self.put('b')
+        assert self.jobs.claim('b').delivery == 'b'
+        # Running jobs are not claimed again while they are leased.
+        assert self.jobs.claim('b') is None
+        self.jobs.fail('b', 'error')
+        job = self.jobs.claim('b')
+        assert (job.delivery, job.attempts) == ('b', 2)
+        self.jobs.complete('b')
+        assert self.jobs.claim('b') is None
+        assert self.jobs.claim('c') is None
+
+    def test_durable(self):
+        self.put('a')
+        self.jobs.close()
+        jobs = JobQueue(self.path)
+        assert jobs.claim().delivery == 'a'
+        mode = jobs._connection().execute('PRAGMA synchronous').fetchone()
+        # FULL
+        assert mode == (2,)
+
+    def test_concurrent_claims(self):
+        for i in range(20):
+            self.put('d%d' % i)
+        claimed = []
+
+        def claim():
+            # Every thread has its own connection.
+            jobs = JobQueue(self.path, clock=self.clock)
+            while True:
+                job = jobs.claim()
+                if job is None:
+                    return
+                claimed.append(job.delivery)
+
+        threads = [threading.Thread(target=claim) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(claimed) == sorted('d%d' % i for i in range(20))
+        assert stats.get('jobs.%s' % RUNNING) == 20
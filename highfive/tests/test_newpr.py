@@ -1,15 +1,25 @@
+import gzip
+import io
 import json
-import os
+import threading
 from copy import deepcopy
 from urllib.error import HTTPError
 
 import mock
 import pytest
+import requests
 import responses
 
 from highfive import newpr
+from highfive.collaborators import CollaboratorCache
 from highfive.config import Config
+from highfive.contributors import ContributorIndex, ContributorStore
+from highfive.deadline import Deadline
+from highfive.diff import DiffAnalysis
 from highfive.payload import Payload
+from highfive.registry import ConfigRegistry, RepoConfig
+from highfive.retry import RetryPolicy
+from highfive.stats import stats
 from highfive.tests import fakes
 from highfive.tests.fakes import load_fake
 from highfive.tests.patcherize import patcherize
@@ -24,7 +34,8 @@ class TestNewPR(object):
 class HighfiveHandlerMock(object):
     def __init__(
             self, payload, integration_user='integrationUser',
-            integration_token='integrationToken', repo_config={}
+            integration_token='integrationToken', repo_config={},
+            global_config=None, handler_class=newpr.HighfiveHandler
     ):
         assert (type(payload) == Payload)
         self.integration_user = integration_user
@@ -48,10 +59,16 @@ class HighfiveHandlerMock(object):
         self.load_repo_config_patcher = mock.patch(
             'highfive.newpr.HighfiveHandler.load_repo_config'
         )
+        global_config = global_config or {'groups': {}}
         self.mock_load_repo_config = self.load_repo_config_patcher.start()
-        self.mock_load_repo_config.return_value = repo_config
+        self.mock_load_repo_config.return_value = RepoConfig(
+            repo_config, global_config
+        )
 
-        self.handler = newpr.HighfiveHandler(payload, config)
+        registry = ConfigRegistry({}, global_config)
+        self.handler = handler_class(payload, config, registry)
+        # Don't share cached answers between tests.
+        self.handler.collaborators = CollaboratorCache()
 
     def __enter__(self):
         return self
@@ -78,34 +95,30 @@ class TestHighfiveHandler(TestNewPR):
             assert m.handler.integration_token == 'integrationToken'
             assert m.handler.repo_config == {'a': 'config!'}
 
-    @mock.patch('highfive.newpr.HighfiveHandler._load_json_file')
-    def test_load_repo_config_supported(self, mock_load_json_file):
-        mock_load_json_file.return_value = {'a': 'config!'}
+    def test_load_repo_config_supported(self):
         payload = Payload({
             'action': 'opened',
             'repository': {'full_name': 'foo/blah'}
         })
         m = HighfiveHandlerMock(payload)
         m.stop_patchers()
-        assert m.handler.load_repo_config() == {'a': 'config!'}
-        mock_load_json_file.assert_called_once_with(
-            os.path.join('foo', 'blah.json'),
+        m.handler.registry = ConfigRegistry(
+            {'foo/blah': {'a': 'config!'}}, {'groups': {}}
         )
+        assert m.handler.load_repo_config() == {'a': 'config!'}
 
-    @mock.patch('highfive.newpr.HighfiveHandler._load_json_file')
-    def test_load_repo_config_unsupported(self, mock_load_json_file):
-        mock_load_json_file.side_effect = IOError
+    def test_load_repo_config_unsupported(self):
         payload = Payload({
             'action': 'created',
             'repository': {'full_name': 'foo/blah'}
         })
         m = HighfiveHandlerMock(payload)
         m.stop_patchers()
+        m.handler.registry = ConfigRegistry(
+            {'foo/other': {'a': 'config!'}}, {'groups': {}}
+        )
         with pytest.raises(newpr.UnsupportedRepoError):
             m.handler.load_repo_config()
-        mock_load_json_file.assert_called_once_with(
-            os.path.join('foo', 'blah.json'),
-        )
 
 
 class TestNewPRGeneral(TestNewPR):
@@ -157,17 +170,6 @@ Please see [the contribution instructions](%s) for more information.
         assert handler.review_msg('userA', 'userB') == \
                'r? @userA\n\n(rust-highfive has picked a reviewer for you, use r? to override)'
 
-    @mock.patch('os.path.dirname')
-    def test_load_json_file(self, mock_dirname):
-        handler = HighfiveHandlerMock(Payload({})).handler
-        mock_dirname.return_value = '/the/path'
-        contents = ['some json']
-        with mock.patch(
-                'builtins.open', mock.mock_open(read_data=json.dumps(contents))
-        ) as mock_file:
-            assert handler._load_json_file('a-config.json') == contents
-            mock_file.assert_called_with(os.path.join(mock_dirname.return_value, 'configs', 'a-config.json'))
-
     @mock.patch('highfive.newpr.HighfiveHandler.api_req')
     def test_post_comment_success(self, mock_api_req):
         handler = HighfiveHandlerMock(Payload({})).handler
@@ -193,6 +195,93 @@ Please see [the contribution instructions](%s) for more information.
             {'body': 'Request body!'}
         )
 
+    @mock.patch('highfive.newpr.HighfiveHandler.api_req')
+    def test_post_comment_retry(self, mock_api_req):
+        handler = HighfiveHandlerMock(Payload({})).handler
+        handler.retry = RetryPolicy(sleep=lambda delay: None)
+        mock_api_req.side_effect = [
+            HTTPError(None, 502, None, None, None),
+            # The comment wasn't created by the failed request.
+            {'body': json.dumps([
+                {'user': {'login': 'someone'}, 'body': 'Request body!'},
+                {'user': {'login': 'integrationUser'}, 'body': 'Other'},
+            ])},
+            {'body': 'response body!'},
+        ]
+        handler.post_comment('Request body!', 'repo-owner', 'repo-name', 7)
+
+        url = 'https://api.github.com/repos/repo-owner/repo-name/issues/7/comments'
+        calls = mock_api_req.call_args_list
+        assert len(calls) == 3
+        assert calls[0] == calls[2] == mock.call(
+            'POST', url, {'body': 'Request body!'}
+        )
+        assert calls[1][0][0] == 'GET'
+        assert calls[1][0][1].startswith(url + '?since=')
+
+    @mock.patch('highfive.newpr.HighfiveHandler.api_req')
+    def test_post_comment_retry_existing(self, mock_api_req):
+        handler = HighfiveHandlerMock(Payload({})).handler
+        handler.retry = RetryPolicy(sleep=lambda delay: None)
+        mock_api_req.side_effect = [
+            HTTPError(None, 504, None, None, None),
+            {'body': json.dumps([
+                {'user': {'login': 'integrationUser'}, 'body': 'Request body!'},
+            ])},
+        ]
+        found = stats.get('retry.comments_found')
+        handler.post_comment('Request body!', 'repo-owner', 'repo-name', 7)
+
+        # The comment was created despite the error, and isn't posted again.
+        assert mock_api_req.call_count == 2
+        assert stats.get('retry.comments_found') == found + 1
+
+    @mock.patch('highfive.newpr.HighfiveHandler.api_req')
+    def test_post_comment_retry_timeout(self, mock_api_req):
+        handler = HighfiveHandlerMock(Payload({})).handler
+        handler.retry = RetryPolicy(sleep=lambda delay: None)
+        mock_api_req.side_effect = [
+            requests.ReadTimeout(),
+            {'body': '[]'},
+            {'body': 'response body!'},
+        ]
+        handler.post_comment('Request body!', 'repo-owner', 'repo-name', 7)
+
+        # The comment wasn't created before the request timed out, and is
+        # posted again.
+        calls = mock_api_req.call_args_list
+        assert [call[0][0] for call in calls] == ['POST', 'GET', 'POST']
+
+    @mock.patch('highfive.newpr.HighfiveHandler.api_req')
+    def test_post_comment_retry_reserve(self, mock_api_req):
+        handler = HighfiveHandlerMock(Payload({})).handler
+        sleeps = []
+        handler.retry = RetryPolicy(base_delay=1, sleep=sleeps.append)
+        handler.deadline = Deadline(9, reserve=8.9)
+        mock_api_req.side_effect = [
+            HTTPError(None, 502, None, None, None),
+            {'body': '[]'},
+            {'body': 'response body!'},
+        ]
+        handler.post_comment('Request body!', 'repo-owner', 'repo-name', 7)
+
+        # The wait leaves the reserve of the deadline.
+        assert len(sleeps) == 1
+        assert sleeps[0] <= 0.1
+
+    @mock.patch('highfive.newpr.HighfiveHandler.api_req')
+    def test_post_comment_retries_exhausted(self, mock_api_req):
+        handler = HighfiveHandlerMock(Payload({})).handler
+        handler.retry = RetryPolicy(retries=1, sleep=lambda delay: None)
+        mock_api_req.side_effect = [
+            HTTPError(None, 502, None, None, None),
+            {'body': '[]'},
+            HTTPError(None, 502, None, None, None),
+        ]
+        with pytest.raises(HTTPError):
+            handler.post_comment('Request body!', 'repo-owner', 'repo-name', 7)
+        assert mock_api_req.call_count == 3
+
     @mock.patch('highfive.newpr.HighfiveHandler.api_req')
     def test_post_comment_error(self, mock_api_req):
         handler = HighfiveHandlerMock(Payload({})).handler
@@ -246,6 +335,87 @@ Please see [the contribution instructions](%s) for more information.
             None
         )
 
+    @mock.patch('highfive.newpr.HighfiveHandler.api_req')
+    def test_is_collaborator_cached(self, mock_api_req):
+        handler = HighfiveHandlerMock(Payload({})).handler
+        mock_api_req.side_effect = [
+            {}, HTTPError(None, 404, None, None, None)
+        ]
+        for _ in range(2):
+            assert handler.is_collaborator(
+                'commentUser', 'repo-owner', 'repo-name'
+            )
+            assert not handler.is_collaborator(
+                'otherUser', 'repo-owner', 'repo-name'
+            )
+        assert mock_api_req.call_count == 2
+
+    @mock.patch('highfive.newpr.HighfiveHandler.api_req')
+    def test_is_collaborator_author_association(self, mock_api_req):
+        saved = stats.get('author_association.saved_requests')
+        for association in ('OWNER', 'COLLABORATOR'):
+            handler = HighfiveHandlerMock(Payload({'comment': {
+                'user': {'login': 'commentUser'},
+                'author_association': association,
+            }})).handler
+            assert handler.is_collaborator(
+                'commentUser', 'repo-owner', 'repo-name'
+            )
+        mock_api_req.assert_not_called()
+        assert stats.get('author_association.saved_requests') == saved + 2
+
+        # Organization members may have access to the repository, even if
+        # their membership is private.
+        for association in (
+                'MEMBER', 'CONTRIBUTOR', 'NONE', 'FIRST_TIME_CONTRIBUTOR',
+        ):
+            handler = HighfiveHandlerMock(Payload({'comment': {
+                'user': {'login': 'commentUser'},
+                'author_association': association,
+            }})).handler
+            assert handler.is_collaborator(
+                'commentUser', 'repo-owner', 'repo-name'
+            )
+        assert mock_api_req.call_count == 4
+        assert stats.get('author_association.saved_requests') == saved + 2
+
+    def test_member_changed(self):
+        handler = HighfiveHandlerMock(Payload({
+            'action': 'removed',
+            'member': {'login': 'commentUser'},
+            'repository': {
+                'name': 'repo-name', 'owner': {'login': 'repo-owner'}
+            },
+        })).handler
+        handler.collaborators.put(
+            'repo-owner', 'repo-name', 'commentUser', True
+        )
+        assert handler.run('member') == 'OK, updated collaborators\n'
+        assert handler.collaborators.get(
+            'repo-owner', 'repo-name', 'commentUser'
+        ) is None
+
+    def test_pr_closed(self, tmp_path):
+        payload = fakes.Payload.new_pr(pr_author='prAuthor')
+        payload._payload['action'] = 'closed'
+        handler = HighfiveHandlerMock(payload).handler
+        handler.contributors = ContributorStore(str(tmp_path / 'db'))
+        handler.contributor_index = ContributorIndex(str(tmp_path / 'db'))
+        handler.contributor_index.build('repo-owner', 'repo-name', [])
+
+        payload._payload['pull_request']['merged'] = False
+        assert handler.run('pull_request') == 'OK, handled closed PR\n'
+        assert not handler.contributor_index.contains(
+            'repo-owner', 'repo-name', 'prAuthor'
+        )
+
+        payload._payload['pull_request']['merged'] = True
+        handler.run('pull_request')
+        assert handler.contributor_index.contains(
+            'repo-owner', 'repo-name', 'prAuthor'
+        )
+        assert handler.contributors.get('repo-owner', 'repo-name', 'prAuthor')
+
     @mock.patch('highfive.newpr.HighfiveHandler.api_req')
     def test_add_labels_success(self, mock_api_req):
         mock_api_req.return_value = {'body': 'response body!'}
@@ -276,24 +446,24 @@ Please see [the contribution instructions](%s) for more information.
 
     def test_submodule(self):
         handler = HighfiveHandlerMock(Payload({})).handler
-        submodule_diff = load_fake('submodule.diff')
+        submodule_diff = DiffAnalysis(load_fake('submodule.diff'))
         assert handler.modifies_submodule(submodule_diff)
 
-        normal_diff = load_fake('normal.diff')
+        normal_diff = DiffAnalysis(load_fake('normal.diff'))
         assert not handler.modifies_submodule(normal_diff)
 
-        targets_diff = load_fake('target.diff')
+        targets_diff = DiffAnalysis(load_fake('target.diff'))
         assert not handler.modifies_submodule(targets_diff)
 
     def test_targets(self):
         handler = HighfiveHandlerMock(Payload({})).handler
-        targets_diff = load_fake('target.diff')
+        targets_diff = DiffAnalysis(load_fake('target.diff'))
         assert handler.modifies_targets(targets_diff)
 
-        normal_diff = load_fake('normal.diff')
+        normal_diff = DiffAnalysis(load_fake('normal.diff'))
         assert not handler.modifies_targets(normal_diff)
 
-        submodule_diff = load_fake('submodule.diff')
+        submodule_diff = DiffAnalysis(load_fake('submodule.diff'))
         assert not handler.modifies_targets(submodule_diff)
 
     def test_expected_branch_default_expected_no_match(self):
@@ -359,139 +529,173 @@ Please see [the contribution instructions](%s) for more information.
             assert handler.find_reviewer(msg, None) is None, \
                 "expected '%s' to have no reviewer extracted" % msg
 
-class TestApiReq(TestNewPR):
+
+class TestAnalyzePr(TestNewPR):
     @pytest.fixture(autouse=True)
     def make_defaults(cls, patcherize):
         cls.mocks = patcherize((
-            ('urlopen', 'urllib.request.urlopen'),
-            ('Request', 'urllib.request.Request'),
-            ('StringIO', 'highfive.newpr.StringIO'),
-            ('GzipFile', 'gzip.GzipFile'),
+            ('api_req', 'highfive.newpr.HighfiveHandler.api_req'),
+            ('_open', 'highfive.newpr.HighfiveHandler._open'),
         ))
+        cls.payload = fakes.Payload.new_pr()
+        cls.res = cls.mocks['_open'].return_value
+        cls.res.headers = {}
+        cls.res.raw.read.side_effect = io.BytesIO(fakes.make_fake_diff([
+            ('src/jemalloc', 1, 1),
+        ]).replace(
+            '+Added line 0', '+Subproject commit 1234'
+        ).encode('utf-8')).read
+
+    def make_handler(self, config={}):
+        return HighfiveHandlerMock(self.payload, repo_config=config).handler
+
+    def files_page(self, count, patch='@@ -1 +1 @@\n-a\n+b'):
+        entries = [
+            {
+                'filename': 'src/file%d.rs' % n, 'status': 'modified',
+                'additions': 1, 'deletions': 1, 'changes': 2, 'patch': patch,
+            }
+            for n in range(count)
+        ]
+        return {'body': json.dumps(entries), 'header': {}}
 
-        cls.req = cls.mocks['Request'].return_value
-
-        cls.res = cls.mocks['urlopen'].return_value
-        cls.res.info.return_value = {'Content-Encoding': 'gzip'}
-
-        cls.body = cls.res.read.return_value = b'body1'
-
-        cls.gzipped_body = cls.mocks['GzipFile'].return_value.read
-        cls.gzipped_body.return_value = b'body2'
-
-        cls.handler = HighfiveHandlerMock(Payload({})).handler
-
-        cls.method = 'METHOD'
-        cls.url = 'https://foo.bar'
-
-    def verify_mock_calls(self, header_calls, gzipped):
-        self.mocks['Request'].assert_called_with(
-            self.url, json.dumps(self.data).encode("utf-8") if self.data else self.data,
-            {'Content-Type': 'application/json'} if self.data else {}
-        )
-        assert self.req.get_method() == 'METHOD'
-
-        assert len(self.req.add_header.mock_calls) == len(header_calls)
-        self.req.add_header.assert_has_calls(header_calls)
-
-        self.mocks['urlopen'].assert_called_with(self.req)
-        self.res.info.assert_called_once()
-        self.res.read.assert_called_once()
-
-        if gzipped:
-            self.mocks['StringIO'].assert_called_with(self.body)
-            self.mocks['GzipFile'].assert_called_with(
-                fileobj=self.mocks['StringIO'].return_value
-            )
-            self.gzipped_body.assert_called_once()
-        else:
-            self.mocks['StringIO'].assert_not_called()
-            self.mocks['GzipFile'].assert_not_called()
-            self.gzipped_body.assert_not_called()
-
-    def call_api_req(self):
-        self.handler.integration_token = self.token
-        return self.handler.api_req(
-            self.method, self.url, self.data, media_type=self.media_type
+    def test_diff(self):
+        analysis = self.make_handler().analyze_pr()
+        self.mocks['_open'].assert_called_once_with(
+            'GET', 'https://the.url/', None, 'application/vnd.github.v3.diff',
+            stream=True,
         )
-
-    def test1(self):
-        """No data, no token, no media_type, header (gzip/no gzip)"""
-        (self.data, self.token, self.media_type) = (None, None, None)
-
-        assert self.call_api_req() == {
-            'header': {'Content-Encoding': 'gzip'}, 'body': 'body2'
+        self.mocks['api_req'].assert_not_called()
+        assert [r.path for r in analysis.files] == ['src/jemalloc']
+        assert analysis.any('submodule')
+
+    def test_spooled_diff(self):
+        handler = self.make_handler()
+        handler.diff_spool_size = 10
+        analysis = handler.analyze_pr()
+        assert [r.path for r in analysis.files] == ['src/jemalloc']
+        assert analysis.any('submodule')
+        self.res.raw.close.assert_called_once_with()
+
+    def test_file_stats_config(self):
+        self.mocks['api_req'].side_effect = [
+            self.files_page(100), self.files_page(3),
+        ]
+        analysis = self.make_handler({'file_stats': True}).analyze_pr()
+        self.mocks['_open'].assert_not_called()
+        assert self.mocks['api_req'].call_args_list == [
+            mock.call('GET', 'https://the.url//files?per_page=100&page=1'),
+            mock.call('GET', 'https://the.url//files?per_page=100&page=2'),
+        ]
+        assert len(analysis.files) == 103
+        assert analysis.files[0].changes == 2
+        assert analysis.files[0].status == 'modified'
+        assert not analysis.incomplete
+
+    def test_many_changed_files(self):
+        self.payload._payload['pull_request']['changed_files'] = 301
+        self.mocks['api_req'].return_value = self.files_page(1)
+        self.make_handler().analyze_pr()
+        self.mocks['_open'].assert_not_called()
+        self.mocks['api_req'].assert_called_once_with(
+            'GET', 'https://the.url//files?per_page=100&page=1'
+        )
+
+    def test_large_diff(self):
+        self.res.headers = {'Content-Length': str(20 * 1024 * 1024)}
+        self.mocks['api_req'].return_value = self.files_page(1, patch=None)
+        analysis = self.make_handler().analyze_pr()
+        # The diff is not read, and not downloaded again for the content
+        # checks.
+        self.mocks['_open'].assert_called_once()
+        self.res.raw.read.assert_not_called()
+        self.res.close.assert_called_once_with()
+        assert analysis.incomplete
+        assert [r.path for r in analysis.files] == ['src/file0.rs']
+
+    def test_large_chunked_diff(self):
+        # Compressed diffs have no Content-Length.
+        self.res.raw.read.side_effect = io.BytesIO(
+            b'x' * (newpr.file_stats_diff_size + 1)
+        ).read
+        self.mocks['api_req'].return_value = self.files_page(1, patch=None)
+        analysis = self.make_handler().analyze_pr()
+        self.mocks['_open'].assert_called_once()
+        self.res.raw.close.assert_called_once_with()
+        assert analysis.incomplete
+        assert [r.path for r in analysis.files] == ['src/file0.rs']
+
+    def test_missing_patch(self):
+        self.mocks['api_req'].return_value = {
+            'body': json.dumps([{
+                'filename': 'src/jemalloc', 'status': 'modified',
+                'additions': 1, 'deletions': 1, 'changes': 2,
+            }]),
+            'header': {},
         }
-        self.verify_mock_calls([], True)
-
-    def test2(self):
-        """Has data, no token, no media_type, response gzipped"""
-        (self.data, self.token, self.media_type) = (
-            {'some': 'data'}, None, None
+        analysis = self.make_handler({'file_stats': True}).analyze_pr()
+        # The content checks fall back to the diff.
+        self.mocks['_open'].assert_called_once_with(
+            'GET', 'https://the.url/', None, 'application/vnd.github.v3.diff',
+            stream=True,
         )
+        assert analysis.any('submodule')
+        assert not analysis.incomplete
 
-        assert self.call_api_req() == {
-            'header': {'Content-Encoding': 'gzip'}, 'body': 'body2'
-        }
-        self.verify_mock_calls([], True)
-
-    def test3(self):
-        """Has data, has token, no media_type, response gzipped"""
-        (self.data, self.token, self.media_type) = (
-            {'some': 'data'}, 'credential', None
-        )
 
-        assert self.call_api_req() == {
-            'header': {'Content-Encoding': 'gzip'}, 'body': 'body2'
-        }
-        calls = [
-            mock.call('Authorization', 'token %s' % self.token),
-        ]
-        self.verify_mock_calls(calls, True)
+class TestApiReq(TestNewPR):
+    @pytest.fixture(autouse=True)
+    def make_defaults(cls):
+        cls.handler = HighfiveHandlerMock(Payload({})).handler
+        cls.method = 'PATCH'
+        cls.url = 'https://foo.bar/'
 
-    def test4(self):
-        """Has data, no token, has media_type, response gzipped"""
-        (self.data, self.token, self.media_type) = (
-            {'some': 'data'}, None, 'this.media.type'
+    def call_api_req(self, data, token, media_type):
+        self.handler.integration_token = token
+        return self.handler.api_req(
+            self.method, self.url, data, media_type=media_type
         )
 
-        assert self.call_api_req() == {
-            'header': {'Content-Encoding': 'gzip'}, 'body': 'body2'
-        }
-        calls = [
-            mock.call('Accept', self.media_type),
-        ]
-        self.verify_mock_calls(calls, True)
+    @responses.activate
+    def test_no_data_no_token(self):
+        responses.add(self.method, self.url, body='body1', headers={'A': 'b'})
+        result = self.call_api_req(None, None, None)
+        assert result['body'] == 'body1'
+        assert result['header']['A'] == 'b'
+
+        request = responses.calls[0].request
+        assert request.body is None
+        assert 'Authorization' not in request.headers
+        assert 'Content-Type' not in request.headers
 
-    def test5(self):
-        """Has data, has token, has media_type, response gzipped"""
-        (self.data, self.token, self.media_type) = (
+    @responses.activate
+    def test_data_token_media_type(self):
+        responses.add(self.method, self.url, body='body1')
+        result = self.call_api_req(
             {'some': 'data'}, 'credential', 'the.media.type'
         )
+        assert result['body'] == 'body1'
 
-        assert self.call_api_req() == {
-            'header': {'Content-Encoding': 'gzip'}, 'body': 'body2'
-        }
-        calls = [
-            mock.call('Authorization', 'token %s' % self.token),
-            mock.call('Accept', self.media_type),
-        ]
-        self.verify_mock_calls(calls, True)
+        request = responses.calls[0].request
+        assert json.loads(request.body) == {'some': 'data'}
+        assert request.headers['Content-Type'] == 'application/json'
+        assert request.headers['Authorization'] == 'token credential'
+        assert request.headers['Accept'] == 'the.media.type'
 
-    def test6(self):
-        """Has data, has token, has media_type, response not gzipped"""
-        (self.data, self.token, self.media_type) = (
-            {'some': 'data'}, 'credential', 'the.media.type'
+    @responses.activate
+    def test_gzipped(self):
+        responses.add(
+            self.method, self.url, body=gzip.compress(b'body2'),
+            headers={'Content-Encoding': 'gzip'},
         )
+        assert self.call_api_req(None, None, None)['body'] == 'body2'
 
-        self.res.info.return_value = {}
-
-        assert self.call_api_req() == {'header': {}, 'body': 'body1'}
-        calls = [
-            mock.call('Authorization', 'token %s' % self.token),
-            mock.call('Accept', self.media_type),
-        ]
-        self.verify_mock_calls(calls, False)
+    @responses.activate
+    def test_error(self):
+        responses.add(self.method, self.url, status=422, body='{}')
+        with pytest.raises(HTTPError) as e:
+            self.call_api_req({'some': 'data'}, 'credential', None)
+        assert e.value.code == 422
 
 
 class TestSetAssignee(TestNewPR):
@@ -572,10 +776,11 @@ class TestSetAssignee(TestNewPR):
         self.set_assignee(to_mention=to_mention)
 
         self.assert_api_req_call()
-        self.mocks['post_comment'].assert_called_once_with(
+        # The message is posted with the other comments of the event.
+        self.mocks['post_comment'].assert_not_called()
+        assert self.handler.comments == [
             'This is important\n\ncc @userA,@userB,@userC\n\nAlso important\n\ncc @userD\n\nlast message but this one has nobody to mention associated with it',
-            self.owner, self.repo, self.issue
-        )
+        ]
 
     def test_no_assignee(self):
         self.set_assignee(None)
@@ -615,6 +820,58 @@ class TestIsNewContributor(TestNewPR):
             ), None, 'application/vnd.github.cloak-preview'
         )
 
+    def test_is_new_contributor_cached(self, tmp_path):
+        handler = HighfiveHandlerMock(Payload(self.payload)).handler
+        handler.contributors = ContributorStore(str(tmp_path / 'db'))
+        self.mocks['api_req'].return_value = self.api_return(5)
+        for _ in range(2):
+            assert not handler.is_new_contributor(
+                self.username, self.owner, self.repo
+            )
+        self.assert_api_req_call()
+
+    def test_is_new_contributor_rate_limited(self):
+        skipped = stats.get('ratelimit.skipped_contributor_checks')
+        with mock.patch.object(newpr.client, 'delay', return_value=30):
+            assert not self.is_new_contributor()
+        self.mocks['api_req'].assert_not_called()
+        assert stats.get('ratelimit.skipped_contributor_checks') == skipped + 1
+
+    def test_is_new_contributor_author_association(self):
+        saved = stats.get('author_association.saved_requests')
+        self.payload._payload['pull_request'] = {
+            'user': {'login': self.username},
+            'author_association': 'FIRST_TIME_CONTRIBUTOR',
+        }
+        assert self.is_new_contributor()
+        self.payload._payload['pull_request']['author_association'] = \
+            'CONTRIBUTOR'
+        assert not self.is_new_contributor()
+        self.mocks['api_req'].assert_not_called()
+        assert stats.get('author_association.saved_requests') == saved + 2
+
+        # Collaborators may not have any commit yet.
+        self.payload._payload['pull_request']['author_association'] = \
+            'COLLABORATOR'
+        self.mocks['api_req'].return_value = self.api_return(0)
+        assert self.is_new_contributor()
+        self.assert_api_req_call()
+
+    def test_is_new_contributor_indexed(self, tmp_path):
+        handler = HighfiveHandlerMock(Payload(self.payload)).handler
+        handler.contributor_index = ContributorIndex(str(tmp_path / 'db'))
+        handler.contributor_index.build(self.owner, self.repo, [self.username])
+        assert not handler.is_new_contributor(
+            self.username, self.owner, self.repo
+        )
+        self.mocks['api_req'].assert_not_called()
+
+        # Users missing from the index are searched.
+        self.username = 'otherUser'
+        self.mocks['api_req'].return_value = self.api_return(0)
+        assert handler.is_new_contributor(self.username, self.owner, self.repo)
+        self.assert_api_req_call()
+
     def test_is_new_contributor_fork(self):
         self.payload._payload['repository']['fork'] = True
         assert not self.is_new_contributor()
@@ -680,6 +937,7 @@ class TestPostWarnings(TestNewPR):
         self.mocks['modifies_submodule'].assert_called_with(self.diff)
         self.mocks['modifies_targets'].assert_called_with(self.diff)
         self.mocks['post_comment'].assert_not_called()
+        assert self.handler.comments == []
 
     def test_unexpected_branch(self):
         self.mocks['unexpected_branch'].return_value = (
@@ -697,9 +955,7 @@ class TestPostWarnings(TestNewPR):
         expected_warning = """:warning: **Warning** :warning:
 
 * Pull requests are usually filed against the master branch for this repo, but this one is against something-else. Please double check that you specified the right target!"""
-        self.mocks['post_comment'].assert_called_with(
-            expected_warning, self.owner, self.repo, self.issue
-        )
+        assert self.handler.comments == [expected_warning]
 
     def test_modifies_submodule(self):
         self.mocks['unexpected_branch'].return_value = False
@@ -715,9 +971,7 @@ class TestPostWarnings(TestNewPR):
         expected_warning = """:warning: **Warning** :warning:
 
 * These commits modify **submodules**."""
-        self.mocks['post_comment'].assert_called_with(
-            expected_warning, self.owner, self.repo, self.issue
-        )
+        assert self.handler.comments == [expected_warning]
 
     def test_unexpected_branch_modifies_submodule(self):
         self.mocks['unexpected_branch'].return_value = (
@@ -736,9 +990,7 @@ class TestPostWarnings(TestNewPR):
 
 * Pull requests are usually filed against the master branch for this repo, but this one is against something-else. Please double check that you specified the right target!
 * These commits modify **submodules**."""
-        self.mocks['post_comment'].assert_called_with(
-            expected_warning, self.owner, self.repo, self.issue
-        )
+        assert self.handler.comments == [expected_warning]
 
     def test_unexpected_branch_modifies_submodule_and_targets(self):
         self.mocks['unexpected_branch'].return_value = (
@@ -758,16 +1010,14 @@ class TestPostWarnings(TestNewPR):
 * Pull requests are usually filed against the master branch for this repo, but this one is against something-else. Please double check that you specified the right target!
 * These commits modify **submodules**.
 * These commits modify **compiler targets**. (See the [Target Tier Policy](https://doc.rust-lang.org/nightly/rustc/target-tier-policy.html).)"""
-        self.mocks['post_comment'].assert_called_with(
-            expected_warning, self.owner, self.repo, self.issue
-        )
+        assert self.handler.comments == [expected_warning]
 
 
 class TestNewPrFunction(TestNewPR):
     @pytest.fixture(autouse=True)
     def make_defaults(cls, patcherize):
         cls.mocks = patcherize((
-            ('api_req', 'highfive.newpr.HighfiveHandler.api_req'),
+            ('analyze_pr', 'highfive.newpr.HighfiveHandler.analyze_pr'),
             ('find_reviewer', 'highfive.newpr.HighfiveHandler.find_reviewer'),
             ('choose_reviewer', 'highfive.newpr.HighfiveHandler.choose_reviewer'),
             ('get_to_mention', 'highfive.newpr.HighfiveHandler.get_to_mention'),
@@ -780,23 +1030,24 @@ class TestNewPrFunction(TestNewPR):
             ('add_labels', 'highfive.newpr.HighfiveHandler.add_labels'),
         ))
 
-        cls.mocks['api_req'].return_value = {'body': 'diff'}
+        cls.analysis = cls.mocks['analyze_pr'].return_value
 
         cls.payload = fakes.Payload.new_pr()
         cls.config = {'the': 'config', 'new_pr_labels': ['foo-label']}
         cls.user = 'integrationUser'
         cls.token = 'integrationToken'
 
+    handler_class = newpr.HighfiveHandler
+
     def call_new_pr(self):
         handler = HighfiveHandlerMock(
-            self.payload, repo_config=self.config
+            self.payload, repo_config=self.config,
+            handler_class=self.handler_class,
         ).handler
         return handler.new_pr()
 
     def assert_set_assignee_branch_calls(self, reviewer, to_mention):
-        self.mocks['api_req'].assert_called_once_with(
-            'GET', 'https://the.url/', None, 'application/vnd.github.v3.diff'
-        )
+        self.mocks['analyze_pr'].assert_called_once_with()
         self.mocks['find_reviewer'].assert_called_once_with('The PR comment.', 'prAuthor')
         self.mocks['set_assignee'].assert_called_once_with(
             reviewer, 'repo-owner', 'repo-name', '7', self.user, 'prAuthor',
@@ -806,7 +1057,7 @@ class TestNewPrFunction(TestNewPR):
             'prAuthor', 'repo-owner', 'repo-name'
         )
         self.mocks['post_warnings'].assert_called_once_with(
-            'diff', 'repo-owner', 'repo-name', '7'
+            self.analysis, 'repo-owner', 'repo-name', '7'
         )
 
     def test_no_msg_reviewer_new_contributor(self):
@@ -820,7 +1071,7 @@ class TestNewPrFunction(TestNewPR):
 
         self.assert_set_assignee_branch_calls('reviewUser', ['to', 'mention'])
         self.mocks['choose_reviewer'].assert_called_once_with(
-            'repo-name', 'repo-owner', 'diff', 'prAuthor'
+            'repo-name', 'repo-owner', self.analysis, 'prAuthor'
         )
         self.mocks['welcome_msg'].assert_called_once_with('reviewUser')
         self.mocks['review_msg'].assert_not_called()
@@ -842,7 +1093,7 @@ class TestNewPrFunction(TestNewPR):
 
         self.assert_set_assignee_branch_calls('reviewUser', ['to', 'mention'])
         self.mocks['choose_reviewer'].assert_called_once_with(
-            'repo-name', 'repo-owner', 'diff', 'prAuthor'
+            'repo-name', 'repo-owner', self.analysis, 'prAuthor'
         )
         self.mocks['welcome_msg'].assert_not_called()
         self.mocks['review_msg'].assert_called_once_with(
@@ -865,7 +1116,9 @@ class TestNewPrFunction(TestNewPR):
 
         self.assert_set_assignee_branch_calls('foundReviewer', ['to'])
         self.mocks['choose_reviewer'].assert_not_called()
-        self.mocks['get_to_mention'].assert_called_once_with('diff', 'prAuthor')
+        self.mocks['get_to_mention'].assert_called_once_with(
+            self.analysis, 'prAuthor'
+        )
         self.mocks['welcome_msg'].assert_not_called()
         self.mocks['review_msg'].assert_not_called()
         self.mocks['post_comment'].assert_not_called()
@@ -880,9 +1133,7 @@ class TestNewPrFunction(TestNewPR):
 
         self.call_new_pr()
 
-        self.mocks['api_req'].assert_called_once_with(
-            'GET', 'https://the.url/', None, 'application/vnd.github.v3.diff'
-        )
+        self.mocks['analyze_pr'].assert_called_once_with()
         self.mocks['find_reviewer'].assert_not_called()
         self.mocks['choose_reviewer'].assert_not_called()
         self.mocks['set_assignee'].assert_not_called()
@@ -891,7 +1142,7 @@ class TestNewPrFunction(TestNewPR):
         self.mocks['review_msg'].assert_not_called()
         self.mocks['post_comment'].assert_not_called()
         self.mocks['post_warnings'].assert_called_once_with(
-            'diff', 'repo-owner', 'repo-name', '7'
+            self.analysis, 'repo-owner', 'repo-name', '7'
         )
 
         self.mocks['add_labels'].assert_called_once_with(
@@ -937,6 +1188,154 @@ class TestNewPrFunction(TestNewPR):
         self.mocks['add_labels'].assert_not_called()
 
 
+    def test_single_comment(self):
+        self.mocks['find_reviewer'].return_value = None
+        self.mocks['choose_reviewer'].return_value = 'reviewUser'
+        self.mocks['get_to_mention'].return_value = []
+        self.mocks['is_new_contributor'].return_value = False
+        self.mocks['review_msg'].return_value = 'Review message!'
+        self.mocks['set_assignee'].side_effect = \
+            lambda *args: handler.add_comment('cc @someone')
+        self.mocks['post_warnings'].side_effect = \
+            lambda *args: handler.add_comment('Warning!')
+        handler = HighfiveHandlerMock(
+            self.payload, repo_config=self.config
+        ).handler
+
+        handler.new_pr()
+
+        self.mocks['post_comment'].assert_called_once_with(
+            'cc @someone\n\nReview message!\n\nWarning!',
+            'repo-owner', 'repo-name', '7'
+        )
+        assert handler.comments == []
+
+    def test_low_budget(self):
+        self.mocks['find_reviewer'].return_value = 'foundReviewer'
+        self.mocks['get_to_mention'].return_value = []
+        self.mocks['post_warnings'].side_effect = \
+            lambda *args: threads.append(threading.current_thread())
+        threads = []
+        handler = HighfiveHandlerMock(
+            self.payload, repo_config=self.config,
+            handler_class=self.handler_class,
+        ).handler
+        handler.deadline = Deadline(5, reserve=10)
+        deferred = stats.get('deadline.deferred_warnings')
+        skipped = stats.get('deadline.skipped_analyses')
+        started = []
+        defer_warnings = handler.defer_warnings
+        handler.defer_warnings = \
+            lambda *args: started.append(defer_warnings(*args))
+
+        handler.new_pr()
+        started[0].join(5)
+
+        # The new contributor check is skipped, the reviewer is picked
+        # without analyzing the PR, and the warnings are posted (and the PR
+        # analyzed) in the background.
+        self.mocks['is_new_contributor'].assert_not_called()
+        self.mocks['get_to_mention'].assert_called_once_with(None, 'prAuthor')
+        self.mocks['post_warnings'].assert_called_once_with(
+            self.analysis, 'repo-owner', 'repo-name', '7'
+        )
+        self.mocks['analyze_pr'].assert_called_once_with()
+        assert threads[0] is not threading.current_thread()
+        assert stats.get('deadline.deferred_warnings') == deferred + 1
+        assert stats.get('deadline.skipped_analyses') == skipped + 1
+
+
+    def test_rate_limited_warnings(self):
+        self.mocks['find_reviewer'].return_value = 'foundReviewer'
+        self.mocks['get_to_mention'].return_value = []
+        self.mocks['is_new_contributor'].return_value = False
+        handler = HighfiveHandlerMock(
+            self.payload, repo_config=self.config,
+            handler_class=self.handler_class,
+        ).handler
+        deferred = stats.get('ratelimit.deferred_warnings')
+        started = []
+        handler.defer_warnings = lambda *args: started.append(args)
+
+        with mock.patch.object(newpr.client, 'delay', return_value=30):
+            handler.new_pr()
+
+        # The warnings don't wait for the rate limit to be reset.
+        assert started == [(self.analysis, 'repo-owner', 'repo-name', '7')]
+        self.mocks['post_warnings'].assert_not_called()
+        assert stats.get('ratelimit.deferred_warnings') == deferred + 1
+
+
+class TestAsyncNewPrFunction(TestNewPrFunction):
+    """Runs the `new_pr` tests against the async handler."""
+    handler_class = newpr.AsyncHighfiveHandler
+
+    def test_concurrent_calls(self):
+        self.mocks['find_reviewer'].return_value = 'foundReviewer'
+        self.mocks['get_to_mention'].return_value = []
+        self.mocks['welcome_msg'].return_value = 'Welcome!'
+        checked = threading.Event()
+        labeled = threading.Event()
+        events = []
+
+        def analyze_pr():
+            # Only returns if the contributor check runs at the same time.
+            assert checked.wait(5)
+            return self.analysis
+
+        def is_new_contributor(*args):
+            checked.set()
+            return True
+
+        def set_assignee(*args):
+            # Only returns if the labels are added at the same time.
+            assert labeled.wait(5)
+            events.append('assign')
+
+        self.mocks['analyze_pr'].side_effect = analyze_pr
+        self.mocks['is_new_contributor'].side_effect = is_new_contributor
+        self.mocks['set_assignee'].side_effect = set_assignee
+        self.mocks['add_labels'].side_effect = lambda *args: labeled.set()
+        self.mocks['post_comment'].side_effect = \
+            lambda body, *args: events.append(body)
+
+        self.call_new_pr()
+
+        # The comment is posted after the assignment.
+        assert events == ['assign', 'Welcome!']
+        self.mocks['add_labels'].assert_called_once_with(
+            'repo-owner', 'repo-name', '7'
+        )
+
+    def test_labels_with_comment(self):
+        self.payload._payload['pull_request']['assignees'] = [
+            {'login': 'assignedUser'},
+        ]
+        handler = HighfiveHandlerMock(
+            self.payload, repo_config=self.config,
+            handler_class=newpr.AsyncHighfiveHandler,
+        ).handler
+        labeled = threading.Event()
+
+        def post_comment(body, *args):
+            # Only returns if the labels are added at the same time.
+            assert labeled.wait(5)
+
+        self.mocks['post_warnings'].side_effect = \
+            lambda *args: handler.add_comment('Warning!')
+        self.mocks['post_comment'].side_effect = post_comment
+        self.mocks['add_labels'].side_effect = lambda *args: labeled.set()
+
+        handler.new_pr()
+
+        self.mocks['post_comment'].assert_called_once_with(
+            'Warning!', 'repo-owner', 'repo-name', '7'
+        )
+        self.mocks['add_labels'].assert_called_once_with(
+            'repo-owner', 'repo-name', '7'
+        )
+
+
 class TestNewComment(TestNewPR):
     @pytest.fixture(autouse=True)
     def make_mocks(cls, patcherize):
@@ -1087,28 +1486,21 @@ class TestChooseReviewer(TestNewPR):
             'global_': fakes.get_global_configs(),
         }
 
-    def get_to_mention(self, diff, author, global_=None):
-        return self.get_to_mention_inner(diff, author, global_)
+    def set_global(self, global_):
+        self.handler.repo_config = RepoConfig(
+            self.handler.repo_config, deepcopy(global_ or {"groups": {}})
+        )
 
-    @mock.patch('highfive.newpr.HighfiveHandler._load_json_file')
-    def get_to_mention_inner(self, diff, author, global_, mock_load_json):
-        mock_load_json.return_value = deepcopy(global_ or {"groups": {}})
-        return self.handler.get_to_mention(diff, author)
+    def get_to_mention(self, diff, author, global_=None):
+        self.set_global(global_)
+        return self.handler.get_to_mention(DiffAnalysis(diff), author)
 
     def choose_reviewer(
             self, repo, owner, diff, exclude, global_=None
     ):
-        return self.choose_reviewer_inner(
-            repo, owner, diff, exclude, global_
-        )
-
-    @mock.patch('highfive.newpr.HighfiveHandler._load_json_file')
-    def choose_reviewer_inner(
-            self, repo, owner, diff, exclude, global_, mock_load_json
-    ):
-        mock_load_json.return_value = deepcopy(global_ or {"groups": {}})
+        self.set_global(global_)
         return self.handler.choose_reviewer(
-            repo, owner, diff, exclude
+            repo, owner, DiffAnalysis(diff), exclude
         )
 
     def choose_reviewers(self, diff, author, global_=None):
@@ -1161,7 +1553,8 @@ class TestChooseReviewer(TestNewPR):
             Payload({}), repo_config=self.fakes['config']['circular_groups']
         ).handler
         chosen_reviewers = handler.choose_reviewer(
-            'rust', 'rust-lang', self.fakes['diff']['normal'], 'fooauthor'
+            'rust', 'rust-lang', DiffAnalysis(self.fakes['diff']['normal']),
+            'fooauthor'
         )
         assert chosen_reviewers is None
 
@@ -1190,18 +1583,14 @@ class TestChooseReviewer(TestNewPR):
         assert set(['alexcrichton']) == chosen_reviewers
         assert set() == mentions
 
-    @mock.patch('highfive.newpr.HighfiveHandler._load_json_file')
-    def test_global_group_overlap(self, mock_load_json):
+    def test_global_group_overlap(self):
         """Test for an AssertionError when the global config contains a group
         already defined in the config.
         """
-        handler = HighfiveHandlerMock(
-            Payload({}), repo_config=self.fakes['config']['individuals_no_dirs']
-        ).handler
-        mock_load_json.return_value = self.fakes['global_']['has_all']
         with pytest.raises(AssertionError):
-            handler.choose_reviewer(
-                'rust', 'rust-lang', self.fakes['diff']['normal'], 'fooauthor'
+            RepoConfig(
+                self.fakes['config']['individuals_no_dirs'],
+                self.fakes['global_']['has_all']
             )
 
     def test_no_potential_reviewers(self):
@@ -1254,6 +1643,33 @@ class TestChooseReviewer(TestNewPR):
         assert set(["pnkfelix", "nrc", "aturon"]) == chosen_reviewers
         assert set() == mentions
 
+    def test_no_analysis(self):
+        """Test that the reviewer is picked from the `all` group when the PR
+        wasn't analyzed."""
+        self.handler = HighfiveHandlerMock(
+            Payload({}), repo_config=self.fakes['config']['individual_files']
+        ).handler
+        chosen_reviewers = set(
+            self.handler.choose_reviewer(
+                'rust', 'rust-lang', None, 'nikomatsakis'
+            )
+            for _ in range(40)
+        )
+        assert set(["pnkfelix", "nrc"]) == chosen_reviewers
+        assert self.handler.get_to_mention(None, 'nikomatsakis') == []
+
+    def test_low_budget(self):
+        """Test that the `dirs` entries are still scored when the budget of
+        the event runs low, once the PR is analyzed."""
+        self.handler = HighfiveHandlerMock(
+            Payload({}), repo_config=self.fakes['config']['individual_files']
+        ).handler
+        self.handler.deadline = Deadline(5, reserve=10)
+        (chosen_reviewers, mentions) = self.choose_reviewers(
+            self.fakes['diff']['travis-yml'], "nikomatsakis"
+        )
+        assert set(["pnkfelix", "nrc", "aturon"]) == chosen_reviewers
+
     def test_mentions(self):
         """Test tagging people listed in the mentions list."""
         self.handler = HighfiveHandlerMock(
@@ -0,0 +1,124 @@
+import pytest
+
+from highfive.paths import GlobSet, MentionMatcher, PathTrie, SuffixTrie
+
+
+@pytest.mark.unit
+@pytest.mark.hermetic
+class TestPathTrie(object):
+    @pytest.fixture(autouse=True)
+    def make_trie(cls):
+        cls.trie = PathTrie([
+            'compiler',
+            'compiler/rustc_parse',
+            'compiler/rustc_parse/src/parse/lexer',
+            '.travis.yml',
+        ])
+
+    def test_longest_matches(self):
+        cases = (
+            ('compiler/foo.rs', ['compiler']),
+            ('compiler/rustc_parse/src/lib.rs', ['compiler/rustc_parse']),
+            (
+                'compiler/rustc_parse/src/parse/lexer/mod.rs',
+                ['compiler/rustc_parse/src/parse/lexer'],
+            ),
+            ('compiler', ['compiler']),
+            ('.travis.yml', ['.travis.yml']),
+            ('compiler_foo/bar.rs', []),
+            ('src/compiler/foo.rs', []),
+        )
+        for (path, expected) in cases:
+            assert self.trie.longest_matches(path.split('/')) == expected, path
+
+    def test_matches(self):
+        assert self.trie.matches(
+            'compiler/rustc_parse/src/parse/lexer/mod.rs'.split('/')
+        ) == [
+            'compiler',
+            'compiler/rustc_parse',
+            'compiler/rustc_parse/src/parse/lexer',
+        ]
+        assert self.trie.matches(['src']) == []
+
+    def test_empty_components(self):
+        trie = PathTrie(['compiler/rustc_macros//src'])
+        assert trie.longest_matches(
+            'compiler/rustc_macros//src/foo.rs'.split('/')
+        ) == ['compiler/rustc_macros//src']
+        assert trie.longest_matches(
+            'compiler/rustc_macros/src/foo.rs'.split('/')
+        ) == []
+
+
+@pytest.mark.unit
+@pytest.mark.hermetic
+class TestSuffixTrie(object):
+    def test_matches(self):
+        trie = SuffixTrie(['error_codes.rs', 'codes.rs', 'lib.rs'])
+        assert sorted(trie.matches('src/error_codes.rs')) == [
+            'codes.rs', 'error_codes.rs',
+        ]
+        assert trie.matches('src/lib.rs') == ['lib.rs']
+        assert trie.matches('src/main.rs') == []
+        assert trie.matches('') == []
+
+
+@pytest.mark.unit
+@pytest.mark.hermetic
+class TestGlobSet(object):
+    def test_matches(self):
+        globs = GlobSet([
+            'library/*/src',
+            'src/**/*.md',
+            'compiler/rustc_*',
+            '**/Cargo.toml',
+        ])
+        cases = (
+            ('library/core/src/lib.rs', ['library/*/src']),
+            ('library/core/tests/lib.rs', []),
+            ('library/core/alloc/src/lib.rs', []),
+            ('src/README.md', ['src/**/*.md']),
+            ('src/doc/book/README.md', ['src/**/*.md']),
+            ('src/doc/book/README.mdx', []),
+            ('compiler/rustc_parse/src/lib.rs', ['compiler/rustc_*']),
+            ('compiler/stable_mir/src/lib.rs', []),
+            ('Cargo.toml', ['**/Cargo.toml']),
+            ('compiler/rustc_parse/Cargo.toml', [
+                'compiler/rustc_*', '**/Cargo.toml',
+            ]),
+        )
+        for (path, expected) in cases:
+            assert globs.matches(path) == expected, path
+
+    def test_special_characters(self):
+        globs = GlobSet(['src/*.c++'])
+        assert globs.matches('src/foo.c++') == ['src/*.c++']
+        assert globs.matches('src/foo.cxx') == []
+
+    def test_empty(self):
+        assert GlobSet().matches('src/foo.rs') == []
+
+
+@pytest.mark.unit
+@pytest.mark.hermetic
+class TestMentionMatcher(object):
+    def test_matches(self):
+        matcher = MentionMatcher([
+            'src/tools/cargo',
+            'error_codes.rs',
+            'compiler/rustc',
+            'src/librustc/lib.rs',
+            'library/*/src/**/*.rs',
+        ])
+        cases = (
+            ('src/tools/cargo/src/lib.rs', {'src/tools/cargo'}),
+            ('src/tools/cargotest/main.rs', set()),
+            ('compiler/rustc_error_codes/src/error_codes.rs', {'error_codes.rs'}),
+            ('compiler/rustc/src/main.rs', {'compiler/rustc'}),
+            ('src/librustc/lib.rs', {'src/librustc/lib.rs'}),
+            ('library/std/src/io/mod.rs', {'library/*/src/**/*.rs'}),
+            ('library/std/src/io/mod.md', set()),
+        )
+        for (path, expected) in cases:
+            assert matcher.matches(path) == expected, path
@@ -26,3 +26,10 @@ class TestPayload(object):
 
         with pytest.raises(KeyError):
             self.payload.__getitem__(['pull_request', 'baz'])
+
+    def test_get(self):
+        assert self.payload.get(('pull_request', 'state')) == 'open'
+        assert self.payload.get('foo') is None
+        assert self.payload.get(['pull_request', 'baz'], 'x') == 'x'
+        # `pull_request.assignee` is null in the payload.
+        assert self.payload.get(['pull_request', 'assignee', 'login']) is None
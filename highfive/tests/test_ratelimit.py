@@ -0,0 +1,120 @@
+import pytest
+
+from highfive.ratelimit import RateLimiter, resource_for
+from highfive.tests.fakes import FakeClock
+
+
+def make_limiter(clock, **kwargs):
+    return RateLimiter(clock=clock, sleep=clock.sleep, **kwargs)
+
+
+@pytest.mark.unit
+@pytest.mark.hermetic
+class TestRateLimiter(object):
+    def test_resource_for(self):
+        assert resource_for(
+            'https://api.github.com/search/commits?q=repo:a/b'
+        ) == 'search'
+        assert resource_for('https://api.github.com/repos/a/b') == 'core'
+
+    def test_pacing(self):
+        clock = FakeClock(1000)
+        limiter = make_limiter(clock, bursts={'core': 2, 'search': 1})
+        limiter.update('core', {
+            'X-RateLimit-Remaining': '60', 'X-RateLimit-Reset': '1060',
+        })
+        # The burst is sent at once, then the budget is spread over what is
+        # left of the window, one request per second.
+        for _ in range(4):
+            limiter.acquire('core')
+        assert clock.sleeps == [1, 1]
+        assert limiter.remaining('core') == 56
+
+    def test_unknown_budget_not_paced(self):
+        clock = FakeClock(1000)
+        limiter = make_limiter(clock, bursts={'core': 1, 'search': 1})
+        for _ in range(100):
+            limiter.acquire('core')
+            limiter.acquire('search')
+        assert clock.sleeps == []
+
+    def test_capped_pacing_wait(self):
+        clock = FakeClock(1000)
+        limiter = make_limiter(clock, bursts={'core': 1, 'search': 1})
+        limiter.update('core', {
+            'X-RateLimit-Remaining': '60', 'X-RateLimit-Reset': '1060',
+        })
+        limiter.acquire('core')
+        # The requests which don't wait for their turn don't push back the
+        # following ones.
+        for _ in range(4):
+            limiter.acquire('core', max_wait=0.25)
+        limiter.acquire('core')
+        assert clock.sleeps == [0.25, 0.25, 0.25, 0.25, 1]
+
+    def test_budget(self):
+        clock = FakeClock(1000)
+        limiter = make_limiter(clock)
+        assert limiter.remaining('core') is None
+        limiter.update('core', {
+            'X-RateLimit-Remaining': '1', 'X-RateLimit-Limit': '5000',
+            'X-RateLimit-Reset': '1030', 'X-RateLimit-Resource': 'core',
+        })
+        assert limiter.remaining('core') == 1
+        limiter.acquire('core')
+        assert limiter.remaining('core') == 0
+        assert clock.sleeps == []
+        assert limiter.delay('core') == 30
+        assert limiter.delay('search') == 0
+        # The budget is exhausted until it is reset.
+        limiter.acquire('core')
+        assert clock.sleeps == [30]
+        assert limiter.delay('core') == 0
+
+    def test_budget_resource_header(self):
+        limiter = make_limiter(FakeClock(1000))
+        limiter.update('core', {
+            'X-RateLimit-Remaining': '7', 'X-RateLimit-Resource': 'search',
+        })
+        assert limiter.remaining('search') == 7
+        assert limiter.remaining('core') is None
+
+    def test_max_wait(self):
+        clock = FakeClock(1000)
+        limiter = make_limiter(clock, max_wait=5)
+        limiter.update('core', {
+            'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '5000',
+        })
+        limiter.acquire('core')
+        limiter.acquire('core', max_wait=2)
+        # Capped waits don't add up.
+        assert clock.sleeps == [5, 2]
+        assert limiter.delay('core') == 5000 - 1007
+
+    def test_is_rate_limited(self):
+        assert RateLimiter.is_rate_limited(429, {}, b'')
+        assert RateLimiter.is_rate_limited(403, {'Retry-After': '3'}, b'')
+        assert RateLimiter.is_rate_limited(
+            403, {'X-RateLimit-Remaining': '0'}, b''
+        )
+        assert RateLimiter.is_rate_limited(
+            403, {}, b'{"message": "You have exceeded a secondary rate limit"}'
+        )
+        assert not RateLimiter.is_rate_limited(
+            403, {'X-RateLimit-Remaining': '10'}, b'{"message": "Forbidden"}'
+        )
+        assert not RateLimiter.is_rate_limited(404, {'Retry-After': '3'}, b'')
+
+    def test_backoff(self):
+        clock = FakeClock(1000)
+        limiter = make_limiter(clock, base_delay=2, max_wait=1000)
+        limiter.backoff(0, {})
+        limiter.backoff(2, {})
+        limiter.backoff(0, {'Retry-After': '10'})
+        limiter.backoff(0, {
+            'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '1100',
+        })
+        expected = [2, 8, 10, 100 - sum(clock.sleeps[:3])]
+        for (sleep, delay) in zip(clock.sleeps, expected):
+            # The jitter only makes the delays longer.
+            assert delay <= sleep <= delay * 1.5
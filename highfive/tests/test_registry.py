@@ -0,0 +1,156 @@
+import json
+import os
+
+import pytest
+
+from highfive.registry import (
+    ConfigRegistry, ConfigWatcher, RepoConfig, UnsupportedRepoError,
+    default_config_dir, load_json_file,
+)
+from highfive.tests import fakes
+
+
+def write_json(path, contents):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(contents, f)
+
+
+def touch_later(path):
+    # Make sure the modification is visible even on filesystems with a coarse
+    # timestamp granularity.
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+
+@pytest.mark.unit
+@pytest.mark.hermetic
+class TestConfigRegistry(object):
+    @pytest.fixture(autouse=True)
+    def make_config_dir(cls, tmpdir):
+        cls.config_dir = str(tmpdir)
+        write_json(
+            os.path.join(cls.config_dir, '_global.json'),
+            {'groups': {'core': ['@alexcrichton']}},
+        )
+        write_json(
+            os.path.join(cls.config_dir, 'foo', 'blah.json'),
+            {'groups': {'all': ['@pnkfelix']}, 'new_pr_labels': ['a']},
+        )
+        write_json(
+            os.path.join(cls.config_dir, 'bar', 'baz.json'),
+            {'groups': {'all': []}},
+        )
+
+    def test_load_json_file(self):
+        assert load_json_file(self.config_dir, '_global.json') == {
+            'groups': {'core': ['@alexcrichton']},
+        }
+
+    def test_load(self):
+        registry = ConfigRegistry.load(self.config_dir)
+        assert len(registry) == 2
+        assert 'foo/blah' in registry
+        assert 'bar/baz' in registry
+        assert sorted(registry) == ['bar/baz', 'foo/blah']
+        assert registry.repo_config('foo/blah')['groups']['all'] == ('@pnkfelix',)
+        assert registry.global_config['groups']['core'] == ('@alexcrichton',)
+
+    def test_unsupported(self):
+        registry = ConfigRegistry.load(self.config_dir)
+        with pytest.raises(UnsupportedRepoError):
+            registry.repo_config('foo/other')
+
+    def test_immutable(self):
+        registry = ConfigRegistry.load(self.config_dir)
+        config = registry.repo_config('foo/blah')
+        with pytest.raises(TypeError):
+            config['groups'] = {}
+        with pytest.raises(AttributeError):
+            config['new_pr_labels'].append('b')
+
+    def test_load_bundled_configs(self):
+        registry = ConfigRegistry.load()
+        assert 'rust-lang/rust-mode' in registry
+        assert registry.global_config == ConfigRegistry(
+            {}, load_json_file(default_config_dir(), '_global.json')
+        ).global_config
+
+    def test_watcher_reload(self):
+        watcher = ConfigWatcher(self.config_dir)
+        old = watcher.registry
+        assert old.generation == 0
+        assert not watcher.check()
+
+        path = os.path.join(self.config_dir, 'foo', 'blah.json')
+        write_json(path, {'groups': {'all': ['@nrc']}})
+        touch_later(path)
+        assert watcher.check()
+        assert watcher.registry.generation == 1
+        assert watcher.registry.repo_config('foo/blah').groups['all'] == {'nrc'}
+        # Snapshots taken before the reload are left untouched.
+        assert old.repo_config('foo/blah').groups['all'] == {'pnkfelix'}
+
+    def test_watcher_new_repo(self):
+        watcher = ConfigWatcher(self.config_dir)
+        write_json(
+            os.path.join(self.config_dir, 'foo', 'new.json'),
+            {'groups': {'all': []}},
+        )
+        assert watcher.check()
+        assert 'foo/new' in watcher.registry
+
+    def test_watcher_invalid_config(self):
+        watcher = ConfigWatcher(self.config_dir)
+        path = os.path.join(self.config_dir, 'foo', 'blah.json')
+        with open(path, 'w') as f:
+            f.write('{ not json')
+        touch_later(path)
+        assert not watcher.check()
+        assert watcher.registry.generation == 0
+        assert 'foo/blah' in watcher.registry
+
+
+@pytest.mark.unit
+@pytest.mark.hermetic
+class TestRepoConfig(object):
+    def test_nested_groups(self):
+        config = RepoConfig(
+            fakes.get_repo_configs()['nested_groups'],
+            fakes.get_global_configs()['base'],
+        )
+        assert config.groups == {
+            'all': frozenset(),
+            'a': frozenset(['pnkfelix']),
+            'b': frozenset(['nrc']),
+            'c': frozenset(['pnkfelix', 'nrc']),
+            'core': frozenset(['alexcrichton']),
+        }
+        assert config.dirs == {
+            'src/librustc_typeck': frozenset(['pnkfelix', 'nrc']),
+        }
+
+    def test_circular_groups(self):
+        config = RepoConfig(
+            {'groups': {'all': ['b'], 'a': ['b', '@x'], 'b': ['a', 'all']}},
+            {'groups': {}},
+        )
+        assert config.groups['all'] == frozenset(['x'])
+        assert config.groups['a'] == frozenset(['x'])
+        assert config.groups['b'] == frozenset(['x'])
+
+    def test_mapping(self):
+        config = RepoConfig(
+            fakes.get_repo_configs()['individuals_no_dirs_labels'],
+            {'groups': {}},
+        )
+        assert config['new_pr_labels'] == ('a', 'b')
+        assert config.get('contributing') is None
+        assert set(config) == {'groups', 'dirs', 'new_pr_labels'}
+
+    def test_global_group_overlap(self):
+        with pytest.raises(AssertionError):
+            ConfigRegistry(
+                {'foo/blah': fakes.get_repo_configs()['individuals_no_dirs']},
+                fakes.get_global_configs()['has_all'],
+            )
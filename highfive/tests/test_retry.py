@@ -0,0 +1,35 @@
+from urllib.error import HTTPError
+
+import pytest
+import requests
+
+from highfive.retry import RetryPolicy, is_transient
+from highfive.stats import stats
+
+
+@pytest.mark.unit
+@pytest.mark.hermetic
+class TestRetryPolicy(object):
+    def test_is_transient(self):
+        assert is_transient(HTTPError(None, 502, None, None, None))
+        assert is_transient(HTTPError(None, 503, None, None, None))
+        assert not is_transient(HTTPError(None, 422, None, None, None))
+        assert is_transient(requests.ConnectionError())
+        assert is_transient(requests.ConnectTimeout())
+        assert not is_transient(requests.ReadTimeout())
+        assert is_transient(requests.ReadTimeout(), timeouts=True)
+        assert not is_transient(ValueError())
+
+    def test_delay(self):
+        policy = RetryPolicy(base_delay=1, max_delay=5)
+        for attempt, delay in enumerate([1, 2, 4, 5, 5]):
+            assert delay / 2 <= policy.delay(attempt) <= delay
+
+    def test_wait(self):
+        sleeps = []
+        policy = RetryPolicy(base_delay=1, sleep=sleeps.append)
+        retries = stats.get('retry.test')
+        policy.wait(1, 'test')
+        assert len(sleeps) == 1
+        assert 1 <= sleeps[0] <= 2
+        assert stats.get('retry.test') == retries + 1
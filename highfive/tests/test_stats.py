@@ -0,0 +1,31 @@
+import pytest
+
+from highfive.stats import Stats
+
+
+@pytest.mark.unit
+@pytest.mark.hermetic
+class TestStats(object):
+    def test_counters(self):
+        stats = Stats()
+        stats.incr('a')
+        stats.incr('a', 2)
+        stats.set('b', 7)
+        assert stats.get('a') == 3
+        assert stats.get('missing') == 0
+        assert stats.snapshot() == {'a': 3, 'b': 7}
+
+    def test_gauges(self):
+        stats = Stats()
+        values = [1]
+        stats.gauge('g', lambda: values[-1])
+        assert stats.snapshot() == {'g': 1}
+        values.append(5)
+        assert stats.get('g') == 5
+
+    def test_reset(self):
+        stats = Stats()
+        stats.incr('a')
+        stats.gauge('g', lambda: 1)
+        stats.reset()
+        assert stats.snapshot() == {}
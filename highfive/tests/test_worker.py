@@ -0,0 +1,124 @@
+import threading
+
+import pytest
+
+from highfive.stats import stats
+from highfive.worker import QueueFull, WorkerPool
+
+
+@pytest.mark.unit
+@pytest.mark.hermetic
+class TestWorkerPool(object):
+    def test_run(self):
+        completed = stats.get('worker.jobs.completed')
+        pool = WorkerPool(workers=2)
+        pool.start()
+        results = []
+        for i in range(5):
+            pool.submit(results.append, i)
+        pool.join()
+        assert sorted(results) == [0, 1, 2, 3, 4]
+        assert stats.get('worker.jobs.completed') == completed + 5
+        assert stats.get('worker.queue.depth') == 0
+
+    def test_failure(self, capsys):
+        failed = stats.get('worker.jobs.failed')
+        completed = stats.get('worker.jobs.completed')
+        pool = WorkerPool(workers=1)
+        pool.start()
+
+        def fail():
+            raise ValueError('job failed')
+
+        results = []
+        pool.submit(fail)
+        pool.submit(results.append, 1)
+        pool.join()
+        # The worker keeps running the other jobs.
+        assert results == [1]
+        assert stats.get('worker.jobs.failed') == failed + 1
+        assert stats.get('worker.jobs.completed') == completed + 2
+        assert 'job failed' in capsys.readouterr().out
+
+    def test_queue_full(self):
+        rejected = stats.get('worker.jobs.rejected')
+        pool = WorkerPool(workers=1, max_queue=1)
+        pool.start()
+        running = threading.Event()
+        release = threading.Event()
+
+        def block():
+            running.set()
+            release.wait()
+
+        pool.submit(block)
+        running.wait()
+        pool.submit(block)
+        assert stats.get('worker.queue.depth') == 1
+        with pytest.raises(QueueFull):
+            pool.submit(block)
+        assert stats.get('worker.jobs.rejected') == rejected + 1
+        release.set()
+        pool.join()
+
+    def test_latency(self):
+        waited = stats.get('worker.jobs.wait_seconds')
+        ran = stats.get('worker.jobs.run_seconds')
+        now = [0]
+        pool = WorkerPool(workers=1, clock=lambda: now[0])
+
+        def job():
+            now[0] += 3
+
+        pool.submit(job)
+        now[0] = 2
+        pool.start()
+        pool.join()
+        assert stats.get('worker.jobs.wait_seconds') == waited + 2
+        assert stats.get('worker.jobs.run_seconds') == ran + 3
+        assert stats.get('worker.jobs.last_latency') == 5
+
+    def test_keys(self):
+        pool = WorkerPool(workers=4)
+        results = []
+        lock = threading.Lock()
+
+        def job(key, i):
+            with lock:
+                results.append((key, i))
+
+        for i in range(20):
+            for key in ('a', 'b', 'c'):
+                pool.submit(job, key, i, key=key)
+        pool.start()
+        pool.join()
+        # The jobs of every key ran in order.
+        for key in ('a', 'b', 'c'):
+            assert [i for (k, i) in results if k == key] == list(range(20))
+
+    def test_keys_serial(self):
+        contended = stats.get('worker.lanes.contended')
+        pool = WorkerPool(workers=2)
+        pool.start()
+        running = threading.Event()
+        release = threading.Event()
+        results = []
+
+        def block():
+            running.set()
+            release.wait()
+            results.append('first')
+
+        # Integers hash to themselves: keys 0 and 2 share the first lane.
+        pool.submit(block, key=0)
+        running.wait()
+        pool.submit(results.append, 'second', key=2)
+        assert stats.get('worker.lanes.contended') == contended + 1
+        # Jobs with other keys are not blocked.
+        other = threading.Event()
+        pool.submit(other.set, key=1)
+        assert other.wait(5)
+        assert results == []
+        release.set()
+        pool.join()
+        assert results == ['first', 'second']
@@ -0,0 +1,101 @@
+import queue
+import threading
+import time
+import traceback
+
+from .stats import stats
+
+
+class QueueFull(Exception):
+    pass
+
+
+class WorkerPool(object):
+    """Runs jobs in `workers` background threads, so that webhooks can be
+    acknowledged before they are handled.
+
+    Every worker runs the jobs of its own queue (its lane) in order. Jobs
+    submitted with the same `key` (e.g. the events of a PR) go to the lane
+    the key hashes to, so they run one at a time and in the order they were
+    submitted, while jobs with other keys run in parallel in the other
+    lanes. Jobs without a key go to the least loaded lane.
+
+    At most `max_queue` jobs wait for a worker: submitting more raises
+    `QueueFull`. Jobs raising an exception are reported and counted in the
+    `worker.jobs.failed` stat. The `/stats` endpoint reports the
+    `worker.queue.depth` (and the `worker.lanes.depth` of every lane), the
+    number of `worker.jobs.completed`, and the time spent by jobs waiting in
+    the queue (`worker.jobs.wait_seconds`) and running
+    (`worker.jobs.run_seconds`), along with the latency of the last job
+    (`worker.jobs.last_latency`). Keyed jobs queued behind another job while
+    a lane was idle are counted in `worker.lanes.contended`.
+    """
+    def __init__(self, workers=4, max_queue=100, clock=time.monotonic):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.clock = clock
+        self.lanes = [queue.Queue() for _ in range(workers)]
+        self._lock = threading.Lock()
+        # The number of jobs queued and running in every lane.
+        self._load = [0] * workers
+        self._threads = []
+
+        stats.gauge('worker.queue.depth', self.depth)
+        stats.gauge(
+            'worker.lanes.depth', lambda: [lane.qsize() for lane in self.lanes]
+        )
+
+    def depth(self):
+        return sum(lane.qsize() for lane in self.lanes)
+
+    def submit(self, func, *args, key=None):
+        """Queue `func(*args)` to be run by a worker, after the jobs
+        submitted before with the same `key`."""
+        with self._lock:
+            if self.depth() >= self.max_queue:
+                stats.incr('worker.jobs.rejected')
+                raise QueueFull()
+            if key is None:
+                lane = self._load.index(min(self._load))
+            else:
+                lane = hash(key) % self.workers
+                if self._load[lane] and 0 in self._load:
+                    stats.incr('worker.lanes.contended')
+            self._load[lane] += 1
+            self.lanes[lane].put((func, args, self.clock()))
+
+    def start(self):
+        """Start the worker threads."""
+        while len(self._threads) < self.workers:
+            lane = len(self._threads)
+            thread = threading.Thread(
+                target=self._run, args=(lane,), name='worker-%d' % lane,
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def join(self):
+        """Wait until every queued job has been run."""
+        for lane in self.lanes:
+            lane.join()
+
+    def _run(self, lane):
+        jobs = self.lanes[lane]
+        while True:
+            func, args, queued = jobs.get()
+            started = self.clock()
+            try:
+                func(*args)
+            except Exception:
+                stats.incr('worker.jobs.failed')
+                print(traceback.format_exc())
+            finally:
+                finished = self.clock()
+                stats.incr('worker.jobs.completed')
+                stats.incr('worker.jobs.wait_seconds', started - queued)
+                stats.incr('worker.jobs.run_seconds', finished - started)
+                stats.set('worker.jobs.last_latency', finished - queued)
+                with self._lock:
+                    self._load[lane] -= 1
+                jobs.task_done()
@@ -12,6 +12,7 @@ setup(
     packages=[
         'highfive',
     ],
+    python_requires='>=3.9',
     install_requires=[
         'click',
         'flask',
@@ -19,6 +20,9 @@ setup(
         'requests',
         'waitress',
     ],
+    extras_require={
+        'brotli': ['brotli'],
+    },
     entry_points={
         'console_scripts': [
             'highfive=highfive.app:main',
@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 
+import json
 import os
-import requests
+import urllib.error
+
+from highfive.client import client
 
 #
 # This script goes over all the repositories in the highfive configuration and
@@ -21,6 +24,7 @@ CURRENT_URL = "https://highfive.infra.rust-lang.org/webhook"
 # Events the current instance requires
 EVENTS = [
     "issue_comment",
+    "member",
     "pull_request",
 ]
 
@@ -28,16 +32,17 @@ EVENTS = [
 class GitHubApi:
     def __init__(self, token):
         self.token = token
-        self.client = requests.Session()
 
     def req(self, method, url, *args, data=None):
         """Make a request against the GitHub API"""
         if not url.startswith("https://"):
             url = "https://api.github.com/%s" % url
         url = url % args
-        resp = self.client.request(method, url, json=data, headers={
-            "Authorization": "token %s" % self.token,
-        })
+        try:
+            resp = client.request(method, url, self.token, data)
+        except urllib.error.HTTPError as e:
+            # Errors are reported through the `message` of the body.
+            return json.load(e)
         return resp.json()
 
 